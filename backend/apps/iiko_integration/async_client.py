@@ -0,0 +1,235 @@
+"""
+Асинхронный клиент iiko (httpx) и ограниченный по параллельности раннер.
+
+Периодические задачи делают один запрос на организацию; последовательный обход
+занимает N × latency и один медленный тенант задерживает всех. Здесь запросы
+всех организаций идут параллельно (не более IIKO_ASYNC_CONCURRENCY одновременно),
+а запись в БД выполняется после, в синхронном коде.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, TypeVar
+
+import httpx
+from django.conf import settings
+
+from . import token_store
+from .client import IikoAPIException, IikoClient, RETRYABLE_STATUS_CODES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class AsyncIikoClient:
+    """Асинхронный аналог IikoClient с тем же набором методов."""
+    BASE_URL = IikoClient.BASE_URL
+    BASE_URL_V2 = IikoClient.BASE_URL_V2
+
+    def __init__(self, api_key: str, http: httpx.AsyncClient):
+        self.api_key = api_key
+        self.token = None
+        self.http = http
+        self.max_retries = getattr(settings, 'IIKO_HTTP_MAX_RETRIES', 2)
+        self.backoff_factor = getattr(settings, 'IIKO_HTTP_BACKOFF_FACTOR', 0.5)
+        # Клиент создаётся внутри цикла событий раннера, поэтому lock привязан к нему
+        self._auth_lock = asyncio.Lock()
+
+    async def authenticate(self):
+        """Authenticate and get access token (всегда запрашивает новый токен и кладёт его в общий кэш)."""
+        url = f"{self.BASE_URL}/access_token"
+        try:
+            response = await self.http.post(url, json={"apiLogin": self.api_key})
+            response.raise_for_status()
+            self.token = response.json().get("token")
+        except httpx.HTTPError as e:
+            logger.error(f"Failed to authenticate with iiko: {e}")
+            raise IikoAPIException(f"Authentication failed: {e}")
+        if not self.token:
+            raise IikoAPIException("No token received from iiko")
+        token_store.set_token(self.api_key, self.token)
+
+    async def get_headers(self) -> Dict[str, str]:
+        if not self.token:
+            async with self._auth_lock:
+                if not self.token:
+                    self.token = token_store.get_token(self.api_key)
+                if not self.token:
+                    await self.authenticate()
+        return {"Authorization": f"Bearer {self.token}"}
+
+    async def _refresh_token(self, stale_token: Optional[str]):
+        """Обновление токена после 401 под той же межпроцессной блокировкой, что и у IikoClient."""
+        async with self._auth_lock:
+            if self.token and self.token != stale_token:
+                return  # уже обновил соседний запрос этого клиента
+            loop = asyncio.get_running_loop()
+            owner = token_store.new_lock_owner()
+            deadline = loop.time() + token_store.lock_wait_seconds()
+            while True:
+                acquired = token_store.acquire_refresh_lock(self.api_key, owner)
+                if acquired is None or acquired or loop.time() >= deadline:
+                    break
+                await asyncio.sleep(token_store.LOCK_POLL_INTERVAL)
+            try:
+                cached = token_store.get_token(self.api_key)
+                if cached and cached != stale_token:
+                    self.token = cached
+                    return
+                token_store.invalidate(self.api_key, stale_token)
+                await self.authenticate()
+            finally:
+                if acquired:
+                    token_store.release_refresh_lock(self.api_key, owner)
+
+    async def _post_once(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Один POST с однократным обновлением токена при 401."""
+        response = await self.http.post(url, json=payload, headers=await self.get_headers())
+        if response.status_code == 401:
+            logger.info("Token expired, re-authenticating...")
+            await self._refresh_token(self.token)
+            response = await self.http.post(url, json=payload, headers=await self.get_headers())
+
+        if response.is_error:
+            logger.error(f"IIKO API ERROR: {response.status_code} | Response: {response.text}")
+
+        response.raise_for_status()
+        return response.json()
+
+    async def _post(self, url: str, payload: Dict[str, Any], idempotent: bool = True) -> Dict[str, Any]:
+        """Те же правила повторов, что у IikoClient._post: только для запросов на чтение."""
+        retries = self.max_retries if idempotent else 0
+        last_error = None
+        for attempt in range(retries + 1):
+            try:
+                return await self._post_once(url, payload)
+            except httpx.TransportError as e:
+                last_error = e
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code not in RETRYABLE_STATUS_CODES:
+                    raise self._api_exception(url, e)
+                last_error = e
+            except httpx.HTTPError as e:
+                raise self._api_exception(url, e)
+
+            if attempt < retries:
+                delay = self.backoff_factor * (2 ** attempt)
+                logger.warning(
+                    "POST %s: попытка %s/%s не удалась (%s), повтор через %.1f с",
+                    url, attempt + 1, retries + 1, last_error, delay,
+                )
+                await asyncio.sleep(delay)
+
+        raise self._api_exception(url, last_error)
+
+    @staticmethod
+    def _api_exception(url: str, e: httpx.HTTPError) -> IikoAPIException:
+        error_msg = f"POST {url} failed: {e}"
+        if isinstance(e, httpx.HTTPStatusError):
+            error_msg += f" Response: {e.response.text}"
+        return IikoAPIException(error_msg)
+
+    async def get_organizations(self) -> Dict[str, Any]:
+        return await self._post(f"{self.BASE_URL}/organizations", {})
+
+    async def get_menu(self, organization_id: str, start_revision: int = 0) -> Dict[str, Any]:
+        payload = {"organizationId": organization_id, "startRevision": start_revision}
+        return await self._post(f"{self.BASE_URL}/nomenclature", payload)
+
+    async def get_external_menus(self, organization_ids: List[str]) -> Dict[str, Any]:
+        return await self._post(f"{self.BASE_URL_V2}/menu", {"organizationIds": organization_ids})
+
+    async def get_external_menu_by_id(
+        self,
+        organization_ids: List[str],
+        external_menu_id: str,
+        price_category_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        payload = {
+            "organizationIds": list(organization_ids),
+            "externalMenuId": str(external_menu_id),
+        }
+        if price_category_id:
+            payload["priceCategoryId"] = str(price_category_id)
+        return await self._post(f"{self.BASE_URL_V2}/menu/by_id", payload)
+
+    async def get_terminal_groups(self, organization_ids: List[str]) -> Dict[str, Any]:
+        return await self._post(f"{self.BASE_URL}/terminal_groups", {"organizationIds": organization_ids})
+
+    async def create_delivery_order(self, data: Dict) -> Dict:
+        return await self._post(f"{self.BASE_URL}/deliveries/create", data, idempotent=False)
+
+    async def get_order_status(self, org_id: str, order_id: str) -> Dict:
+        payload = {
+            "organizationIds": [org_id],
+            "organizationId": org_id,
+            "orderIds": [order_id],
+        }
+        return await self._post(f"{self.BASE_URL}/deliveries/by_id", payload)
+
+    async def get_creation_status(self, org_id: str, correlation_id: str) -> Dict:
+        payload = {"organizationId": org_id, "correlationId": correlation_id}
+        return await self._post(f"{self.BASE_URL}/commands/status", payload)
+
+    async def get_payment_types(self, organization_ids: List[str]) -> Dict[str, Any]:
+        return await self._post(f"{self.BASE_URL}/payment_types", {"organizationIds": organization_ids})
+
+    async def get_discounts(self, organization_ids: List[str]) -> Dict[str, Any]:
+        payload = {"organizationIds": [str(oid) for oid in organization_ids]}
+        return await self._post(f"{self.BASE_URL}/discounts", payload)
+
+
+def build_async_http_client(concurrency: int) -> httpx.AsyncClient:
+    connect_timeout, read_timeout = IikoClient.REQUEST_TIMEOUT
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        headers={'Accept': 'application/json'},
+    )
+
+
+async def gather_bounded(jobs: Iterable[Callable[[], Awaitable[T]]], limit: int) -> List[Any]:
+    """
+    Выполняет фабрики корутин не более limit одновременно.
+    Порядок результатов совпадает с порядком jobs; исключение одной задачи
+    возвращается на её месте и не отменяет остальные.
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(job):
+        async with semaphore:
+            return await job()
+
+    return await asyncio.gather(*(run(job) for job in jobs), return_exceptions=True)
+
+
+def fetch_for_organizations(
+    organizations: Iterable,
+    fetch: Callable[[AsyncIikoClient, Any], Awaitable[T]],
+    concurrency: Optional[int] = None,
+) -> Dict[Any, Any]:
+    """
+    Параллельно выполняет fetch(client, organization) для каждой организации.
+    Клиент общий на API-ключ (один токен на ключ). Возвращает {organization.pk: результат
+    или исключение}; разбор результатов и запись в БД — на стороне вызывающего.
+    Вызывается из синхронного кода (celery-задачи).
+    """
+    organizations = [org for org in organizations if org.api_key]
+    if not organizations:
+        return {}
+    limit = concurrency or getattr(settings, 'IIKO_ASYNC_CONCURRENCY', 8)
+
+    async def main():
+        async with build_async_http_client(limit) as http:
+            clients = {}
+            for org in organizations:
+                if org.api_key not in clients:
+                    clients[org.api_key] = AsyncIikoClient(org.api_key, http)
+            jobs = [
+                (lambda org=org: fetch(clients[org.api_key], org))
+                for org in organizations
+            ]
+            results = await gather_bounded(jobs, limit)
+        return {org.pk: result for org, result in zip(organizations, results)}
+
+    return asyncio.run(main())
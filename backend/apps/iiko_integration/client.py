@@ -1,9 +1,55 @@
 import logging
+import os
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
 from typing import Dict, Any, Optional, List
 
+from . import token_store
+
 logger = logging.getLogger(__name__)
 
+# Ответы, при которых запрос на чтение имеет смысл повторить (перегрузка / временный сбой iiko)
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+_session_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+
+
+def _build_http_session() -> requests.Session:
+    pool_size = getattr(settings, 'IIKO_HTTP_POOL_SIZE', 10)
+    session = requests.Session()
+    # Повторы делаем сами в IikoClient._post: urllib3 не отличает POST-чтение от POST-создания заказа
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({
+        'Accept': 'application/json',
+        'Accept-Encoding': 'gzip, deflate',
+    })
+    return session
+
+
+def get_http_session() -> requests.Session:
+    """
+    Keep-alive сессия с пулом соединений, одна на процесс.
+    Привязана к pid: после fork (celery prefork, gunicorn) дочерний процесс
+    создаёт свой пул, а не делит сокеты с родителем.
+    """
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            _session = _build_http_session()
+            _session_pid = pid
+        return _session
+
+
 class IikoAPIException(Exception):
     """Exception raised for errors in iiko API."""
     pass
@@ -14,15 +60,18 @@ class IikoClient:
     # Таймауты для всех запросов (connect, read). Предотвращают зависание воркеров при сбоях iiko.
     REQUEST_TIMEOUT = (10, 45)  # (connect, read) в секундах
 
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, session: Optional[requests.Session] = None):
         self.api_key = api_key
         self.token = None
+        self.session = session or get_http_session()
+        self.max_retries = getattr(settings, 'IIKO_HTTP_MAX_RETRIES', 2)
+        self.backoff_factor = getattr(settings, 'IIKO_HTTP_BACKOFF_FACTOR', 0.5)
 
     def authenticate(self):
-        """Authenticate and get access token."""
+        """Authenticate and get access token (всегда запрашивает новый токен и кладёт его в общий кэш)."""
         url = f"{self.BASE_URL}/access_token"
         try:
-            response = requests.post(
+            response = self.session.post(
                 url, json={"apiLogin": self.api_key}, timeout=self.REQUEST_TIMEOUT
             )
             response.raise_for_status()
@@ -33,54 +82,97 @@ class IikoClient:
         except requests.RequestException as e:
             logger.error(f"Failed to authenticate with iiko: {e}")
             raise IikoAPIException(f"Authentication failed: {e}")
+        token_store.set_token(self.api_key, self.token)
 
     def get_headers(self) -> Dict[str, str]:
+        if not self.token:
+            self.token = token_store.get_token(self.api_key)
         if not self.token:
             self.authenticate()
         return {"Authorization": f"Bearer {self.token}"}
 
-    def _post(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-        """Generic POST helper with re-auth logic."""
-        try:
-            response = requests.post(
+    def _refresh_token(self, stale_token: Optional[str]):
+        """
+        Обновление токена после 401. Под межпроцессной блокировкой: первый воркер
+        получает новый токен, остальные дожидаются его и берут из кэша, а не
+        идут в /access_token одновременно.
+        """
+        with token_store.refresh_lock(self.api_key):
+            cached = token_store.get_token(self.api_key)
+            if cached and cached != stale_token:
+                self.token = cached
+                return
+            token_store.invalidate(self.api_key, stale_token)
+            self.authenticate()
+
+    def _post_once(self, url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Один POST с однократным обновлением токена при 401."""
+        response = self.session.post(
+            url, json=payload, headers=self.get_headers(), timeout=self.REQUEST_TIMEOUT
+        )
+        if response.status_code == 401:
+            logger.info("Token expired, re-authenticating...")
+            self._refresh_token(self.token)
+            response = self.session.post(
                 url, json=payload, headers=self.get_headers(), timeout=self.REQUEST_TIMEOUT
             )
-            
-            if not response.ok:
-                logger.error(f"IIKO API ERROR: {response.status_code} | Response: {response.text}")
-            
-            response.raise_for_status()
-            data = response.json()
-            return data
-        except requests.RequestException as e:
-            if e.response and e.response.status_code == 401:
-                logger.info("Token expired, re-authenticating...")
-                self.token = None
-                try:
-                    response = requests.post(
-                        url, json=payload, headers=self.get_headers(), timeout=self.REQUEST_TIMEOUT
-                    )
-                    response.raise_for_status()
-                    return response.json()
-                except requests.RequestException as retry_e:
-                     raise IikoAPIException(f"POST {url} failed after retry: {retry_e}")
-            
-            error_msg = f"POST {url} failed: {e}"
-            if e.response is not None:
-                error_msg += f" Response: {e.response.text}"
-            raise IikoAPIException(error_msg)
+
+        if not response.ok:
+            logger.error(f"IIKO API ERROR: {response.status_code} | Response: {response.text}")
+
+        response.raise_for_status()
+        return response.json()
+
+    def _post(self, url: str, payload: Dict[str, Any], idempotent: bool = True) -> Dict[str, Any]:
+        """
+        Generic POST helper with re-auth logic.
+        idempotent=True — запрос на чтение: при сетевой ошибке или 429/5xx повторяется
+        до IIKO_HTTP_MAX_RETRIES раз с экспоненциальной задержкой. Создание заказа
+        (idempotent=False) не повторяется, чтобы не задвоить заказ в iiko.
+        """
+        retries = self.max_retries if idempotent else 0
+        last_error = None
+        for attempt in range(retries + 1):
+            try:
+                return self._post_once(url, payload)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                last_error = e
+            except requests.HTTPError as e:
+                if e.response is None or e.response.status_code not in RETRYABLE_STATUS_CODES:
+                    raise self._api_exception(url, e)
+                last_error = e
+            except requests.RequestException as e:
+                raise self._api_exception(url, e)
+
+            if attempt < retries:
+                delay = self.backoff_factor * (2 ** attempt)
+                logger.warning(
+                    "POST %s: попытка %s/%s не удалась (%s), повтор через %.1f с",
+                    url, attempt + 1, retries + 1, last_error, delay,
+                )
+                time.sleep(delay)
+
+        raise self._api_exception(url, last_error)
+
+    @staticmethod
+    def _api_exception(url: str, e: requests.RequestException) -> IikoAPIException:
+        error_msg = f"POST {url} failed: {e}"
+        if getattr(e, 'response', None) is not None:
+            error_msg += f" Response: {e.response.text}"
+        return IikoAPIException(error_msg)
 
     def get_organizations(self) -> Dict[str, Any]:
         """Fetch list of organizations available for this API key."""
         url = f"{self.BASE_URL}/organizations"
         return self._post(url, {})
 
-    def get_menu(self, organization_id: str) -> Dict[str, Any]:
-        """Fetch nomenclature (internal menu) for the organization."""
+    def get_menu(self, organization_id: str, start_revision: int = 0) -> Dict[str, Any]:
+        """Fetch nomenclature (internal menu) for the organization.
+        start_revision > 0: iiko возвращает группы/продукты только если есть ревизия новее."""
         url = f"{self.BASE_URL}/nomenclature"
         payload = {
             "organizationId": organization_id,
-            "startRevision": 0
+            "startRevision": start_revision
         }
         return self._post(url, payload)
 
@@ -121,15 +213,19 @@ class IikoClient:
     def create_delivery_order(self, data: Dict) -> Dict:
         """Create a delivery order in iiko Cloud."""
         url = f"{self.BASE_URL}/deliveries/create"
-        return self._post(url, data)
+        return self._post(url, data, idempotent=False)
 
     def get_order_status(self, org_id: str, order_id: str) -> Dict:
         """Get order status from iiko Cloud."""
+        return self.get_orders_by_ids(org_id, [order_id])
+
+    def get_orders_by_ids(self, org_id: str, order_ids: List[str]) -> Dict:
+        """Get several delivery orders from iiko Cloud in one call (deliveries/by_id)."""
         url = f"{self.BASE_URL}/deliveries/by_id"
         payload = {
             "organizationIds": [org_id],
             "organizationId": org_id, # Added singular for compatibility
-            "orderIds": [order_id]
+            "orderIds": [str(order_id) for order_id in order_ids]
         }
         return self._post(url, payload)
 
@@ -0,0 +1,98 @@
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from django.core.management.base import BaseCommand
+
+from apps.iiko_integration.client import IikoClient
+
+
+class _FakeIikoHandler(BaseHTTPRequestHandler):
+    """Минимальный iiko: access_token и stop_lists, HTTP/1.1 keep-alive."""
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело пишутся отдельно: без TCP_NODELAY keep-alive упирается в delayed ACK (~40 мс)
+    disable_nagle_algorithm = True
+    latency = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        if self.latency:
+            time.sleep(self.latency)
+        if self.path.endswith('/access_token'):
+            body = {'token': 'bench-token'}
+        else:
+            body = {'terminalGroupStopLists': []}
+        raw = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark IikoClient: new connection per call vs pooled keep-alive session (local fake iiko)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Number of calls per mode')
+        parser.add_argument('--latency-ms', type=float, default=0.0, help='Simulated server processing time')
+
+    def handle(self, *args, **options):
+        n = options['requests']
+        _FakeIikoHandler.latency = options['latency_ms'] / 1000.0
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _FakeIikoHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        base = f'http://127.0.0.1:{server.server_address[1]}'
+
+        class LocalClient(IikoClient):
+            BASE_URL = f'{base}/api/1'
+            BASE_URL_V2 = f'{base}/api/2'
+
+        try:
+            # Без пула: как прежний requests.post — новое соединение на каждый вызов
+            cold = []
+            for _ in range(n):
+                session = requests.Session()
+                client = LocalClient('bench', session=session)
+                client.token = 'bench-token'
+                started = time.perf_counter()
+                client.get_stop_lists(['org'])
+                cold.append(time.perf_counter() - started)
+                session.close()
+
+            # Пул: одна keep-alive сессия на процесс
+            client = LocalClient('bench', session=requests.Session())
+            client.get_stop_lists(['org'])  # прогрев: токен + соединение
+            warm = []
+            for _ in range(n):
+                started = time.perf_counter()
+                client.get_stop_lists(['org'])
+                warm.append(time.perf_counter() - started)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        def fmt(samples):
+            ordered = sorted(samples)
+            p95 = ordered[int(len(ordered) * 0.95) - 1]
+            return (
+                f'mean={statistics.mean(samples) * 1000:.3f} ms  '
+                f'p50={statistics.median(samples) * 1000:.3f} ms  '
+                f'p95={p95 * 1000:.3f} ms'
+            )
+
+        saved = (statistics.mean(cold) - statistics.mean(warm)) * 1000
+        self.stdout.write(f'new connection per call: {fmt(cold)}')
+        self.stdout.write(f'pooled keep-alive:       {fmt(warm)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'saved per call: {saved:.3f} ms (local plain HTTP; TLS to api-ru.iiko.services saves a full handshake on top)'
+        ))
@@ -1,14 +1,44 @@
+import hashlib
+import json
 import logging
 import uuid
-from typing import Dict, Any, List, Optional
-from django.db import transaction
+from decimal import Decimal, InvalidOperation
+from typing import Callable, Dict, Any, List, Optional
+from django.db import models, transaction
 from django.utils import timezone
 from apps.products.models import Menu, ProductCategory, Product, Modifier, StopList
+from apps.products.menu_versions import PREVIOUS_MENU_KEY, activate_menu, get_build_target
+from apps.products.catalog_cache import invalidate_catalog
+from apps.products.catalog_events import publish_stop_list_delta
+from apps.products.stop_list_index import update_terminal_index
 from apps.organizations.models import Organization, Terminal
 from apps.iiko_integration.client import IikoClient, IikoAPIException
 
 logger = logging.getLogger(__name__)
 
+# Размер пачки для bulk_create / bulk_update при синхронизации меню
+BULK_BATCH_SIZE = 500
+
+CATEGORY_UPDATE_FIELDS = ['subgroup_name', 'order_index', 'outer_data', 'content_hash', 'updated_at']
+PRODUCT_UPDATE_FIELDS = [
+    'product_name', 'product_code', 'price', 'description', 'measure_unit', 'organization',
+    'category', 'parent_group', 'order_index', 'image_url', 'type', 'outer_data',
+    'has_modifiers', 'is_available', 'updated_from_iiko', 'content_hash', 'updated_at',
+]
+# Не входят в отпечаток: меняются при каждой синхронизации или выставляются отдельно
+FINGERPRINT_EXCLUDED_FIELDS = frozenset({'updated_from_iiko', 'is_available', 'content_hash'})
+# Сколько названий продуктов класть в отчёт синхронизации по каждому списку
+SYNC_REPORT_MAX_ITEMS = 100
+
+STOP_LIST_UPDATE_FIELDS = ['product_name', 'balance', 'organization', 'is_auto_added', 'updated_at']
+# StopList.balance — DecimalField(decimal_places=2): сравниваем в той же точности, что хранится
+STOP_LIST_BALANCE_QUANT = Decimal('0.01')
+
+MODIFIER_UPDATE_FIELDS = [
+    'modifier_name', 'min_amount', 'max_amount', 'is_required', 'price',
+    'is_available', 'updated_from_iiko', 'updated_at',
+]
+
 
 def _normalize_iiko_product_uuid(value) -> Optional[uuid.UUID]:
     if value is None:
@@ -19,10 +49,97 @@ def _normalize_iiko_product_uuid(value) -> Optional[uuid.UUID]:
         return None
 
 
+def _fingerprint(values: Dict[str, Any], extra: Any = None) -> str:
+    """
+    Стабильный отпечаток строки меню: sha256 от значений, которые синхронизация пишет
+    в строку (включая outer_data), без служебных полей. Связанные объекты — по pk.
+    """
+    payload = {
+        field: (value.pk if isinstance(value, models.Model) else value)
+        for field, value in values.items()
+        if field not in FINGERPRINT_EXCLUDED_FIELDS
+    }
+    if extra is not None:
+        payload['_extra'] = extra
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def _report_summary(report: Dict[str, Any]) -> str:
+    return ', '.join(f'{k}={v}' for k, v in report.items() if isinstance(v, int))
+
+
+def _uuid_key(value) -> Optional[str]:
+    """Каноничный строковый ключ UUID из iiko (для словарей предзагрузки)."""
+    normalized = _normalize_iiko_product_uuid(value)
+    return str(normalized) if normalized else None
+
+
 class MenuSyncService:
-    def sync_menu(self, organization: Organization, menu_data: Dict[str, Any]):
+    # Ключи Menu.metadata для инкрементальной синхронизации номенклатуры
+    REVISION_KEY = 'nomenclature_revision'
+
+    def __init__(self, progress: Optional[Callable[[str, int, int], None]] = None):
+        # progress(phase, processed, total) — для фонового импорта (apps.products.menu_import)
+        self.progress = progress
+
+    def _report_progress(self, phase: str, processed: int = 0, total: int = 0):
+        if self.progress is None:
+            return
+        try:
+            self.progress(phase, processed, total)
+        except Exception as e:
+            logger.warning(f"Не удалось сохранить прогресс синхронизации меню ({phase}): {e}")
+
+    def _get_nomenclature_menu(self, organization: Organization) -> Menu:
+        # Только меню-номенклатура: у организации может быть и внешнее меню, и тогда
+        # get_or_create(organization=...) падал с MultipleObjectsReturned
+        menu = (
+            Menu.objects.filter(organization=organization, source_type=Menu.SOURCE_NOMENCLATURE)
+            .order_by('created_at')
+            .first()
+        )
+        if menu is None:
+            menu = Menu.objects.create(
+                organization=organization,
+                menu_name=f"Меню {organization.org_name}",
+                source_type=Menu.SOURCE_NOMENCLATURE,
+            )
+        return menu
+
+    def sync_nomenclature(
+        self, organization: Organization, client: IikoClient, full_resync: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Загрузка номенклатуры с учётом ревизии iiko.
+
+        В iiko уходит последняя применённая ревизия (Menu.metadata['nomenclature_revision']);
+        если новее ничего нет, iiko возвращает пустые списки и БД не трогается вовсе.
+        Иначе перезаписываются только группы и продукты с изменившимся отпечатком (content_hash).
+        full_resync=True — запрос с ревизии 0 и полная перезапись меню.
+        """
+        menu = self._get_nomenclature_menu(organization)
+        stored_revision = 0 if full_resync else int((menu.metadata or {}).get(self.REVISION_KEY) or 0)
+        self._report_progress('fetch')
+        menu_data = client.get_menu(organization.iiko_organization_id, start_revision=stored_revision)
+
+        remote_revision = menu_data.get('revision')
+        has_items = bool(menu_data.get('groups') or menu_data.get('products'))
+        if stored_revision and (not has_items or (remote_revision is not None and remote_revision <= stored_revision)):
+            logger.info(
+                "Номенклатура org=%s не изменилась (ревизия %s), синхронизация пропущена",
+                organization.org_name, stored_revision,
+            )
+            return {'status': 'unchanged', 'revision': stored_revision}
+
+        result = self.sync_menu(organization, menu_data, force=full_resync) or {}
+        return {'status': 'full' if full_resync else 'updated', **result}
+
+    def sync_menu(self, organization: Organization, menu_data: Dict[str, Any], force: bool = False):
         """
         Syncs menu data from iiko to local database.
+        Строки, у которых отпечаток данных iiko (content_hash) не изменился, не перезаписываются;
+        force=True — перезаписать все строки (полная пересинхронизация).
         """
         if not menu_data:
             logger.warning("No menu data provided for sync")
@@ -30,24 +147,39 @@ class MenuSyncService:
 
         with transaction.atomic():
             # 1. Ensure a default Menu exists for the organization
-            menu, _ = Menu.objects.get_or_create(
-                organization=organization,
-                defaults={'menu_name': f"Меню {organization.org_name}"}
-            )
+            menu = self._get_nomenclature_menu(organization)
 
             # 2. Process Groups (Categories) - но только те, которые не являются группами модификаторов
             groups = menu_data.get('groups', [])
             products = menu_data.get('products', [])
             # Map for quick lookup of modifier names
             products_map = {p['id']: p for p in products}
-            
+
             # Передаем products для проверки, чтобы не создавать категории из групп модификаторов
-            self._sync_categories(menu, groups, products)
+            self._report_progress('categories', 0, len(groups))
+            report = self._sync_categories(menu, groups, products, force=force)
             
             # 3. Process Products & Modifiers
-            self._sync_products_and_modifiers(menu, organization, products, products_map)
+            self._report_progress('products', 0, len(products))
+            report.update(self._sync_products_and_modifiers(menu, organization, products, products_map, force=force))
+            self._report_progress('deactivate', len(products), len(products))
             seen_ids = self._collect_seen_nomenclature_product_ids(products)
-            self._deactivate_products_not_in_seen(menu, seen_ids)
+            report.update(self._deactivate_products_not_in_seen(menu, seen_ids))
+
+            if menu_data.get('revision') is not None:
+                menu.metadata = {**(menu.metadata or {}), self.REVISION_KEY: menu_data['revision']}
+                menu.save(update_fields=['metadata', 'updated_at'])
+            if menu.is_active:
+                invalidate_catalog(organization.pk, reason='menu')
+                # Новые продукты могут сопоставиться с позициями стоп-листа, которые раньше пропускались
+                if report.get('products_created'):
+                    Terminal.reset_stop_list_digests(organization.pk)
+
+        logger.info(
+            "Номенклатура org=%s, ревизия %s: %s",
+            organization.org_name, menu_data.get('revision'), _report_summary(report),
+        )
+        return {'revision': menu_data.get('revision'), **report}
 
     def _collect_seen_nomenclature_product_ids(self, items: List[Dict]) -> set:
         """ID продуктов Dish/Good из выгрузки номенклатуры (не удалённые в iiko)."""
@@ -62,35 +194,48 @@ class MenuSyncService:
                 seen.add(uid)
         return seen
 
-    def _deactivate_products_not_in_seen(self, menu: Menu, seen_product_ids: set) -> int:
+    def _deactivate_products_not_in_seen(self, menu: Menu, seen_product_ids: set) -> Dict[str, Any]:
         """
         Помечает продукты меню как недоступные (is_available=False), если их нет в последней
         выгрузке. Записи не удаляются — сохраняются ссылки в заказах.
         При пустом seen не трогаем БД (защита от пустой/битой выгрузки).
+        Возвращает часть отчёта: products_deactivated и названия деактивированных.
         """
         if not seen_product_ids:
             logger.warning(
                 "Деактивация продуктов, отсутствующих в выгрузке iiko, пропущена: "
                 "список ID товаров пуст."
             )
-            return 0
+            return {'products_deactivated': 0, 'deactivated_products': []}
         now = timezone.now()
-        qs = Product.objects.filter(menu=menu, is_available=True).exclude(
-            product_id__in=seen_product_ids
+        stale = list(
+            Product.objects.filter(menu=menu, is_available=True)
+            .exclude(product_id__in=seen_product_ids)
+            .values_list('pk', 'product_name')
         )
-        count = qs.update(is_available=False, updated_from_iiko=now)
+        count = 0
+        if stale:
+            count = Product.objects.filter(pk__in=[pk for pk, _ in stale]).update(
+                is_available=False, updated_from_iiko=now
+            )
         if count:
             logger.info(
                 "Деактивировано продуктов (нет в текущей выгрузке iiko): %s, menu_id=%s",
                 count,
                 menu.menu_id,
             )
-        return count
+        return {
+            'products_deactivated': count,
+            'deactivated_products': [name for _, name in stale[:SYNC_REPORT_MAX_ITEMS]],
+        }
 
-    def _sync_categories(self, menu: Menu, groups: List[Dict], products: List[Dict] = None):
+    def _sync_categories(
+        self, menu: Menu, groups: List[Dict], products: List[Dict] = None, force: bool = False
+    ) -> Dict[str, int]:
         """
         Синхронизация категорий из групп iiko.
         Исключает группы модификаторов - создает категории только для групп, в которых есть продукты.
+        Пакетно: существующие категории меню загружаются одним запросом, запись — bulk_create/bulk_update.
         
         Args:
             menu: Меню для привязки категорий
@@ -106,108 +251,100 @@ class MenuSyncService:
         for product in products:
             if product.get('isDeleted'):
                 continue
-            group_id = product.get('groupId')
-            parent_group_id = product.get('parentGroup')
-            if group_id:
-                used_group_ids.add(str(group_id))
-            if parent_group_id:
-                used_group_ids.add(str(parent_group_id))
+            for group_ref in (product.get('groupId'), product.get('parentGroup')):
+                key = _uuid_key(group_ref)
+                if key:
+                    used_group_ids.add(key)
         
-        # 1. Create/Update only groups that are used by products (not modifier groups)
+        # Только группы, которые используются продуктами (не группы модификаторов)
+        rows = {}
+        parents = {}
         for group in groups:
             if group.get('isDeleted'):
                 continue
-            
-            group_id = str(group['id'])
-            
-            # Пропускаем группы модификаторов - они не используются как категории продуктов
+            key = _uuid_key(group.get('id'))
+            if not key:
+                continue
             # Группа модификаторов определяется как группа, в которой нет продуктов
-            if group_id not in used_group_ids:
-                logger.debug(f"Skipping modifier group (no products): {group.get('name')} (ID: {group_id})")
+            if key not in used_group_ids:
+                logger.debug(f"Skipping modifier group (no products): {group.get('name')} (ID: {key})")
                 continue
+            rows[key] = {
+                'subgroup_id': uuid.UUID(key),
+                'menu': menu,
+                'subgroup_name': group['name'],
+                'order_index': group.get('order', 0),
+                'outer_data': group,
+            }
+            parents[key] = _uuid_key(group.get('parentGroup'))
 
-            Category_id = group['id']
-            ProductCategory.objects.update_or_create(
-                subgroup_id=Category_id,
-                menu=menu,
-                defaults={
-                    'subgroup_name': group['name'],
-                    'order_index': group.get('order', 0),
-                    'outer_data': group
-                }
-            )
+        categories = {
+            str(c.subgroup_id): c for c in ProductCategory.objects.filter(menu=menu).defer('outer_data')
+        }
+        synced, created, changed, unchanged = self._bulk_upsert(
+            ProductCategory, rows, categories,
+            unique_fields=['subgroup_id', 'menu'], update_fields=CATEGORY_UPDATE_FIELDS, force=force,
+        )
+        categories.update(synced)
 
-        # 2. Link parents (только для созданных категорий)
-        for group in groups:
-            if group.get('isDeleted'):
-                continue
-            
-            group_id = str(group['id'])
-            # Пропускаем, если группа не была создана как категория
-            if group_id not in used_group_ids:
+        # Связь с родителем — только если родитель тоже категория (не группа модификаторов)
+        relinked = []
+        for key, parent_key in parents.items():
+            if not parent_key or parent_key not in used_group_ids:
                 continue
-            
-            parent_id = group.get('parentGroup')
-            if parent_id:
-                try:
-                    category = ProductCategory.objects.get(subgroup_id=group['id'], menu=menu)
-                    parent = ProductCategory.objects.get(subgroup_id=parent_id, menu=menu)
-                    # Проверяем, что родитель тоже является категорией (не группой модификаторов)
-                    parent_id_str = str(parent_id)
-                    if parent_id_str in used_group_ids:
-                        category.parent = parent
-                        category.save()
-                except ProductCategory.DoesNotExist:
-                    pass
-
-    def _sync_products_and_modifiers(self, menu: Menu, organization: Organization, items: List[Dict], products_map: Dict[str, Dict] = None):
+            category, parent = categories.get(key), categories.get(parent_key)
+            if category and parent and category.parent_id != parent.pk:
+                category.parent = parent
+                relinked.append(category)
+        if relinked:
+            ProductCategory.objects.bulk_update(relinked, ['parent'], batch_size=BULK_BATCH_SIZE)
+
+        return {
+            'categories_created': len(created),
+            'categories_changed': len(changed),
+            'categories_unchanged': unchanged,
+        }
+
+    def _sync_products_and_modifiers(
+        self, menu: Menu, organization: Organization, items: List[Dict], products_map: Dict[str, Dict] = None,
+        force: bool = False,
+    ) -> Dict[str, Any]:
+        """Продукты Dish/Good и их модификаторы из номенклатуры — пакетно (см. _write_products)."""
         if products_map is None:
-             products_map = {p['id']: p for p in items}
+            products_map = {p['id']: p for p in items}
 
+        categories = {str(c.subgroup_id): c for c in ProductCategory.objects.filter(menu=menu)}
+        now = timezone.now()
+        rows = {}
+        modifier_specs = {}
         for item in items:
             if item.get('isDeleted'):
                 continue
-                
-            item_type = item.get('type')
-            
-            # Treat 'Modifier' type items as potential independent products if needed, 
-            # OR just ignore them here and process them only when embedded in Parent.
-            # But sometimes modifiers are sold independently? 
-            # For now, we process Dish/Good as Products.
-            
-            if item_type in ['Dish', 'Good']: 
-                self._sync_product(menu, organization, item, products_map)
-                
-    def _sync_product(self, menu: Menu, organization: Organization, item: Dict, products_map: Dict[str, Dict]):
-        product_id = item['id']
-        category_id = item.get('groupId')
-        parent_group_id = item.get('parentGroup')
-        
-        category = None
-        if category_id:
-            category = ProductCategory.objects.filter(subgroup_id=category_id, menu=menu).first()
-        if not category and parent_group_id:
-            category = ProductCategory.objects.filter(subgroup_id=parent_group_id, menu=menu).first()
-
-        if not category:
-            logger.warning(f"Category not found (groupId={category_id}, parentGroup={parent_group_id}) for product {item['name']}")
-
-        price = 0
-        size_prices = item.get('sizePrices', [])
-        if size_prices:
-            price_info = size_prices[0].get('price', {})
-            price = price_info.get('currentPrice', 0)
-
-        # Check modifiers availability
-        group_modifiers = item.get('groupModifiers', [])
-        simple_modifiers = item.get('modifiers', [])
-        has_modifiers = bool(group_modifiers or simple_modifiers)
-
-        # Поиск по (product_id, menu), чтобы продукты разных меню не перезаписывали друг друга
-        product, created = Product.objects.update_or_create(
-            product_id=product_id,
-            menu=menu,
-            defaults={
+            # Модификаторы обрабатываются только в составе родительского продукта
+            if item.get('type') not in ('Dish', 'Good'):
+                continue
+            key = _uuid_key(item.get('id'))
+            if not key:
+                continue
+
+            category_id = item.get('groupId')
+            parent_group_id = item.get('parentGroup')
+            category = categories.get(_uuid_key(category_id)) or categories.get(_uuid_key(parent_group_id))
+            if not category:
+                logger.warning(f"Category not found (groupId={category_id}, parentGroup={parent_group_id}) for product {item['name']}")
+
+            price = 0
+            size_prices = item.get('sizePrices', [])
+            if size_prices:
+                price_info = size_prices[0].get('price', {})
+                price = price_info.get('currentPrice', 0)
+
+            group_modifiers = item.get('groupModifiers', [])
+            simple_modifiers = item.get('modifiers', [])
+
+            rows[key] = {
+                'product_id': uuid.UUID(key),
+                'menu': menu,
                 'product_name': item['name'],
                 'product_code': item.get('code'),
                 'price': price,
@@ -220,139 +357,197 @@ class MenuSyncService:
                 'image_url': item.get('imageLinks', [])[0] if item.get('imageLinks') else None,
                 'type': item.get('type'),
                 'outer_data': item,
-                'has_modifiers': has_modifiers,
+                'has_modifiers': bool(group_modifiers or simple_modifiers),
                 'is_available': True,
-                'updated_from_iiko': timezone.now(),
+                'updated_from_iiko': now,
             }
-        )
-        
-        # Модификаторы: при отсутствии в выгрузке — деактивация (is_available=False), без удаления (FK заказов).
-        if has_modifiers:
-            self._sync_product_modifiers(product, group_modifiers, simple_modifiers, products_map)
-        else:
-            self._sync_product_modifiers(product, [], [], products_map)
-
-    def _deactivate_modifiers_not_in_seen(self, product: Product, seen_modifier_codes: set) -> int:
-        """Помечает модификаторы продукта как недоступные, если их нет в текущей выгрузке."""
-        now = timezone.now()
-        qs = Modifier.objects.filter(product=product, is_available=True).exclude(
-            modifier_code__in=seen_modifier_codes
-        )
-        count = qs.update(is_available=False, updated_from_iiko=now)
-        if count:
-            logger.debug(
-                'Деактивировано модификаторов (нет в выгрузке iiko): %s для продукта "%s"',
-                count,
-                product.product_name,
+            modifier_specs[key] = self._nomenclature_modifier_specs(
+                item['name'], group_modifiers, simple_modifiers, products_map
             )
-        return count
 
-    def _sync_product_modifiers(self, product, group_modifiers, simple_modifiers, products_map):
-        seen_modifier_codes = set()
+        return self._write_products(menu, rows, modifier_specs, force=force)
 
-        # Helper to create or update modifier
-        def create_modifier_entry(mod_data, group_info=None):
+    def _nomenclature_modifier_specs(
+        self, product_name: str, group_modifiers: List[Dict], simple_modifiers: List[Dict], products_map: Dict[str, Dict]
+    ) -> Dict[str, Dict[str, Any]]:
+        """Модификаторы продукта из номенклатуры: {modifier_code: поля}. При повторе кода побеждает последний."""
+        specs = {}
+
+        def add_modifier(mod_data, group_info=None):
             # mod_data usually has 'id' (product id), 'minAmount', 'maxAmount', 'required'
-            # OR it might include nested 'product' info.
-            
             mod_product_id = mod_data.get('id') or mod_data.get('productId')
             if not mod_product_id:
                 logger.warning(
-                    f'Пропущен модификатор для продукта "{product.product_name}" (ID: {product.product_id}): '
+                    f'Пропущен модификатор для продукта "{product_name}": '
                     f'отсутствует id или productId в данных: {mod_data}'
                 )
                 return
 
             # Lookup name/price from global map if missing
-            name = mod_data.get('name') # unlikely in childModifiers
-            price = mod_data.get('price') # unlikely?
-            
+            name = mod_data.get('name')
+            price = mod_data.get('price')
             linked_product = products_map.get(mod_product_id)
             if linked_product:
-                if not name: 
+                if not name:
                     name = linked_product.get('name')
-                # Price logic: usually modifier overrides price or adds to it?
-                # If 'currentPrice' is in mod_data (sometimes), use it. Else use linked product price.
-                # In iiko: childModifier might represent "Availability" of a product. Price might be 0 or override.
                 if not price and 'price' in linked_product:
                     price = linked_product.get('price', 0)
-            
             if not name:
                 name = f"Modifier {mod_product_id}"
 
-            # Конвертируем mod_product_id в строку для сохранения в modifier_code
-            modifier_code_str = str(mod_product_id).strip() if mod_product_id else None
-            
+            modifier_code_str = str(mod_product_id).strip()
             if not modifier_code_str or modifier_code_str == 'None':
                 logger.error(
-                    f'Не удалось создать модификатор для продукта "{product.product_name}": '
+                    f'Не удалось создать модификатор для продукта "{product_name}": '
                     f'modifier_code пустой или None после конвертации mod_product_id={mod_product_id}'
                 )
                 return
 
-            seen_modifier_codes.add(modifier_code_str)
-
-            min_amt = int(mod_data.get('minAmount') or 0)
-            max_amt = int(mod_data.get('maxAmount') or 1)
-            is_req = bool(mod_data.get('required')) or bool(group_info and group_info.get('required'))
-            price_val = float(price) if price is not None else 0.0
-
-            existing = Modifier.objects.filter(
-                product=product,
-                modifier_code=modifier_code_str
-            ).first()
-            if existing:
-                existing.modifier_name = name
-                existing.min_amount = min_amt
-                existing.max_amount = max_amt
-                existing.is_required = is_req
-                existing.price = price_val
-                existing.is_available = True
-                existing.updated_from_iiko = timezone.now()
-                existing.save(
-                    update_fields=[
-                        'modifier_name', 'min_amount', 'max_amount', 'is_required', 'price',
-                        'is_available', 'updated_from_iiko',
-                    ]
-                )
-                logger.debug(
-                    f'Обновлен модификатор для продукта "{product.product_name}": '
-                    f'name="{name}", modifier_code={modifier_code_str}'
-                )
-            else:
-                Modifier.objects.create(
-                    modifier_id=uuid.uuid4(),
-                    modifier_name=name,
-                    product=product,
-                    modifier_code=modifier_code_str,
-                    min_amount=min_amt,
-                    max_amount=max_amt,
-                    is_required=is_req,
-                    price=price_val,
-                    is_available=True,
-                    updated_from_iiko=timezone.now(),
-                )
-                logger.debug(
-                    f'Создан модификатор для продукта "{product.product_name}": '
-                    f'name="{name}", modifier_code={modifier_code_str}'
-                )
+            specs[modifier_code_str] = {
+                'modifier_name': name,
+                'min_amount': int(mod_data.get('minAmount') or 0),
+                'max_amount': int(mod_data.get('maxAmount') or 1),
+                'is_required': bool(mod_data.get('required')) or bool(group_info and group_info.get('required')),
+                'price': float(price) if price is not None else 0.0,
+            }
 
-        # Process Group Modifiers
         for group in group_modifiers:
-            child_mods = group.get('childModifiers', [])
             group_details = {
                 'required': group.get('required', False),
                 'minAmount': group.get('minAmount'),
                 'maxAmount': group.get('maxAmount')
             }
-            for child in child_mods:
-                create_modifier_entry(child, group_details)
+            for child in group.get('childModifiers', []):
+                add_modifier(child, group_details)
 
-        # Process Simple Modifiers
         for mod in simple_modifiers:
-            create_modifier_entry(mod)
+            add_modifier(mod)
+
+        return specs
+
+    def _bulk_upsert(self, model, rows: Dict[Any, Dict[str, Any]], existing: Dict[Any, Any],
+                     unique_fields: Optional[List[str]], update_fields: List[str],
+                     fingerprint_extra: Optional[Dict[Any, Any]] = None, force: bool = False):
+        """
+        Пакетный upsert: rows — {ключ: значения полей}, existing — {ключ: загруженный объект}.
+        Новые пишутся bulk_create (при наличии unique_fields — с update_conflicts на случай
+        параллельной вставки), изменившиеся — bulk_update.
+        Для моделей с content_hash строка с тем же отпечатком (и доступная) не перезаписывается,
+        если не force. fingerprint_extra — {ключ: данные вне строки}, влияющие на отпечаток.
+        Возвращает ({ключ: объект}, ключи созданных, ключи изменённых, число неизменных).
+        """
+        hashed = 'content_hash' in update_fields
+        now = timezone.now()
+        to_create, to_update, result = [], [], {}
+        created_keys, changed_keys = [], []
+        unchanged = 0
+        for key, values in rows.items():
+            if hashed:
+                extra = fingerprint_extra.get(key) if fingerprint_extra else None
+                values = {**values, 'content_hash': _fingerprint(values, extra)}
+            obj = existing.get(key)
+            if obj is None:
+                obj = model(**values)
+                if obj.pk is None:
+                    obj.pk = uuid.uuid4()
+                to_create.append(obj)
+                created_keys.append(key)
+            elif (
+                hashed and not force
+                and obj.content_hash == values['content_hash']
+                and getattr(obj, 'is_available', True)
+            ):
+                unchanged += 1
+            else:
+                for field, value in values.items():
+                    setattr(obj, field, value)
+                obj.updated_at = now
+                to_update.append(obj)
+                changed_keys.append(key)
+            result[key] = obj
+
+        if to_create:
+            if unique_fields:
+                model.objects.bulk_create(
+                    to_create, batch_size=BULK_BATCH_SIZE,
+                    update_conflicts=True, unique_fields=unique_fields, update_fields=update_fields,
+                )
+            else:
+                model.objects.bulk_create(to_create, batch_size=BULK_BATCH_SIZE)
+        if to_update:
+            model.objects.bulk_update(to_update, update_fields, batch_size=BULK_BATCH_SIZE)
+        return result, created_keys, changed_keys, unchanged
+
+    def _write_products(
+        self, menu: Menu, rows: Dict[str, Dict[str, Any]], modifier_specs: Dict[str, Dict[str, Dict[str, Any]]],
+        force: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Запись продуктов меню и их модификаторов набором запросов, не зависящим от размера меню:
+        загрузка существующих продуктов (без outer_data) и модификаторов, bulk_create/bulk_update,
+        одна деактивация модификаторов, которых нет в выгрузке (без удаления — FK заказов).
+        Модификаторы входят в отпечаток продукта, поэтому у неизменных продуктов не трогаются.
+        """
+        existing = {
+            str(p.product_id): p
+            for p in Product.objects.filter(
+                menu=menu, product_id__in=[uuid.UUID(k) for k in rows]
+            ).defer('outer_data')
+        }
+        products, created, changed, unchanged = self._bulk_upsert(
+            Product, rows, existing,
+            unique_fields=['product_id', 'menu'], update_fields=PRODUCT_UPDATE_FIELDS,
+            fingerprint_extra=modifier_specs, force=force,
+        )
+        report = {
+            'products_created': len(created),
+            'products_changed': len(changed),
+            'products_unchanged': unchanged,
+            'created_products': [rows[k]['product_name'] for k in created[:SYNC_REPORT_MAX_ITEMS]],
+            'changed_products': [rows[k]['product_name'] for k in changed[:SYNC_REPORT_MAX_ITEMS]],
+        }
+        touched = {key: products[key] for key in created + changed}
+        report.update(self._write_modifiers(touched, modifier_specs))
+        return report
 
-        self._deactivate_modifiers_not_in_seen(product, seen_modifier_codes)
+    def _write_modifiers(
+        self, products: Dict[str, Product], modifier_specs: Dict[str, Dict[str, Dict[str, Any]]]
+    ) -> Dict[str, int]:
+        now = timezone.now()
+        existing = {}
+        available = []
+        for modifier in Modifier.objects.filter(product_id__in=[p.pk for p in products.values()]):
+            # При дублях (product, modifier_code) обновляется первая запись, как и раньше
+            existing.setdefault((modifier.product_id, modifier.modifier_code), modifier)
+            if modifier.is_available:
+                available.append(modifier)
+
+        rows = {}
+        for key, product in products.items():
+            for code, values in (modifier_specs.get(key) or {}).items():
+                rows[(product.pk, code)] = {
+                    **values,
+                    'product': product,
+                    'modifier_code': code,
+                    'is_available': True,
+                    'updated_from_iiko': now,
+                }
+        _, created, changed, _ = self._bulk_upsert(
+            Modifier, rows, existing, unique_fields=None, update_fields=MODIFIER_UPDATE_FIELDS,
+        )
+
+        # Модификаторы, которых нет в текущей выгрузке, — недоступны (без удаления: FK заказов)
+        stale_ids = [m.pk for m in available if (m.product_id, m.modifier_code) not in rows]
+        deactivated = 0
+        if stale_ids:
+            deactivated = Modifier.objects.filter(pk__in=stale_ids).update(
+                is_available=False, updated_from_iiko=now
+            )
+        return {
+            'modifiers_created': len(created),
+            'modifiers_changed': len(changed),
+            'modifiers_deactivated': deactivated,
+        }
 
     def _sync_modifier(self, item: Dict):
         # Placeholder for Modifier sync (if needed distinct from products)
@@ -421,6 +616,8 @@ class MenuSyncService:
                 self._sync_products_and_modifiers(menu, organization, products_to_sync, products_map)
                 seen_ids = self._collect_seen_nomenclature_product_ids(products_to_sync)
                 self._deactivate_products_not_in_seen(menu, seen_ids)
+            invalidate_catalog(organization.pk, reason='menu')
+            Terminal.reset_stop_list_digests(organization.pk)
 
     def _price_for_category(
         self,
@@ -494,6 +691,7 @@ class MenuSyncService:
         price_category_name: Optional[str] = None,
         external_menu_id: Optional[str] = None,
         set_active: bool = True,
+        force: bool = False,
     ):
         """
         Синхронизирует внешнее меню (ответ iiko API v2 POST /menu/by_id) в БД.
@@ -503,6 +701,10 @@ class MenuSyncService:
         ProductCategory (subgroup_id + menu) и Product (product_id + menu). Модификаторы
         для внешнего меню в этой выгрузке не создаются (в ответе menu/by_id их может не быть).
 
+        Blue/green (apps.products.menu_versions): если меню с этим названием активно, выгрузка
+        пишется в его неактивную резервную версию, а при set_active=True после коммита сборки
+        версии переключаются одной короткой транзакцией. Прежняя версия остаётся для отката.
+
         Ожидаемая структура menu_data: список категорий в itemCategories или
         productCategories/categoryGroups/groups; внутри категории — items или products.
         """
@@ -529,51 +731,48 @@ class MenuSyncService:
                 list(payload.keys()) if isinstance(payload, dict) else [],
             )
 
+        if not menu_name:
+            menu_name = f"Внешнее меню {organization.org_name}"
+
+        menu_metadata = {}
+        if price_category_id:
+            menu_metadata['price_category_id'] = str(price_category_id)
+        if price_category_name:
+            menu_metadata['price_category_name'] = price_category_name
+        if external_menu_id:
+            menu_metadata['external_menu_id'] = str(external_menu_id)
+
         with transaction.atomic():
-            if not menu_name:
-                menu_name = f"Внешнее меню {organization.org_name}"
-
-            menu_metadata = {}
-            if price_category_id:
-                menu_metadata['price_category_id'] = str(price_category_id)
-            if price_category_name:
-                menu_metadata['price_category_name'] = price_category_name
-            if external_menu_id:
-                menu_metadata['external_menu_id'] = str(external_menu_id)
-
-            menu, _ = Menu.objects.update_or_create(
-                organization=organization,
-                menu_name=menu_name,
-                defaults={
-                    'is_active': set_active,
-                    'source_type': Menu.SOURCE_EXTERNAL,
-                    'metadata': menu_metadata or None,
-                }
-            )
-            if set_active:
-                Menu.objects.filter(organization=organization).exclude(pk=menu.pk).update(is_active=False)
+            # Сборка идёт в неактивную версию: каталог до переключения отдаёт текущую целиком
+            menu, live_menu = get_build_target(organization, menu_name, Menu.SOURCE_EXTERNAL)
+            previous_menu_id = (menu.metadata or {}).get(PREVIOUS_MENU_KEY)
+            if previous_menu_id:
+                menu_metadata[PREVIOUS_MENU_KEY] = previous_menu_id
+            menu.metadata = menu_metadata or None
+            menu.save(update_fields=['metadata', 'updated_at'])
 
             org_id = getattr(organization, 'iiko_organization_id', None)
-            products_created = 0
-            seen_external_product_ids: set = set()
+            now = timezone.now()
+            category_rows = {}
+            product_rows = {}
+            modifier_specs = {}
 
             for cat_data in item_categories:
                 category_id = cat_data.get('id') or cat_data.get('categoryId') or cat_data.get('groupId')
                 category_name = cat_data.get('name') or cat_data.get('categoryName') or cat_data.get('groupName') or ''
-                if not category_id:
+                category_key = _uuid_key(category_id)
+                if not category_key:
                     logger.debug("Skip category with no id: %s", list(cat_data.keys()))
                     continue
 
                 # Для каждого меню — свои категории (unique_together subgroup_id + menu)
-                category, _ = ProductCategory.objects.update_or_create(
-                    subgroup_id=category_id,
-                    menu=menu,
-                    defaults={
-                        'subgroup_name': category_name,
-                        'order_index': 0,
-                        'outer_data': cat_data,
-                    }
-                )
+                category_rows[category_key] = {
+                    'subgroup_id': uuid.UUID(category_key),
+                    'menu': menu,
+                    'subgroup_name': category_name,
+                    'order_index': 0,
+                    'outer_data': cat_data,
+                }
 
                 # Товары в категории могут быть в items, products и т.д.
                 items = (
@@ -595,7 +794,8 @@ class MenuSyncService:
                     product_id = item.get('itemId') or item.get('id') or item.get('productId')
                     if not product_id and item.get('itemSizes'):
                         product_id = item['itemSizes'][0].get('itemId')
-                    if not product_id:
+                    product_key = _uuid_key(product_id)
+                    if not product_key:
                         continue
                     product_name = item.get('name') or item.get('productName') or ''
                     price = self._price_for_category(item, price_category_id, organization_id=org_id)
@@ -608,55 +808,77 @@ class MenuSyncService:
                     has_modifier_groups = any(
                         (s.get('itemModifierGroups') or []) for s in item_sizes
                     )
-                    product, _ = Product.objects.update_or_create(
-                        product_id=product_id,
-                        menu=menu,
-                        defaults={
-                            'product_name': product_name,
-                            'product_code': item.get('sku'),
-                            'price': price,
-                            'description': item.get('description', ''),
-                            'measure_unit': 'порц',
-                            'organization': organization,
-                            'category': category,
-                            'parent_group': category_name,
-                            'order_index': 0,
-                            'image_url': image_url,
-                            'type': 'Dish',
-                            'outer_data': item,
-                            'has_modifiers': bool(item.get('modifierSchemaId') or has_modifier_groups),
-                            'is_available': True,
-                            'updated_from_iiko': timezone.now(),
-                        }
+                    # Категория проставляется после записи категорий (ниже)
+                    product_rows[product_key] = {
+                        'product_id': uuid.UUID(product_key),
+                        'menu': menu,
+                        'product_name': product_name,
+                        'product_code': item.get('sku'),
+                        'price': price,
+                        'description': item.get('description', ''),
+                        'measure_unit': 'порц',
+                        'organization': organization,
+                        'category': category_key,
+                        'parent_group': category_name,
+                        'order_index': 0,
+                        'image_url': image_url,
+                        'type': 'Dish',
+                        'outer_data': item,
+                        'has_modifiers': bool(item.get('modifierSchemaId') or has_modifier_groups),
+                        'is_available': True,
+                        'updated_from_iiko': now,
+                    }
+                    modifier_specs[product_key] = (
+                        self._external_modifier_specs(item, organization_id=org_id) if has_modifier_groups else {}
                     )
-                    seen_external_product_ids.add(product.product_id)
-                    products_created += 1
-                    if has_modifier_groups:
-                        self._sync_external_menu_modifiers(product, item, organization_id=org_id)
-                    else:
-                        self._deactivate_modifiers_not_in_seen(product, set())
 
-            self._deactivate_products_not_in_seen(menu, seen_external_product_ids)
+            self._report_progress('categories', 0, len(category_rows))
+            categories = {
+                str(c.subgroup_id): c for c in ProductCategory.objects.filter(menu=menu).defer('outer_data')
+            }
+            synced_categories, categories_created, categories_changed, categories_unchanged = self._bulk_upsert(
+                ProductCategory, category_rows, categories,
+                unique_fields=['subgroup_id', 'menu'], update_fields=CATEGORY_UPDATE_FIELDS, force=force,
+            )
+            for row in product_rows.values():
+                row['category'] = synced_categories[row['category']]
+
+            report = {
+                'categories_created': len(categories_created),
+                'categories_changed': len(categories_changed),
+                'categories_unchanged': categories_unchanged,
+            }
+            self._report_progress('products', 0, len(product_rows))
+            report.update(self._write_products(menu, product_rows, modifier_specs, force=force))
+            self._report_progress('deactivate', len(product_rows), len(product_rows))
+            seen_external_product_ids = {uuid.UUID(key) for key in product_rows}
+            report.update(self._deactivate_products_not_in_seen(menu, seen_external_product_ids))
 
             logger.info(
-                "sync_external_menu: menu=%s, categories=%s, products=%s",
+                "sync_external_menu: menu=%s, categories=%s, products=%s: %s",
                 menu.menu_name,
                 len(item_categories),
-                products_created,
+                len(product_rows),
+                _report_summary(report),
             )
 
-    def _sync_external_menu_modifiers(
-        self, product: Product, item: Dict[str, Any], organization_id: Optional[str] = None
-    ) -> None:
+        if set_active:
+            self._report_progress('activate', len(product_rows), len(product_rows))
+            report.update(activate_menu(menu))
+        report['menu_id'] = str(menu.pk)
+        report['previous_menu_id'] = str(live_menu.pk) if live_menu else None
+        return report
+
+    def _external_modifier_specs(
+        self, item: Dict[str, Any], organization_id: Optional[str] = None
+    ) -> Dict[str, Dict[str, Any]]:
         """
-        Синхронизация модификаторов из формата внешнего меню (API v2).
-        Модификаторы лежат в item.itemSizes[].itemModifierGroups[].items[].
-        Отсутствующие в выгрузке — деактивируются (is_available=False), без удаления.
+        Модификаторы из формата внешнего меню (API v2): {modifier_code: поля}.
+        Модификаторы лежат в item.itemSizes[].itemModifierGroups[].items[]; при повторе кода
+        побеждает первый.
         """
-        item_sizes = item.get('itemSizes') or []
-        seen_in_product = set()
-
-        for size in item_sizes:
+        specs = {}
+        for size in item.get('itemSizes') or []:
             groups = size.get('itemModifierGroups') or []
             for group in groups:
                 restr = group.get('restrictions') or {}
@@ -671,9 +893,8 @@ class MenuSyncService:
                     if not iiko_item_id:
                         continue
                     iiko_id_str = str(iiko_item_id)
-                    if iiko_id_str in seen_in_product:
+                    if iiko_id_str in specs:
                         continue
-                    seen_in_product.add(iiko_id_str)
                     name = mod_item.get('name') or mod_item.get('productName') or f'Модификатор {iiko_id_str}'
                     mod_prices = mod_item.get('prices') or []
                     price_val = 0.0
@@ -691,56 +912,30 @@ class MenuSyncService:
                             except (TypeError, ValueError):
                                 pass
                     mod_restr = mod_item.get('restrictions') or {}
-                    min_amt = int(mod_restr.get('minQuantity') or group_min or 0)
-                    max_amt = int(mod_restr.get('maxQuantity') or group_max or 1)
-                    if max_amt < 1:
-                        max_amt = 1
-                    is_required = group_required or min_amt > 0
                     try:
-                        existing = Modifier.objects.filter(
-                            product=product,
-                            modifier_code=iiko_id_str
-                        ).first()
-                        if existing:
-                            existing.modifier_name = name
-                            existing.min_amount = min_amt
-                            existing.max_amount = max_amt
-                            existing.price = price_val
-                            existing.is_required = is_required
-                            existing.is_available = True
-                            existing.updated_from_iiko = timezone.now()
-                            existing.save(
-                                update_fields=[
-                                    'modifier_name', 'min_amount', 'max_amount', 'price', 'is_required',
-                                    'is_available', 'updated_from_iiko',
-                                ]
-                            )
-                        else:
-                            Modifier.objects.create(
-                                modifier_id=uuid.uuid4(),
-                                modifier_name=name,
-                                product=product,
-                                modifier_code=iiko_id_str,
-                                min_amount=min_amt,
-                                max_amount=max_amt,
-                                price=price_val,
-                                is_required=is_required,
-                                is_available=True,
-                                updated_from_iiko=timezone.now(),
-                            )
+                        min_amt = int(mod_restr.get('minQuantity') or group_min or 0)
+                        max_amt = int(mod_restr.get('maxQuantity') or group_max or 1)
                     except (ValueError, TypeError) as e:
-                        logger.warning(
-                            "Пропущен модификатор %s для продукта %s: %s",
-                            iiko_id_str,
-                            product.product_name,
-                            e,
-                        )
-
-        self._deactivate_modifiers_not_in_seen(product, seen_in_product)
+                        logger.warning("Пропущен модификатор %s: %s", iiko_id_str, e)
+                        continue
+                    if max_amt < 1:
+                        max_amt = 1
+                    specs[iiko_id_str] = {
+                        'modifier_name': name,
+                        'min_amount': min_amt,
+                        'max_amount': max_amt,
+                        'price': price_val,
+                        'is_required': group_required or min_amt > 0,
+                    }
+        return specs
 
-    def sync_terminal_groups(self, terminal_groups_data: Dict[str, Any], organization: Organization = None):
+    def sync_terminal_groups(
+        self, terminal_groups_data: Dict[str, Any], organization: Organization = None, activate: bool = True
+    ):
         """
         Syncs terminal groups data from iiko to local database.
+        activate=False — существующие терминалы не включаются обратно (периодическая
+        синхронизация не должна отменять ручное отключение); новые создаются активными.
         """
         from apps.organizations.models import Terminal
         
@@ -755,23 +950,29 @@ class MenuSyncService:
                     terminal_id = item.get('id')
                     name = item.get('name')
                     
+                    defaults = {
+                        'terminal_group_name': name,
+                        'organization': organization,
+                        'iiko_organization_id': organization.iiko_organization_id if organization else None,
+                    }
+                    if activate:
+                        defaults['is_active'] = True
                     terminal, created = Terminal.objects.update_or_create(
                         terminal_id=terminal_id,
-                        defaults={
-                            'terminal_group_name': name,
-                            'organization': organization,
-                            'iiko_organization_id': organization.iiko_organization_id if organization else None,
-                            'is_active': True
-                        }
+                        defaults=defaults,
+                        create_defaults={**defaults, 'is_active': True},
                     )
                     
                     synced_terminals.append(terminal)
         
+        # Список терминалов входит в меню сайта
+        invalidate_catalog(getattr(organization, 'pk', None))
         return synced_terminals
 
-    def sync_payment_types(self, organization, payment_types_data: Dict[str, Any]):
+    def sync_payment_types(self, organization, payment_types_data: Dict[str, Any], activate: bool = True):
         """
         Syncs payment types data from iiko to local database.
+        activate=False — не включать обратно отключённые вручную типы оплаты.
         """
         from apps.organizations.models import PaymentType
         
@@ -796,7 +997,8 @@ class MenuSyncService:
                     existing.payment_name = name
                     existing.payment_type = p_kind
                     existing.organization = organization
-                    existing.is_active = True
+                    if activate:
+                        existing.is_active = True
                     existing.save()
                     synced_types.append(existing)
                 else:
@@ -827,16 +1029,51 @@ def _extract_stop_list_items_for_terminal(
     return []
 
 
+def _parse_stop_list_items(items: List) -> Dict[uuid.UUID, tuple]:
+    """{UUID продукта iiko: (название, остаток)} из позиций стоп-листа; при повторах побеждает последняя."""
+    parsed = {}
+    for item in items:
+        product_id_str = (
+            item.get('productId') or item.get('product_id') or item.get('id')
+        )
+        product_id = _normalize_iiko_product_uuid(product_id_str) if product_id_str else None
+        if product_id is None:
+            continue
+        product_name = (
+            item.get('productName') or item.get('product_name') or item.get('name') or ''
+        )
+        balance_value = (
+            item.get('balance') or item.get('quantity') or item.get('amount') or 0.0
+        )
+        try:
+            balance = Decimal(str(balance_value)).quantize(STOP_LIST_BALANCE_QUANT)
+        except (InvalidOperation, ValueError, TypeError):
+            balance = Decimal('0.00')
+        parsed[product_id] = (product_name, balance)
+    return parsed
+
+
+def _stop_list_digest(incoming: Dict[uuid.UUID, tuple]) -> str:
+    """Отпечаток стоп-листа терминала: не зависит от порядка позиций в ответе iiko."""
+    normalized = sorted((str(pid), name, str(balance)) for pid, (name, balance) in incoming.items())
+    raw = json.dumps(normalized, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
 class StopListSyncService:
     """Сервис для синхронизации стоп-листа с iiko API"""
     
     def __init__(self, api_key: str):
         self.client = IikoClient(api_key)
     
-    def apply_stop_list_response(self, terminal: Terminal, api_response: Dict[str, Any]) -> Dict[str, Any]:
+    def apply_stop_list_response(
+        self, terminal: Terminal, api_response: Dict[str, Any], force: bool = False
+    ) -> Dict[str, Any]:
         """
         Применяет уже полученный ответ get_stop_lists к одному терминалу (только БД).
         Используется для оптимизации: один запрос к API на организацию, затем обновление всех терминалов.
+        Если стоп-лист терминала совпадает с последним применённым (Terminal.stop_list_digest),
+        БД не трогается — обновляется только stop_list_checked_at. force=True — применить всё равно.
         """
         organization = terminal.organization
         if not organization:
@@ -846,102 +1083,135 @@ class StopListSyncService:
             raise ValueError("У организации должен быть настроен iiko_organization_id")
         terminal_id_str = str(terminal.terminal_id)
         items = _extract_stop_list_items_for_terminal(api_response, organization_id, terminal_id_str)
-        return self._upsert_delete_stop_list_for_terminal(terminal, organization, items)
+        incoming = _parse_stop_list_items(items)
+        digest = _stop_list_digest(incoming)
+        if not force and terminal.stop_list_digest == digest:
+            now = timezone.now()
+            Terminal.objects.filter(pk=terminal.pk).update(stop_list_checked_at=now)
+            terminal.stop_list_checked_at = now
+            logger.debug(f"Стоп-лист для терминала {terminal.terminal_id} не изменился, запись пропущена")
+            return {
+                'terminal_id': terminal_id_str,
+                'terminal_name': terminal.terminal_group_name,
+                'skipped': True,
+                'created': 0,
+                'updated': 0,
+                'unchanged': len(incoming),
+                'deleted_count': 0,
+                'updated_count': 0,
+                'total_items': len(items)
+            }
+        return self._upsert_delete_stop_list_for_terminal(terminal, organization, items, incoming, digest)
 
     def _upsert_delete_stop_list_for_terminal(
-        self, terminal: Terminal, organization, items: List
+        self, terminal: Terminal, organization, items: List,
+        incoming: Optional[Dict[uuid.UUID, tuple]] = None, digest: Optional[str] = None,
     ) -> Dict[str, Any]:
-        """UPSERT и DELETE записей стоп-листа для одного терминала в одной транзакции."""
-        active_menu_product_pks = []  # Product.pk из активного меню (для корректного delete)
-        created_count = 0
-        updated_count = 0
-        deleted_count = 0
+        """
+        Применяет стоп-лист iiko к терминалу как разницу с текущими записями:
+        продукты активного меню ищутся одним запросом, сравнение с записями терминала —
+        в памяти, затем bulk_create / bulk_update / один DELETE в одной транзакции.
+        Неизменные записи (то же название и остаток) не перезаписываются.
+        Вместе с записями сохраняется отпечаток применённого стоп-листа (digest).
+        """
+        if incoming is None:
+            incoming = _parse_stop_list_items(items)
+        if digest is None:
+            digest = _stop_list_digest(incoming)
+        now = timezone.now()
         with transaction.atomic():
-            for item in items:
-                product_id_str = (
-                    item.get('productId') or item.get('product_id') or item.get('id')
-                )
-                if not product_id_str:
-                    continue
-                try:
-                    product_id = uuid.UUID(str(product_id_str))
-                except (ValueError, TypeError):
-                    continue
-                product_name = (
-                    item.get('productName') or item.get('product_name') or item.get('name') or ''
-                )
-                balance_value = (
-                    item.get('balance') or item.get('quantity') or item.get('amount') or 0.0
-                )
-                try:
-                    balance = float(balance_value)
-                except (ValueError, TypeError):
-                    balance = 0.0
-                product = Product.objects.filter(
-                    product_id=product_id,
+            products = {
+                p.product_id: p
+                for p in Product.objects.filter(
+                    product_id__in=list(incoming),
                     organization=organization,
                     menu__is_active=True,
-                ).first()
-                if not product:
+                ).only('pk', 'product_id', 'product_name')
+            } if incoming else {}
+            # select_for_update: параллельная синхронизация того же терминала ждёт, а не пишет дубли
+            existing = {
+                row.product_id: row
+                for row in StopList.objects.select_for_update().filter(terminal=terminal)
+            }
+
+            to_create, to_update = [], []
+            seen_pks = set()
+            unchanged_count = 0
+            for product_uuid, (product_name, balance) in incoming.items():
+                product = products.get(product_uuid)
+                if product is None:
                     continue
-                active_menu_product_pks.append(product.pk)
-                stop_list_obj, created = StopList.objects.update_or_create(
-                    product=product,
-                    terminal=terminal,
-                    defaults={
-                        'product_name': product_name or product.product_name,
-                        'balance': balance,
-                        'organization': organization,
-                        'is_auto_added': True,
-                        'updated_at': timezone.now()
-                    }
-                )
-                if created:
-                    created_count += 1
+                seen_pks.add(product.pk)
+                values = {
+                    'product_name': product_name or product.product_name,
+                    'balance': balance,
+                    'organization_id': organization.pk,
+                    'is_auto_added': True,
+                }
+                row = existing.get(product.pk)
+                if row is None:
+                    to_create.append(StopList(product=product, terminal=terminal, updated_at=now, **values))
+                elif any(getattr(row, field) != value for field, value in values.items()):
+                    for field, value in values.items():
+                        setattr(row, field, value)
+                    row.updated_at = now
+                    to_update.append(row)
                 else:
-                    updated_count += 1
-            if active_menu_product_pks:
-                deleted_queryset = StopList.objects.filter(terminal=terminal).exclude(
-                    product_id__in=active_menu_product_pks
+                    unchanged_count += 1
+
+            stale = [(product_pk, row.pk) for product_pk, row in existing.items() if product_pk not in seen_pks]
+            stale_ids = [row_pk for _, row_pk in stale]
+            unblocked = list(
+                Product.objects.filter(pk__in=[product_pk for product_pk, _ in stale]).values_list('product_id', flat=True)
+            ) if stale else []
+            if to_create:
+                StopList.objects.bulk_create(to_create, batch_size=BULK_BATCH_SIZE)
+            if to_update:
+                StopList.objects.bulk_update(
+                    to_update, STOP_LIST_UPDATE_FIELDS, batch_size=BULK_BATCH_SIZE
                 )
-                deleted_count = deleted_queryset.count()
-                deleted_queryset.delete()
-            else:
-                deleted_queryset = StopList.objects.filter(terminal=terminal)
-                deleted_count = deleted_queryset.count()
-                deleted_queryset.delete()
+            deleted_count = StopList.objects.filter(pk__in=stale_ids).delete()[0] if stale_ids else 0
+
+            Terminal.objects.filter(pk=terminal.pk).update(stop_list_digest=digest, stop_list_checked_at=now)
+            terminal.stop_list_digest = digest
+            terminal.stop_list_checked_at = now
+
+            # В каталоге виден только факт стопа, поэтому обновление остатков снимки не сбрасывает
+            if to_create or deleted_count:
+                # Открытым сессиям уходит разница по терминалу, а не общее событие каталога
+                invalidate_catalog(organization.pk, notify=False)
+                publish_stop_list_delta(
+                    terminal.terminal_id, [row.product.product_id for row in to_create], unblocked
+                )
+                # Итоговое множество терминала известно — кладём его в индекс сразу
+                update_terminal_index(organization.pk, terminal.terminal_id, seen_pks)
         logger.info(
-            f"Стоп-лист для терминала {terminal.terminal_id}: "
-            f"создано {created_count}, обновлено {updated_count}, удалено {deleted_count}"
+            f"Стоп-лист для терминала {terminal.terminal_id}: создано {len(to_create)}, "
+            f"обновлено {len(to_update)}, без изменений {unchanged_count}, удалено {deleted_count}"
         )
         return {
             'terminal_id': str(terminal.terminal_id),
             'terminal_name': terminal.terminal_group_name,
-            'created': created_count,
-            'updated': updated_count,
+            'skipped': False,
+            'created': len(to_create),
+            'updated': len(to_update),
+            'unchanged': unchanged_count,
             'deleted_count': deleted_count,
-            'updated_count': len(active_menu_product_pks),
+            'updated_count': len(seen_pks),
             'total_items': len(items)
         }
 
-    def sync_stop_lists_for_terminals(self, terminals: List[Terminal]) -> List[Dict[str, Any]]:
+    def apply_stop_lists_for_terminals(
+        self, terminals: List[Terminal], api_response: Dict[str, Any]
+    ) -> List[Dict[str, Any]]:
         """
-        Синхронизирует стоп-листы для списка терминалов одной организации.
-        Делает один запрос к API на организацию вместо одного на каждый терминал.
-        Обрабатываются только активные терминалы (is_active=True).
+        Применяет уже полученный ответ get_stop_lists организации к её терминалам (только БД).
+        Ошибка одного терминала не прерывает обработку остальных.
         """
-        if not terminals:
-            return []
-        active_only = [t for t in terminals if t.is_active]
-        if not active_only:
-            return []
-        organization = active_only[0].organization
-        organization_id = organization.iiko_organization_id
-        if not organization_id:
-            raise ValueError("У организации должен быть настроен iiko_organization_id")
-        api_response = self.client.get_stop_lists([organization_id])
         results = []
-        for terminal in active_only:
+        for terminal in terminals:
+            if not terminal.is_active:
+                continue
             try:
                 result = self.apply_stop_list_response(terminal, api_response)
                 results.append(result)
@@ -984,5 +1254,6 @@ class StopListSyncService:
             logger.error(f"Ошибка при запросе стоп-листа из iiko для терминала {terminal.terminal_id}: {e}")
             raise
         
-        return self.apply_stop_list_response(terminal, api_response)
+        # Ручная синхронизация применяет ответ iiko даже при совпадающем отпечатке
+        return self.apply_stop_list_response(terminal, api_response, force=True)
 
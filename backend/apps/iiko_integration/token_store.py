@@ -0,0 +1,120 @@
+"""
+Общий кэш access-токенов iiko.
+
+Токен хранится в Django cache (Redis) под ключом от sha256(api_key), поэтому
+все gunicorn- и celery-воркеры используют один токен на API-ключ вместо
+запроса /access_token в каждом новом IikoClient. Сам API-ключ в Redis не пишется.
+
+Недоступность Redis не ломает работу с iiko: операции с кэшем глотают ошибки,
+клиент в этом случае просто авторизуется сам, как раньше.
+"""
+import hashlib
+import logging
+import secrets
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'iiko:token'
+LOCK_POLL_INTERVAL = 0.05
+
+
+def _token_ttl() -> int:
+    # Токен iiko живёт ~60 минут; храним меньше, чтобы не отдавать почти истёкший
+    return getattr(settings, 'IIKO_TOKEN_TTL', 50 * 60)
+
+
+def _key_hash(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:32]
+
+
+def _token_key(api_key: str) -> str:
+    return f'{KEY_PREFIX}:{_key_hash(api_key)}'
+
+
+def _lock_key(api_key: str) -> str:
+    return f'{KEY_PREFIX}:lock:{_key_hash(api_key)}'
+
+
+def get_token(api_key: str) -> Optional[str]:
+    try:
+        return cache.get(_token_key(api_key))
+    except Exception as e:
+        logger.warning(f"iiko token cache недоступен (get): {e}")
+        return None
+
+
+def set_token(api_key: str, token: str) -> None:
+    try:
+        cache.set(_token_key(api_key), token, timeout=_token_ttl())
+    except Exception as e:
+        logger.warning(f"iiko token cache недоступен (set): {e}")
+
+
+def invalidate(api_key: str, token: Optional[str] = None) -> None:
+    """Удаляет токен из кэша. Если передан token — только если в кэше лежит именно он."""
+    try:
+        if token is None or cache.get(_token_key(api_key)) == token:
+            cache.delete(_token_key(api_key))
+    except Exception as e:
+        logger.warning(f"iiko token cache недоступен (delete): {e}")
+
+
+def new_lock_owner() -> str:
+    """Случайный идентификатор владельца блокировки обновления токена."""
+    return secrets.token_hex(16)
+
+
+def acquire_refresh_lock(api_key: str, owner: str) -> Optional[bool]:
+    """
+    Одна неблокирующая попытка взять блокировку обновления токена (cache.add — атомарный SET NX).
+    В блокировку записывается owner, чтобы снять её мог только тот, кто взял.
+    None — кэш недоступен, работаем без блокировки.
+    """
+    try:
+        return cache.add(_lock_key(api_key), owner, timeout=getattr(settings, 'IIKO_TOKEN_LOCK_TTL', 15))
+    except Exception as e:
+        logger.warning(f"iiko token cache недоступен (lock): {e}")
+        return None
+
+
+def release_refresh_lock(api_key: str, owner: str) -> None:
+    """
+    Снимает блокировку, только если она всё ещё принадлежит owner: если обновление шло
+    дольше IIKO_TOKEN_LOCK_TTL, блокировка уже истекла и, возможно, взята другим процессом.
+    """
+    try:
+        if cache.get(_lock_key(api_key)) == owner:
+            cache.delete(_lock_key(api_key))
+    except Exception as e:
+        logger.warning(f"iiko token cache недоступен (unlock): {e}")
+
+
+def lock_wait_seconds() -> float:
+    return getattr(settings, 'IIKO_TOKEN_LOCK_WAIT', 10)
+
+
+@contextmanager
+def refresh_lock(api_key: str) -> Iterator[bool]:
+    """
+    Межпроцессная блокировка обновления токена.
+    Ждёт не дольше IIKO_TOKEN_LOCK_WAIT секунд; по таймауту или при недоступном
+    Redis пропускает вызывающего без блокировки (yield False), чтобы запрос не завис.
+    """
+    owner = new_lock_owner()
+    deadline = time.monotonic() + lock_wait_seconds()
+    while True:
+        acquired = acquire_refresh_lock(api_key, owner)
+        if acquired is None or acquired or time.monotonic() >= deadline:
+            break
+        time.sleep(LOCK_POLL_INTERVAL)
+    try:
+        yield bool(acquired)
+    finally:
+        if acquired:
+            release_refresh_lock(api_key, owner)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Order, OrderItem, OrderItemModifier, IikoRequestLog
+from .models import Order, OrderItem, OrderItemModifier, IikoRequestLog, OrderOutbox
 from apps.organizations.models import Organization
 
 class OrderBaseAdmin(admin.ModelAdmin):
@@ -90,3 +90,13 @@ class IikoRequestLogAdmin(OrderBaseAdmin):
     list_filter = ('success', 'created_at')
     readonly_fields = ('order', 'payload', 'success', 'created_at')
     search_fields = ('order__order_number',)
+
+
+@admin.register(OrderOutbox)
+class OrderOutboxAdmin(OrderBaseAdmin):
+    list_display = ('order', 'organization', 'status', 'attempts', 'next_attempt_at', 'created_at', 'processed_at')
+    list_filter = ('status', 'organization', 'created_at')
+    readonly_fields = (
+        'order', 'organization', 'attempts', 'locked_until', 'last_error', 'processed_at', 'created_at'
+    )
+    search_fields = ('order__order_number',)
@@ -0,0 +1,89 @@
+"""
+Снимок корзины для валидации и создания заказа.
+
+Продукты корзины из активного меню организации вместе с доступными модификаторами загружаются
+одним запросом (+ prefetch модификаторов), стоп-лист терминала берётся из индекса
+(apps.products.stop_list_index). Снимок строит первая валидируемая позиция
+(OrderItemCreateSerializer) и кладёт в контекст сериализатора; OrderService.create_order
+получает тот же снимок и собирает заказ в памяти, не обращаясь к каталогу повторно.
+"""
+import uuid
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+from django.db.models import Prefetch
+
+from apps.products.models import Modifier, Product
+from apps.products.stop_list_index import blocked_product_pks
+
+CONTEXT_KEY = 'cart_snapshot'
+
+
+def _as_uuid(value) -> Optional[uuid.UUID]:
+    try:
+        return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+
+class CartSnapshot:
+    """Продукты корзины (по product_id iiko), их доступные модификаторы и стоп-лист терминала."""
+
+    def __init__(self, organization_id, terminal_id, products: Iterable[Product], blocked: FrozenSet):
+        self.organization_id = organization_id
+        self.terminal_id = terminal_id
+        self.products: Dict[uuid.UUID, Product] = {}
+        self.modifiers: Dict[uuid.UUID, Dict[uuid.UUID, Modifier]] = {}
+        for product in products:
+            self.products[product.product_id] = product
+            self.modifiers[product.product_id] = {m.modifier_id: m for m in product.available_modifiers}
+        self.blocked = blocked
+
+    @classmethod
+    def load(cls, organization_id, product_ids: Iterable, terminal_id=None) -> 'CartSnapshot':
+        """
+        Продукты product_ids из активного меню организации. Без организации — любые продукты
+        с этими product_id и без проверки стоп-листа (как прежняя валидация без организации).
+        """
+        ids = {pid for pid in (_as_uuid(p) for p in product_ids) if pid is not None}
+        products: List[Product] = []
+        if ids:
+            queryset = Product.objects.filter(product_id__in=ids).prefetch_related(
+                Prefetch('modifiers', Modifier.objects.filter(is_available=True), to_attr='available_modifiers')
+            )
+            if organization_id is not None:
+                queryset = queryset.filter(organization_id=organization_id, menu__is_active=True)
+            products = list(queryset)
+        blocked = blocked_product_pks(organization_id, terminal_id) if organization_id is not None else frozenset()
+        return cls(organization_id, terminal_id, products, blocked)
+
+    def for_terminal(self, organization_id, terminal_id) -> Optional['CartSnapshot']:
+        """
+        Снимок для заказа организации и терминала: этот же (стоп-лист перечитывается из индекса,
+        если терминал другой) или None, если снимок собран для другой организации.
+        """
+        if self.organization_id is None or str(self.organization_id) != str(organization_id):
+            return None
+        if str(self.terminal_id or '') == str(terminal_id or ''):
+            return self
+        return CartSnapshot(
+            organization_id, terminal_id, self.products.values(),
+            blocked_product_pks(organization_id, terminal_id),
+        )
+
+    def product(self, product_id) -> Optional[Product]:
+        return self.products.get(_as_uuid(product_id))
+
+    def is_blocked(self, product: Product) -> bool:
+        return product.pk in self.blocked
+
+    def modifier(self, product: Product, modifier_id) -> Optional[Modifier]:
+        return self.modifiers.get(product.product_id, {}).get(_as_uuid(modifier_id))
+
+    def required_modifiers(self, product: Product) -> List[Modifier]:
+        """Обязательные модификаторы (is_required или min_amount > 0) — добавляются к позиции автоматически."""
+        if not product.has_modifiers:
+            return []
+        return [
+            m for m in self.modifiers.get(product.product_id, {}).values()
+            if m.is_required or (m.min_amount or 0) > 0
+        ]
@@ -0,0 +1,188 @@
+import json
+import statistics
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from core.events import get_hub, get_redis, publish, stream_events
+
+
+class _Consumer(threading.Thread):
+    """Подписчик: ждёт expected событий bench и записывает задержку публикация -> получение."""
+
+    def __init__(self, channels, expected, deadline, started, mode):
+        super().__init__(daemon=True)
+        self.channels = channels
+        self.expected = expected
+        self.deadline = deadline
+        self.started = started
+        self.mode = mode
+        self.latencies = []
+
+    def run(self):
+        if self.mode == 'hub':
+            self._run_hub()
+        else:
+            self._run_direct()
+
+    def _record(self, data):
+        self.latencies.append(time.time() - json.loads(data)['t'])
+
+    def _run_hub(self):
+        # Тот же путь, что у SSE-ответа: stream_events поверх EventHub
+        events = stream_events(self.channels)
+        try:
+            for chunk in events:
+                if 'event: ready' in chunk or 'event: reset' in chunk:
+                    self.started.release()
+                elif 'event: bench' in chunk:
+                    self._record(chunk.rsplit('data: ', 1)[1])
+                if len(self.latencies) >= self.expected or time.monotonic() > self.deadline:
+                    return
+        finally:
+            events.close()
+
+    def _run_direct(self):
+        # Прежняя схема: собственный блокирующий XREAD на каждое соединение
+        client = get_redis()
+        cursors = {}
+        for ch in self.channels:
+            last = client.xrevrange(ch, count=1)
+            cursors[ch] = last[0][0] if last else '0-0'
+        self.started.release()
+        while len(self.latencies) < self.expected and time.monotonic() < self.deadline:
+            response = client.xread(cursors, count=100, block=1000)
+            for ch, entries in response or []:
+                for entry_id, fields in entries:
+                    cursors[ch] = entry_id
+                    if fields.get('event') == 'bench':
+                        self._record(fields['data'])
+
+
+class _Ready:
+    """Счётчик подписавшихся (release от потоков, wait в основном потоке)."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.count = 0
+
+    def release(self):
+        with self._cond:
+            self.count += 1
+            self._cond.notify_all()
+
+    def wait_for(self, n, timeout):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.count >= n, timeout=timeout)
+
+
+def _connected_clients(client):
+    # INFO может быть запрещён (управляемый Redis) — тогда без числа соединений
+    try:
+        return client.info('clients').get('connected_clients')
+    except Exception:
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark SSE fan-out of order status events on one process: N subscribers either share '
+        'one organization channel or each follow its own user channel. Compares the per-process '
+        'EventHub (one XREAD) with a blocking XREAD connection per subscriber. Needs Redis '
+        '(EVENTS_REDIS_URL); benchmark streams are deleted afterwards. Measures Redis fan-out only: '
+        'it runs every subscriber in one process and says nothing about how many open streams a '
+        'gunicorn deployment can hold (each holds a worker thread; see EVENTS_SSE_ENABLED).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=2000, help='Concurrent subscribers (one thread each)')
+        parser.add_argument('--events', type=int, default=20, help='Events per subscriber')
+        parser.add_argument('--interval-ms', type=float, default=50.0, help='Pause between publish rounds')
+        parser.add_argument('--scenario', choices=['organization', 'users', 'both'], default='both')
+        parser.add_argument('--mode', choices=['hub', 'direct', 'both'], default='hub')
+        parser.add_argument('--timeout', type=float, default=60.0, help='Per run limit, seconds')
+
+    def handle(self, *args, **options):
+        try:
+            get_redis().ping()
+        except Exception as e:
+            raise CommandError(f'Redis unavailable: {e}')
+
+        # Небольшой стек: тысячи потоков-подписчиков, как потоки gthread-воркера
+        threading.stack_size(256 * 1024)
+        scenarios = ['organization', 'users'] if options['scenario'] == 'both' else [options['scenario']]
+        modes = ['hub', 'direct'] if options['mode'] == 'both' else [options['mode']]
+        with override_settings(EVENTS_SSE_MAX_DURATION=options['timeout'] + 5, EVENTS_SSE_HEARTBEAT=1):
+            for scenario in scenarios:
+                for mode in modes:
+                    self._run(scenario, mode, options)
+
+    def _run(self, scenario, mode, options):
+        n, events = options['subscribers'], options['events']
+        run_id = uuid.uuid4().hex[:8]
+        if scenario == 'organization':
+            shared = f'events:bench:{run_id}:org'
+            channels = [[shared] for _ in range(n)]
+            targets = [shared]
+        else:
+            channels = [[f'events:bench:{run_id}:user:{i}'] for i in range(n)]
+            targets = [c[0] for c in channels]
+        client = get_redis()
+        connections_before = _connected_clients(client)
+
+        deadline = time.monotonic() + options['timeout']
+        ready = _Ready()
+        consumers = [_Consumer(c, events, deadline, ready, mode) for c in channels]
+        started = time.perf_counter()
+        for consumer in consumers:
+            consumer.start()
+        if not ready.wait_for(n, timeout=options['timeout']):
+            raise CommandError(f'{scenario}/{mode}: only {ready.count} of {n} subscribers connected')
+        subscribe_time = time.perf_counter() - started
+        if mode == 'hub':
+            # Хаб добавляет новые каналы в XREAD со следующего цикла
+            time.sleep(1.2)
+        connections = _connected_clients(client)
+
+        published = time.perf_counter()
+        for i in range(events):
+            if len(targets) == 1:
+                publish(targets[0], 'bench', {'t': time.time(), 'i': i})
+            else:
+                pipe = client.pipeline(transaction=False)
+                payload = json.dumps({'t': time.time(), 'i': i})
+                for ch in targets:
+                    pipe.xadd(ch, {'event': 'bench', 'data': payload}, maxlen=events + 10, approximate=True)
+                pipe.execute()
+            time.sleep(options['interval_ms'] / 1000.0)
+        for consumer in consumers:
+            consumer.join(max(0.0, deadline - time.monotonic()) + 1)
+        elapsed = time.perf_counter() - published
+
+        latencies = sorted(l for consumer in consumers for l in consumer.latencies)
+        expected = n * events
+        for i in range(0, len(targets), 1000):
+            client.delete(*targets[i:i + 1000])
+
+        label = f'{scenario:<12} {mode:<6}'
+        if not latencies:
+            self.stdout.write(self.style.ERROR(f'{label} no events delivered'))
+            return
+
+        def pct(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write(
+            f'{label} subscribers={n} delivered={len(latencies)}/{expected} '
+            f'subscribe={subscribe_time:.2f}s throughput={len(latencies) / elapsed:,.0f} ev/s '
+            f'latency p50={pct(0.5):.1f} ms p95={pct(0.95):.1f} ms p99={pct(0.99):.1f} ms '
+            f'max={latencies[-1] * 1000:.1f} ms mean={statistics.mean(latencies) * 1000:.1f} ms '
+            f'redis_clients={connections_before}->{connections}'
+        )
+        if mode == 'hub':
+            self.stdout.write(f'{"":<20} hub subscribers after run: {get_hub().subscriber_count()}')
+        if len(latencies) < expected:
+            self.stdout.write(self.style.WARNING(f'{label} {expected - len(latencies)} events not delivered in time'))
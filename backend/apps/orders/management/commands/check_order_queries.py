@@ -0,0 +1,101 @@
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps.orders.views import OrderViewSet
+from apps.organizations.models import Organization, Terminal
+from apps.products.models import Menu, Modifier, Product, ProductCategory
+from apps.users.models import Role, User
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Regression check: creating an order (POST /orders/) must run a constant number of queries '
+        'regardless of cart size. Each item has one chosen and one required modifier. '
+        'Test data is created in a rolled-back transaction.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=15, help='Cart size of the first run (second run doubles it)')
+        parser.add_argument('--verbose-queries', action='store_true', help='Print the queries of the first run')
+
+    def handle(self, *args, **options):
+        small = max(1, options['items'])
+        counts = {}
+        for size in (small, small * 2):
+            try:
+                with transaction.atomic():
+                    counts[size] = self._measure(size, options['verbose_queries'] and size == small)
+                    raise _Rollback()
+            except _Rollback:
+                pass
+
+        a, b = counts[small], counts[small * 2]
+        line = f'order create  {small} items: {a} queries, {small * 2} items: {b} queries'
+        if a != b:
+            self.stdout.write(self.style.ERROR(line))
+            raise CommandError('Query count grows with cart size (per-item queries in order creation)')
+        self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS('Order creation query count is constant'))
+
+    def _measure(self, size, verbose):
+        org = Organization.objects.create(org_name=f'order-check-{uuid.uuid4().hex[:8]}', is_active=True)
+        terminal = Terminal.objects.create(terminal_id=uuid.uuid4(), organization=org, is_active=True)
+        menu = Menu.objects.create(organization=org, menu_name='order-check', is_active=True)
+        category = ProductCategory.objects.create(subgroup_id=uuid.uuid4(), subgroup_name='C', menu=menu)
+        products = Product.objects.bulk_create([
+            Product(
+                product_id=uuid.uuid4(), menu=menu, organization=org, category=category,
+                product_name=f'p{i}', price=100 + i, is_available=True, has_modifiers=True,
+            )
+            for i in range(size)
+        ])
+        chosen = {}
+        modifiers = []
+        for product in products:
+            optional = Modifier(
+                modifier_id=uuid.uuid4(), product=product, modifier_name='opt', price=10,
+                min_amount=0, max_amount=3, is_available=True,
+            )
+            required = Modifier(
+                modifier_id=uuid.uuid4(), product=product, modifier_name='req', price=0,
+                min_amount=1, max_amount=1, is_required=True, is_available=True,
+            )
+            chosen[product.pk] = optional.modifier_id
+            modifiers.extend([optional, required])
+        Modifier.objects.bulk_create(modifiers)
+        role, _ = Role.objects.get_or_create(role_name=Role.CUSTOMER)
+        user = User.objects.create(username=f'order-check-{uuid.uuid4().hex[:8]}', role=role, organization=org)
+
+        payload = {
+            'delivery_type': 'pickup',
+            'terminal_id': str(terminal.terminal_id),
+            'phone': '+77000000000',
+            'items': [
+                {
+                    'product_id': str(p.product_id),
+                    'quantity': 2,
+                    'modifiers': [{'modifier_id': str(chosen[p.pk]), 'quantity': 1}],
+                }
+                for p in products
+            ],
+        }
+        request = APIRequestFactory().post('/', payload, format='json')
+        force_authenticate(request, user=user)
+        view = OrderViewSet.as_view({'post': 'create'})
+        with CaptureQueriesContext(connection) as ctx:
+            response = view(request)
+            response.render()
+        if response.status_code != 201:
+            raise CommandError(f'HTTP {response.status_code}: {response.data}')
+        if verbose:
+            for query in ctx.captured_queries:
+                self.stdout.write(f"  {query['sql'][:160]}")
+        return len(ctx)
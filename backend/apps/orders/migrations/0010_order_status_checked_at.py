@@ -0,0 +1,18 @@
+# Generated manually: время последней сверки статуса заказа с iiko (пакетный опрос статусов)
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_order_retry_count_sent_to_backup_webhook'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='status_checked_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Статус проверен в iiko'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated manually: очередь отправки заказов в iiko (transactional outbox)
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations', '0026_terminal_stop_list_adaptive'),
+        ('orders', '0010_order_status_checked_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает отправки'), ('processing', 'Отправляется'), ('done', 'Обработан'), ('failed', 'Не отправлен')], default='pending', max_length=20, verbose_name='Статус')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Попыток')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Следующая попытка')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='Занята до')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='Последняя ошибка')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='Обработан')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+                ('order', models.ForeignKey(db_column='order_id', on_delete=django.db.models.deletion.CASCADE, related_name='outbox_entries', to='orders.order', verbose_name='Заказ')),
+                ('organization', models.ForeignKey(db_column='org_id', on_delete=django.db.models.deletion.CASCADE, related_name='order_outbox', to='organizations.organization', verbose_name='Организация')),
+            ],
+            options={
+                'verbose_name': 'Отправка заказа в iiko',
+                'verbose_name_plural': 'Очередь отправки заказов в iiko',
+                'db_table': 'order_outbox',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='order_outbox_due_idx')],
+            },
+        ),
+    ]
@@ -1,5 +1,6 @@
 import uuid
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 class Order(models.Model):
@@ -30,6 +31,12 @@ class Order(models.Model):
         (STATUS_SENT_TO_BACKUP_WEBHOOK, 'Отправлен на резервный вебхук'),
     ]
     
+    # После этих статусов заказ больше не опрашивается в iiko (включая конечные статусы доставки iiko)
+    FINAL_STATUSES = (
+        STATUS_COMPLETED, STATUS_CANCELLED, STATUS_ERROR, STATUS_SENT_TO_BACKUP_WEBHOOK,
+        'Delivered', 'Closed', 'Cancelled',
+    )
+    
     order_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     iiko_order_id = models.UUIDField('ID заказа в iiko', null=True, blank=True)
     correlation_id = models.UUIDField('Correlation ID iiko', null=True, blank=True)
@@ -105,6 +112,8 @@ class Order(models.Model):
     
     # Умный повтор: сколько раз уже повторяли отправку в iiko (0, 1, 2)
     retry_count = models.PositiveSmallIntegerField('Количество повторов в iiko', default=0)
+    # Когда статус последний раз сверялся с iiko (пакетный опрос или проверка по запросу)
+    status_checked_at = models.DateTimeField('Статус проверен в iiko', null=True, blank=True)
     
     created_at = models.DateTimeField('Создан', auto_now_add=True)
     updated_at = models.DateTimeField('Обновлен', auto_now=True)
@@ -148,6 +157,59 @@ class IikoRequestLog(models.Model):
         return f"Лог {self.order_id} ({self.created_at})"
 
 
+class OrderOutbox(models.Model):
+    """
+    Очередь отправки заказов в iiko (transactional outbox).
+    Запись создаётся в одной транзакции с заказом; отправку выполняет dispatch_order_outbox.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Ожидает отправки'),
+        (STATUS_PROCESSING, 'Отправляется'),
+        (STATUS_DONE, 'Обработан'),
+        (STATUS_FAILED, 'Не отправлен'),
+    ]
+
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name='outbox_entries',
+        verbose_name='Заказ',
+        db_column='order_id'
+    )
+    organization = models.ForeignKey(
+        'organizations.Organization',
+        on_delete=models.CASCADE,
+        related_name='order_outbox',
+        verbose_name='Организация',
+        db_column='org_id'
+    )
+    status = models.CharField('Статус', max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField('Попыток', default=0)
+    next_attempt_at = models.DateTimeField('Следующая попытка', default=timezone.now)
+    # Запись выдана воркеру до этого момента; после — считается потерянной и выдаётся снова
+    locked_until = models.DateTimeField('Занята до', null=True, blank=True)
+    last_error = models.TextField('Последняя ошибка', blank=True, null=True)
+    processed_at = models.DateTimeField('Обработан', null=True, blank=True)
+    created_at = models.DateTimeField('Создан', auto_now_add=True)
+
+    class Meta:
+        db_table = 'order_outbox'
+        verbose_name = 'Отправка заказа в iiko'
+        verbose_name_plural = 'Очередь отправки заказов в iiko'
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='order_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"Отправка {self.order_id} ({self.get_status_display()})"
+
+
 class OrderItem(models.Model):
     """Позиция заказа"""
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -0,0 +1,79 @@
+"""
+События статусов заказов (core.events, SSE).
+
+Каналы:
+- пользователь — заказы покупателя (TMA, сайт);
+- организация — все заказы организации (панель администратора).
+
+Событие order_status: {"order_id", "status", "previous_status", "order_number", "updated_at"};
+previous_status = null — новый заказ. Публикуется при каждой смене статуса: отправка в iiko
+(send_to_iiko, repeat_order_to_iiko), проверка статуса создания, фоновый опрос iiko
+(poll_order_statuses), резервный вебхук, отмена.
+
+EventSource не передаёт заголовок Authorization, поэтому подписка идёт по короткоживущему
+подписанному токену (issue_stream_token) в параметре token, а не по JWT в URL.
+Пока SSE выключены (EVENTS_SSE_ENABLED, см. core.events), токен не выдается и клиенты
+не подписываются.
+"""
+from typing import List, Optional
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+from core.events import channel_name, publish_on_commit
+
+TOKEN_SALT = 'orders.events'
+
+
+def user_channel(user_id) -> str:
+    return channel_name('orders', 'user', user_id)
+
+
+def organization_channel(organization_id) -> str:
+    return channel_name('orders', 'org', organization_id)
+
+
+def publish_order_status(order, previous_status: Optional[str] = None, created: bool = False) -> None:
+    """Публикует смену статуса заказа после коммита; без смены (и не новый заказ) — ничего."""
+    if not created and previous_status == order.status:
+        return
+    data = {
+        'order_id': str(order.order_id),
+        'status': order.status,
+        'previous_status': None if created else previous_status,
+        'order_number': order.order_number,
+        'updated_at': timezone.now().isoformat(),
+    }
+    if order.user_id:
+        publish_on_commit(user_channel(order.user_id), 'order_status', data)
+    if order.organization_id:
+        publish_on_commit(organization_channel(order.organization_id), 'order_status', data)
+
+
+def _token_ttl() -> int:
+    return getattr(settings, 'ORDER_EVENTS_TOKEN_TTL', 60 * 60)
+
+
+def issue_stream_token(user, organization_id=None) -> str:
+    """Токен подписки на события пользователя (и организации — для администраторов)."""
+    payload = {'u': str(user.pk)}
+    if organization_id:
+        payload['o'] = str(organization_id)
+    return signing.dumps(payload, salt=TOKEN_SALT, compress=True)
+
+
+def load_stream_token(token: str) -> Optional[dict]:
+    """Содержимое токена; None — токен неверный или просрочен."""
+    try:
+        return signing.loads(token, salt=TOKEN_SALT, max_age=_token_ttl())
+    except signing.BadSignature:
+        return None
+
+
+def channels_for_token(payload: dict) -> List[str]:
+    """Каналы подписки по содержимому токена (load_stream_token)."""
+    channels = [user_channel(payload['u'])]
+    if payload.get('o'):
+        channels.append(organization_channel(payload['o']))
+    return channels
@@ -0,0 +1,150 @@
+"""
+Transactional outbox отправки заказов в iiko.
+
+Раньше заказ ставился в Celery из transaction.on_commit: если брокер недоступен в момент
+публикации, заказ не уходил в iiko, а smart_retry видит только последние 10 минут.
+Теперь в транзакции создания заказа пишется запись OrderOutbox; после коммита диспетчер
+лишь «подталкивается» (kick), а при сбое брокера запись подберёт периодический запуск.
+
+Диспетчер (claim_due) выдаёт записи пачками с ограничением числа одновременных отправок
+на организацию; выданная запись арендуется на ORDER_OUTBOX_LEASE секунд — если воркер
+пропал, запись выдаётся снова. Доставка at-least-once: повторная отправка того же заказа
+отсекается проверкой sent_to_iiko_at под блокировкой строки заказа.
+
+Повторы с нарастающей задержкой — для сбоев самой доставки (исключение в задаче, потерянный
+воркер, недоступный брокер). Ответ iiko с ошибкой — результат отправки: заказ получает
+статус Error и дальше идёт по обычному пути smart_retry (резервный вебхук), без повтора
+отсюда, иначе заказ ушёл бы и на вебхук, и в iiko.
+"""
+import logging
+from collections import Counter
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+
+from .models import Order, OrderOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_order(order: Order) -> OrderOutbox:
+    """Запись в очередь отправки; вызывать в транзакции создания заказа."""
+    entry = OrderOutbox.objects.create(order=order, organization_id=order.organization_id)
+    transaction.on_commit(kick)
+    return entry
+
+
+def kick() -> None:
+    """Запустить диспетчер сейчас, не дожидаясь расписания; сбой брокера не страшен — запись в БД."""
+    from .tasks import dispatch_order_outbox
+
+    try:
+        dispatch_order_outbox.delay()
+    except Exception as e:
+        logger.warning(f"Очередь отправки заказов: диспетчер не запущен ({e}), сработает по расписанию")
+
+
+def retry_delay(attempts: int) -> timedelta:
+    """Задержка перед следующей попыткой: base * 2^(attempts-1), не больше ORDER_OUTBOX_RETRY_MAX."""
+    base = getattr(settings, 'ORDER_OUTBOX_RETRY_BASE', 30)
+    cap = getattr(settings, 'ORDER_OUTBOX_RETRY_MAX', 10 * 60)
+    return timedelta(seconds=min(cap, base * 2 ** max(0, attempts - 1)))
+
+
+def claim_due(now=None) -> List[OrderOutbox]:
+    """
+    Выдаёт записи к отправке (ожидающие и с истёкшей арендой), не больше ORDER_OUTBOX_BATCH_SIZE
+    и не больше ORDER_OUTBOX_ORG_CONCURRENCY одновременных отправок на организацию.
+    Вызывать в транзакции: строки блокируются (skip_locked), параллельный диспетчер их пропустит.
+    """
+    now = now or timezone.now()
+    batch_size = getattr(settings, 'ORDER_OUTBOX_BATCH_SIZE', 200)
+    per_org = getattr(settings, 'ORDER_OUTBOX_ORG_CONCURRENCY', 4)
+    lease = timedelta(seconds=getattr(settings, 'ORDER_OUTBOX_LEASE', 5 * 60))
+
+    busy = Counter(
+        OrderOutbox.objects.filter(status=OrderOutbox.STATUS_PROCESSING, locked_until__gt=now)
+        .values_list('organization_id', flat=True)
+    )
+    candidates = (
+        OrderOutbox.objects.select_for_update(skip_locked=True)
+        .filter(
+            Q(status=OrderOutbox.STATUS_PENDING, next_attempt_at__lte=now)
+            | Q(status=OrderOutbox.STATUS_PROCESSING, locked_until__lte=now)
+        )
+        .order_by('next_attempt_at')[:batch_size * 2]
+    )
+    claimed = []
+    for entry in candidates:
+        if busy[entry.organization_id] >= per_org:
+            continue
+        busy[entry.organization_id] += 1
+        if entry.status == OrderOutbox.STATUS_PROCESSING:
+            logger.warning(f"Очередь отправки заказов: аренда записи {entry.pk} истекла, выдаём снова")
+        entry.status = OrderOutbox.STATUS_PROCESSING
+        entry.locked_until = now + lease
+        entry.attempts += 1
+        claimed.append(entry)
+        if len(claimed) >= batch_size:
+            break
+    if claimed:
+        OrderOutbox.objects.bulk_update(claimed, ['status', 'locked_until', 'attempts'])
+    return claimed
+
+
+def mark_done(entry: OrderOutbox, error: Optional[str] = None) -> None:
+    entry.status = OrderOutbox.STATUS_DONE
+    entry.locked_until = None
+    entry.processed_at = timezone.now()
+    entry.last_error = error
+    entry.save(update_fields=['status', 'locked_until', 'processed_at', 'last_error'])
+
+
+def mark_retry(entry: OrderOutbox, error: str) -> None:
+    """Неудачная попытка: повтор с задержкой или, после ORDER_OUTBOX_MAX_ATTEMPTS, failed."""
+    max_attempts = getattr(settings, 'ORDER_OUTBOX_MAX_ATTEMPTS', 8)
+    entry.locked_until = None
+    entry.last_error = error
+    if entry.attempts >= max_attempts:
+        entry.status = OrderOutbox.STATUS_FAILED
+        entry.processed_at = timezone.now()
+        logger.error(f"Очередь отправки заказов: заказ {entry.order_id} не отправлен за {entry.attempts} попыток: {error}")
+    else:
+        entry.status = OrderOutbox.STATUS_PENDING
+        entry.next_attempt_at = timezone.now() + retry_delay(entry.attempts)
+    entry.save(update_fields=['status', 'locked_until', 'last_error', 'processed_at', 'next_attempt_at'])
+
+
+def has_due(organization_id, now=None) -> bool:
+    now = now or timezone.now()
+    return OrderOutbox.objects.filter(
+        organization_id=organization_id, status=OrderOutbox.STATUS_PENDING, next_attempt_at__lte=now
+    ).exists()
+
+
+def backlog_stats(now=None) -> Dict[str, object]:
+    """Размер очереди: записи по статусам (кроме обработанных) и возраст самой старой ожидающей (сек)."""
+    now = now or timezone.now()
+    open_entries = OrderOutbox.objects.filter(status__in=[
+        OrderOutbox.STATUS_PENDING, OrderOutbox.STATUS_PROCESSING, OrderOutbox.STATUS_FAILED,
+    ])
+    counts = dict(open_entries.values_list('status').annotate(n=Count('id')).order_by())
+    oldest = open_entries.filter(status=OrderOutbox.STATUS_PENDING).aggregate(oldest=Min('created_at'))['oldest']
+    return {
+        'pending': counts.get(OrderOutbox.STATUS_PENDING, 0),
+        'processing': counts.get(OrderOutbox.STATUS_PROCESSING, 0),
+        'failed': counts.get(OrderOutbox.STATUS_FAILED, 0),
+        'oldest_pending_age': round((now - oldest).total_seconds()) if oldest else 0,
+    }
+
+
+def purge_processed(now=None) -> int:
+    """Удаляет обработанные записи старше ORDER_OUTBOX_RETENTION_DAYS."""
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=getattr(settings, 'ORDER_OUTBOX_RETENTION_DAYS', 7))
+    deleted, _ = OrderOutbox.objects.filter(status=OrderOutbox.STATUS_DONE, processed_at__lt=cutoff).delete()
+    return deleted
@@ -3,7 +3,7 @@ from decimal import Decimal
 from datetime import time
 from django.utils import timezone
 from .models import Order, OrderItem, OrderItemModifier
-from apps.products.models import Product, Modifier, StopList
+from .cart_snapshot import CONTEXT_KEY as CART_SNAPSHOT_KEY, CartSnapshot
 from apps.users.models import DeliveryAddress
 from apps.organizations.models import PaymentType, Terminal
 from apps.iiko_integration.user_messages import iiko_error_message_for_user
@@ -45,100 +45,64 @@ class OrderItemCreateSerializer(serializers.Serializer):
         default=list
     )
     
-    def validate_product_id(self, value):
-        """Проверка существования продукта (из активного меню организации)."""
+    def _snapshot(self) -> CartSnapshot:
+        """Снимок всей корзины: строится при валидации первой позиции, общий для остальных и для create_order."""
+        snapshot = self.context.get(CART_SNAPSHOT_KEY)
+        if snapshot is not None:
+            return snapshot
         request = self.context.get('request')
-        if not request or not getattr(request.user, 'organization', None):
-            return value
-        product = Product.objects.filter(
-            product_id=value,
-            organization=request.user.organization,
-            menu__is_active=True,
-        ).first()
-        if not product:
-            raise serializers.ValidationError('Продукт не найден')
-        if not product.is_available:
-            raise serializers.ValidationError('Продукт недоступен для заказа')
-        return value
+        organization = getattr(request.user, 'organization', None) if request else None
+        terminal_id = None
+        if request is not None and hasattr(request, 'data') and isinstance(request.data, dict):
+            terminal_id = request.data.get('terminal_id')
+        initial = getattr(self.root, 'initial_data', None)
+        items = initial.get('items') if isinstance(initial, dict) and self.root is not self else [initial]
+        product_ids = [item.get('product_id') for item in items or [] if isinstance(item, dict)]
+        snapshot = CartSnapshot.load(organization.pk if organization else None, product_ids, terminal_id)
+        self.context[CART_SNAPSHOT_KEY] = snapshot
+        return snapshot
 
     def validate(self, attrs):
-        """Валидация позиции заказа"""
-        product_id = attrs.get('product_id')
-        request = self.context.get('request')
-        organization = getattr(request.user, 'organization', None) if request else None
-        if organization:
-            product = Product.objects.filter(
-                product_id=product_id,
-                organization=organization,
-                menu__is_active=True,
-            ).first()
-        else:
-            product = Product.objects.filter(product_id=product_id).first()
+        """Валидация позиции заказа (по снимку корзины, без запросов на каждую позицию)"""
+        snapshot = self._snapshot()
+        product = snapshot.product(attrs.get('product_id'))
         if not product:
             raise serializers.ValidationError({'product_id': 'Продукт не найден'})
+        if snapshot.organization_id is not None and not product.is_available:
+            raise serializers.ValidationError({'product_id': 'Продукт недоступен для заказа'})
 
-        # Проверяем стоп-лист с учетом terminal_id
-        if request and organization:
-            # Получаем terminal_id из данных заказа (если есть)
-            terminal_id = None
-            if hasattr(request, 'data') and isinstance(request.data, dict):
-                terminal_id = request.data.get('terminal_id')
-
-            stop_list_query = StopList.objects.filter(
-                product=product,
-                organization=organization
-            )
-            
-            # Если указан terminal_id, проверяем по нему
-            if terminal_id:
-                try:
-                    from apps.organizations.models import Terminal
-                    terminal = Terminal.objects.get(terminal_id=terminal_id)
-                    if stop_list_query.filter(terminal=terminal).exists():
-                        raise serializers.ValidationError({
-                            'product_id': f'Продукт "{product.product_name}" временно недоступен в выбранном филиале'
-                        })
-                except (Terminal.DoesNotExist, ValueError):
-                    # Если terminal не найден, проверяем по организации
-                    if stop_list_query.exists():
-                        raise serializers.ValidationError({
-                            'product_id': f'Продукт "{product.product_name}" временно недоступен'
-                        })
-            else:
-                # Если terminal_id не указан, проверяем по организации
-                if stop_list_query.exists():
-                    raise serializers.ValidationError({
-                        'product_id': f'Продукт "{product.product_name}" временно недоступен'
-                    })
+        # Стоп-лист терминала (terminal_id из данных заказа), а если он не указан или не найден — организации
+        if snapshot.is_blocked(product):
+            if snapshot.terminal_id:
+                raise serializers.ValidationError({
+                    'product_id': f'Продукт "{product.product_name}" временно недоступен в выбранном филиале'
+                })
+            raise serializers.ValidationError({
+                'product_id': f'Продукт "{product.product_name}" временно недоступен'
+            })
         
         # Валидация модификаторов: проверяем только переданные (опциональные).
         # Обязательные (is_required или min_amount > 0) добавляются автоматически в OrderService.
-        modifiers_data = attrs.get('modifiers', [])
-        if modifiers_data:
-            product_modifiers = {
-                m.modifier_id: m
-                for m in Modifier.objects.filter(product=product, is_available=True)
-            }
-            for mod_data in modifiers_data:
-                modifier_id = mod_data.get('modifier_id')
-                quantity = mod_data.get('quantity', 1)
-                if not modifier_id:
-                    raise serializers.ValidationError({
-                        'modifiers': 'Не указан modifier_id'
-                    })
-                modifier = product_modifiers.get(modifier_id)
-                if not modifier:
-                    raise serializers.ValidationError({
-                        'modifiers': f'Модификатор {modifier_id} не найден для этого продукта'
-                    })
-                if quantity < modifier.min_amount:
-                    raise serializers.ValidationError({
-                        'modifiers': f'Минимальное количество для {modifier.modifier_name}: {modifier.min_amount}'
-                    })
-                if quantity > modifier.max_amount:
-                    raise serializers.ValidationError({
-                        'modifiers': f'Максимальное количество для {modifier.modifier_name}: {modifier.max_amount}'
-                    })
+        for mod_data in attrs.get('modifiers', []):
+            modifier_id = mod_data.get('modifier_id')
+            quantity = mod_data.get('quantity', 1)
+            if not modifier_id:
+                raise serializers.ValidationError({
+                    'modifiers': 'Не указан modifier_id'
+                })
+            modifier = snapshot.modifier(product, modifier_id)
+            if not modifier:
+                raise serializers.ValidationError({
+                    'modifiers': f'Модификатор {modifier_id} не найден для этого продукта'
+                })
+            if quantity < modifier.min_amount:
+                raise serializers.ValidationError({
+                    'modifiers': f'Минимальное количество для {modifier.modifier_name}: {modifier.min_amount}'
+                })
+            if quantity > modifier.max_amount:
+                raise serializers.ValidationError({
+                    'modifiers': f'Максимальное количество для {modifier.modifier_name}: {modifier.max_amount}'
+                })
         return attrs
 
 
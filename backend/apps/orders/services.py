@@ -9,14 +9,16 @@ from typing import Dict, List, Optional, Union, Any
 import random
 import re
 import requests
+from django.conf import settings
 from django.db import transaction
-from django.db.models import Prefetch
 from django.utils import timezone
+from .cart_snapshot import CartSnapshot
 from .models import Order, OrderItem, OrderItemModifier, IikoRequestLog
+from .order_events import publish_order_status
 from .serializers import OrderDetailSerializer
-from apps.products.models import Product, Modifier, StopList
 from apps.users.models import User, DeliveryAddress, BillingPhone
 from apps.organizations.models import Organization, PaymentType, Terminal
+from apps.organizations.terminal_selection import select_terminal
 from apps.iiko_integration.client import IikoClient, IikoAPIException
 
 
@@ -109,15 +111,58 @@ class OrderService:
             return user.username
         return "Клиент"
     
+    @staticmethod
+    def _terminal_by_location(
+        organization: Organization,
+        validated_data: Dict,
+        delivery_address: Optional[DeliveryAddress],
+        snapshot: Optional[CartSnapshot],
+        terminal_ids=None,
+    ) -> Optional[Terminal]:
+        """
+        Терминал по зонам доставки (apps.organizations.terminal_selection) для заказа с доставкой
+        без выбранного терминала: координаты из запроса или сохраненного адреса, сумма — по снимку корзины.
+        """
+        delivery_type = (validated_data.get('delivery_type') or 'delivery').strip().lower()
+        if delivery_type != 'delivery':
+            return None
+        latitude, longitude = validated_data.get('latitude'), validated_data.get('longitude')
+        if (latitude is None or longitude is None) and delivery_address is not None:
+            latitude, longitude = delivery_address.latitude, delivery_address.longitude
+        if latitude is None or longitude is None:
+            return None
+
+        order_amount = Decimal('0')
+        if snapshot is not None:
+            for item in validated_data.get('items', []):
+                product = snapshot.product(item.get('product_id'))
+                if product is not None:
+                    order_amount += (product.price or 0) * (item.get('quantity') or 1)
+
+        choice = select_terminal(
+            organization.pk, float(latitude), float(longitude), float(order_amount),
+            terminal_ids=list(terminal_ids) if terminal_ids is not None else None,
+        )
+        if choice['terminal'] is None:
+            return None
+        logger.info(
+            f"Терминал заказа выбран по зоне доставки: {choice['terminal'].pk} "
+            f"({choice['quote'].get('zone_name')}) из {len(choice['candidates'])}"
+        )
+        return Terminal.objects.get(pk=choice['terminal'].pk)
+
     @transaction.atomic
     def create_order(
         self,
         user: User,
         organization: Organization,
-        validated_data: Dict
+        validated_data: Dict,
+        snapshot: Optional[CartSnapshot] = None,
     ) -> Order:
         """
-        Создание заказа в базе данных
+        Создание заказа в базе данных.
+        Позиции собираются в памяти по снимку корзины (snapshot из валидации OrderCreateSerializer
+        или загруженному здесь) и пишутся двумя bulk_create — число запросов не зависит от корзины.
         """
         # Получаем данные
         delivery_address_id = validated_data.get('delivery_address_id')
@@ -133,6 +178,17 @@ class OrderService:
         # Сумма доставки (если фронт её уже посчитал и передал отдельно)
         delivery_cost = validated_data.get('delivery_cost')
         
+        # Получаем адрес доставки если указан
+        delivery_address = None
+        if delivery_address_id:
+            try:
+                delivery_address = DeliveryAddress.objects.get(
+                    id=delivery_address_id,
+                    user=user
+                )
+            except DeliveryAddress.DoesNotExist:
+                raise ValueError('Адрес доставки не найден')
+
         # 1. Determine the terminal to use
         selected_terminal = None
         if terminal_id:
@@ -142,34 +198,35 @@ class OrderService:
                 raise ValueError('Выбранный терминал не найден')
         else:
             # Attempt to determine automatically
-            user_terminals = user.terminals.all()
-            if user_terminals.count() == 1:
-                selected_terminal = user_terminals.first()
-            elif user_terminals.count() > 1:
-                raise ValueError('Необходимо выбрать терминал (выдано более одного)')
+            # Двух достаточно, чтобы отличить «один» от «несколько»
+            user_terminals = list(user.terminals.all()[:2])
+            if len(user_terminals) == 1:
+                selected_terminal = user_terminals[0]
+            elif len(user_terminals) > 1:
+                # Несколько терминалов — по зонам доставки среди выданных пользователю
+                selected_terminal = self._terminal_by_location(
+                    organization, validated_data, delivery_address, snapshot,
+                    terminal_ids=user.terminals.values_list('terminal_id', flat=True),
+                )
+                if not selected_terminal:
+                    raise ValueError('Необходимо выбрать терминал (выдано более одного)')
             else:
                 # No user terminals, check organization
-                org_terminals = organization.terminals.all()
-                if org_terminals.count() == 1:
-                    selected_terminal = org_terminals.first()
-                elif org_terminals.count() > 1:
-                    raise ValueError('Для организации доступно несколько терминалов, выберите один')
-                elif org_terminals.count() == 0:
+                org_terminals = list(organization.terminals.all()[:2])
+                if len(org_terminals) == 1:
+                    selected_terminal = org_terminals[0]
+                elif len(org_terminals) > 1:
+                    selected_terminal = self._terminal_by_location(
+                        organization, validated_data, delivery_address, snapshot,
+                    )
+                    if not selected_terminal:
+                        raise ValueError('Для организации доступно несколько терминалов, выберите один')
+                else:
                     raise ValueError('Для этой организации не настроены терминалы')
 
         if not selected_terminal:
              raise ValueError('Не удалось определить терминал для заказа')
         
-        # Получаем адрес доставки если указан
-        delivery_address = None
-        if delivery_address_id:
-            try:
-                delivery_address = DeliveryAddress.objects.get(
-                    id=delivery_address_id,
-                    user=user
-                )
-            except DeliveryAddress.DoesNotExist:
-                raise ValueError('Адрес доставки не найден')
         
         # Тип оплаты (может быть не указан, если не настроен)
         payment_type = None
@@ -234,8 +291,16 @@ class OrderService:
             except Exception:
                 delivery_cost_value = Decimal('0')
 
-        # Создаем заказ
-        order = Order.objects.create(
+        # Позиции — в памяти по снимку корзины (продукты, модификаторы, стоп-лист терминала)
+        terminal_key = selected_terminal.terminal_id if selected_terminal else None
+        if snapshot is not None:
+            snapshot = snapshot.for_terminal(organization.pk, terminal_key)
+        if snapshot is None:
+            snapshot = CartSnapshot.load(
+                organization.pk, [item_data['product_id'] for item_data in items_data], terminal_key
+            )
+
+        order = Order(
             user=user,
             organization=organization,
             status=Order.STATUS_PENDING,
@@ -251,71 +316,21 @@ class OrderService:
             longitude=validated_data.get('longitude')
         )
 
-        # Если у пользователя в профиле нет телефона — сохраним из заказа (B2C UX).
-        if phone and not user.phone:
-            user.phone = phone
-            user.save(update_fields=['phone'])
-
-        # При удалённой оплате по Kaspi по желанию пользователя сохраняем номер в BillingPhone
-        if system_type == 'remote_payment' and kaspi_phone and save_billing_phone:
-            existing = BillingPhone.objects.filter(
-                user=user,
-                phone=kaspi_phone
-            ).first()
-
-            if existing:
-                # Делаем существующий номер основным
-                if not existing.is_default:
-                    existing.is_default = True
-                    existing.save(update_fields=['is_default'])
-                    BillingPhone.objects.filter(user=user).exclude(
-                        id=existing.id
-                    ).update(is_default=False)
-            else:
-                bp = BillingPhone.objects.create(
-                    user=user,
-                    phone=kaspi_phone,
-                    is_default=True,
-                )
-                BillingPhone.objects.filter(user=user).exclude(
-                    id=bp.id
-                ).update(is_default=False)
-        
-        # Продукты только из активного меню организации (product_id не уникален глобально).
-        product_ids = [item_data['product_id'] for item_data in items_data]
-        products_map = {
-            p.product_id: p
-            for p in Product.objects.prefetch_related(
-                Prefetch('modifiers', Modifier.objects.filter(is_available=True))
-            ).filter(
-                product_id__in=product_ids,
-                organization=organization,
-                menu__is_active=True,
-            )
-        }
-
+        order_items = []
+        item_modifiers = []
         total_amount = Decimal('0')
-
         for item_data in items_data:
             product_id = item_data['product_id']
             quantity = item_data['quantity']
             modifiers_data = item_data.get('modifiers', [])
-            user_selected_modifier_ids = {m.get('modifier_id') for m in modifiers_data if m.get('modifier_id')}
+            user_selected_modifier_ids = set()
 
-            product = products_map.get(product_id)
+            product = snapshot.product(product_id)
             if not product:
-                order.delete()
                 raise ValueError(f'Продукт {product_id} не найден')
 
-            # Проверяем стоп-лист для выбранного терминала
-            stop_list_query = StopList.objects.filter(
-                product=product,
-                organization=organization
-            )
-            if selected_terminal:
-                stop_list_query = stop_list_query.filter(terminal=selected_terminal)
-            if stop_list_query.exists():
-                order.delete()
+            # Проверяем стоп-лист для выбранного терминала (индекс, без запроса к БД)
+            if snapshot.is_blocked(product):
                 raise ValueError(
                     f'Продукт "{product.product_name}" временно недоступен'
                     + (f' в филиале "{selected_terminal.terminal_group_name}"' if selected_terminal else '')
@@ -324,60 +339,85 @@ class OrderService:
             item_price = product.price
             item_total = item_price * quantity
 
-            order_item = OrderItem.objects.create(
+            order_item = OrderItem(
                 order=order,
                 product=product,
                 product_name=product.product_name,
                 quantity=quantity,
                 price=item_price,
-                total_price=item_total
             )
 
             # Модификаторы, выбранные пользователем (опциональные)
             for mod_data in modifiers_data:
                 modifier_id = mod_data.get('modifier_id')
                 mod_quantity = mod_data.get('quantity', 1)
-                try:
-                    modifier = Modifier.objects.get(
-                        modifier_id=modifier_id,
-                        product=product,
-                        is_available=True,
-                    )
-                    OrderItemModifier.objects.create(
-                        order_item=order_item,
-                        modifier=modifier,
-                        modifier_name=modifier.modifier_name,
-                        quantity=mod_quantity,
-                        price=modifier.price
-                    )
-                    item_total += modifier.price * mod_quantity * quantity
-                except Modifier.DoesNotExist:
+                modifier = snapshot.modifier(product, modifier_id)
+                if modifier is None:
                     logger.warning(f'Модификатор {modifier_id} не найден')
+                    continue
+                user_selected_modifier_ids.add(modifier.modifier_id)
+                item_modifiers.append(OrderItemModifier(
+                    order_item=order_item,
+                    modifier=modifier,
+                    modifier_name=modifier.modifier_name,
+                    quantity=mod_quantity,
+                    price=modifier.price
+                ))
+                item_total += modifier.price * mod_quantity * quantity
 
             # Обязательные модификаторы (is_required или min_amount > 0): добавляем автоматически
-            if product.has_modifiers:
-                for mod_def in product.modifiers.filter(is_available=True):
-                    if not (mod_def.is_required or (mod_def.min_amount or 0) > 0):
-                        continue
-                    if mod_def.modifier_id in user_selected_modifier_ids:
-                        continue
-                    qty = max(1, mod_def.min_amount or 0)
-                    OrderItemModifier.objects.create(
-                        order_item=order_item,
-                        modifier=mod_def,
-                        modifier_name=mod_def.modifier_name,
-                        quantity=qty,
-                        price=mod_def.price
-                    )
-                    item_total += mod_def.price * qty * quantity
+            for mod_def in snapshot.required_modifiers(product):
+                if mod_def.modifier_id in user_selected_modifier_ids:
+                    continue
+                qty = max(1, mod_def.min_amount or 0)
+                item_modifiers.append(OrderItemModifier(
+                    order_item=order_item,
+                    modifier=mod_def,
+                    modifier_name=mod_def.modifier_name,
+                    quantity=qty,
+                    price=mod_def.price
+                ))
+                item_total += mod_def.price * qty * quantity
 
             order_item.total_price = item_total
-            order_item.save(update_fields=['total_price'])
+            order_items.append(order_item)
             total_amount += item_total
-        
-        # Обновляем общую сумму заказа
+
         order.total_amount = total_amount
-        order.save(update_fields=['total_amount'])
+        order.save(force_insert=True)
+        OrderItem.objects.bulk_create(order_items)
+        if item_modifiers:
+            OrderItemModifier.objects.bulk_create(item_modifiers)
+
+        # Если у пользователя в профиле нет телефона — сохраним из заказа (B2C UX).
+        if phone and not user.phone:
+            user.phone = phone
+            user.save(update_fields=['phone'])
+
+        # При удалённой оплате по Kaspi по желанию пользователя сохраняем номер в BillingPhone
+        if system_type == 'remote_payment' and kaspi_phone and save_billing_phone:
+            existing = BillingPhone.objects.filter(
+                user=user,
+                phone=kaspi_phone
+            ).first()
+
+            if existing:
+                # Делаем существующий номер основным
+                if not existing.is_default:
+                    existing.is_default = True
+                    existing.save(update_fields=['is_default'])
+                    BillingPhone.objects.filter(user=user).exclude(
+                        id=existing.id
+                    ).update(is_default=False)
+            else:
+                bp = BillingPhone.objects.create(
+                    user=user,
+                    phone=kaspi_phone,
+                    is_default=True,
+                )
+                BillingPhone.objects.filter(user=user).exclude(
+                    id=bp.id
+                ).update(is_default=False)
         
         logger.info(f'Создан заказ {order.order_id} на сумму {total_amount}')
         
@@ -397,6 +437,7 @@ class OrderService:
             )
             return True
 
+        previous_status = order.status
         with transaction.atomic():
             try:
                 # Подготавливаем данные (код + api_custom_params)
@@ -451,6 +492,7 @@ class OrderService:
                     'sent_to_iiko_at', 'iiko_response', 'query_to_iiko', 'error_message',
                     'iiko_delivery_number', 'order_number',
                 ])
+                publish_order_status(order, previous_status)
 
                 request_log.success = True
                 request_log.save(update_fields=['success'])
@@ -463,6 +505,7 @@ class OrderService:
                 order.status = Order.STATUS_ERROR
                 order.error_message = str(e)
                 order.save(update_fields=['status', 'error_message', 'query_to_iiko'])
+                publish_order_status(order, previous_status)
                 return False
 
             except Exception as e:
@@ -470,6 +513,7 @@ class OrderService:
                 order.status = Order.STATUS_ERROR
                 order.error_message = f'Системная ошибка: {str(e)}'
                 order.save(update_fields=['status', 'error_message', 'query_to_iiko'])
+                publish_order_status(order, previous_status)
                 return False
 
     @transaction.atomic
@@ -483,6 +527,7 @@ class OrderService:
 
         payload = order.query_to_iiko
         client = IikoClient(order.organization.api_key)
+        previous_status = order.status
 
         try:
             response = client.create_delivery_order(payload)
@@ -492,6 +537,7 @@ class OrderService:
             order.error_message = str(e)
             order.iiko_response = {'error': str(e)}
             order.save(update_fields=['status', 'error_message', 'iiko_response'])
+            publish_order_status(order, previous_status)
             raise
 
         order_info = response.get('orderInfo', {})
@@ -507,6 +553,7 @@ class OrderService:
             'iiko_order_id', 'correlation_id', 'status',
             'sent_to_iiko_at', 'iiko_response', 'error_message'
         ])
+        publish_order_status(order, previous_status)
 
         IikoRequestLog.objects.create(
             order=order,
@@ -517,6 +564,52 @@ class OrderService:
         logger.info(f'Повторная отправка заказа {order.order_id} в iiko (correlationId: {correlation_id})')
         return order
 
+    def _apply_creation_status(self, order: Order, status_response: Dict) -> None:
+        """Применяет ответ commands/status к заказу (без сохранения и без запроса деталей доставки)."""
+        creation_status = status_response.get('state')  # usually 'Success', 'InProgress', 'Error'
+
+        # В iiko commands/status возвращает 'state'
+        # Если это deliveries/create, то в ответе может быть 'Success'
+        if creation_status == 'Success':
+            # Команды в iiko обычно возвращают результат в поле 'result'
+            result = status_response.get('result', {})
+            if isinstance(result, dict):
+                order_info = result.get('orderInfo', {}) or {}
+                # Может прийти iiko_order_id и номер
+                if not order.iiko_order_id and order_info.get('id'):
+                    order.iiko_order_id = order_info.get('id')
+                iiko_number = order_info.get('number') or order_info.get('externalNumber')
+                if iiko_number:
+                    order.iiko_delivery_number = str(iiko_number)
+                    order.order_number = str(iiko_number)
+            order.status = Order.STATUS_SUCCESS
+        elif creation_status == 'Error':
+            order.status = Order.STATUS_ERROR
+            order.error_message = (status_response.get('exception') or {}).get('message', 'Неизвестная ошибка iiko')
+        else:
+            order.status = creation_status
+
+    def _apply_delivery_info(self, order: Order, iiko_order: Dict) -> None:
+        """Применяет элемент orders из deliveries/by_id к заказу (без сохранения)."""
+        creation_status = iiko_order.get('creationStatus')
+        inner_order = iiko_order.get('order') or {}
+
+        # Номер заказа (в ответе приходит как order.number)
+        iiko_number = inner_order.get('number') or iiko_order.get('externalNumber')
+        if iiko_number:
+            order.iiko_delivery_number = str(iiko_number)
+            order.order_number = str(iiko_number)
+
+        # Два статуса:
+        # - creationStatus: статус создания
+        # - order.status: реальный статус заказа (Cancelled/Confirmed/Cooking/etc.)
+        if str(creation_status).lower() == 'success':
+            real_status = inner_order.get('status')
+            if real_status:
+                order.status = str(real_status)
+        elif creation_status:
+            order.status = str(creation_status)
+
     def update_order_creation_status(self, order: Order) -> Dict:
         """
         Запрос статуса создания заказа в iiko по correlationId
@@ -527,52 +620,33 @@ class OrderService:
         try:
             client = IikoClient(order.organization.api_key)
             org_id = str(order.organization.iiko_organization_id or order.organization.org_id)
+            previous_status = order.status
             
             status_response = client.get_creation_status(org_id, str(order.correlation_id))
-            
-            creation_status = status_response.get('state')  # usually 'Success', 'InProgress', 'Error'
-            
-            # В iiko commands/status возвращает 'state'
-            # Если это deliveries/create, то в ответе может быть 'Success'
-            if creation_status == 'Success':
-                # Команды в iiko обычно возвращают результат в поле 'result'
-                result = status_response.get('result', {})
-                if isinstance(result, dict):
-                    order_info = result.get('orderInfo', {}) or {}
-                    # Может прийти iiko_order_id и номер
-                    if not order.iiko_order_id and order_info.get('id'):
-                        order.iiko_order_id = order_info.get('id')
-                    iiko_number = order_info.get('number') or order_info.get('externalNumber')
-                    if iiko_number:
-                        order.iiko_delivery_number = str(iiko_number)
-                        order.order_number = str(iiko_number)
-
-                # По требованию: если создание успешно — назначаем реальный статус заказа из iiko
-                # (например Cancelled / Cooking / Confirmed), который приходит из deliveries/by_id.
-                # Если iiko_order_id уже известен — подтянем детали и применим status.
-                if order.iiko_order_id:
-                    self.get_order_details_and_update(order)
-                else:
-                    order.status = Order.STATUS_SUCCESS
-            
-            elif creation_status == 'Error':
-                order.status = Order.STATUS_ERROR
-                order.error_message = status_response.get('exception', {}).get('message', 'Неизвестная ошибка iiko')
-            else:
-                order.status = creation_status
-            
+            self._apply_creation_status(order, status_response)
+
+            # По требованию: если создание успешно — назначаем реальный статус заказа из iiko
+            # (например Cancelled / Cooking / Confirmed), который приходит из deliveries/by_id.
+            # Если iiko_order_id уже известен — подтянем детали и применим status.
+            if order.status == Order.STATUS_SUCCESS and order.iiko_order_id:
+                self.get_order_details_and_update(order, notify=False)
+
+            order.status_checked_at = timezone.now()
             order.save(update_fields=[
-                'status', 'iiko_delivery_number', 'error_message', 'order_number', 'iiko_order_id'
+                'status', 'iiko_delivery_number', 'error_message', 'order_number', 'iiko_order_id',
+                'status_checked_at'
             ])
+            publish_order_status(order, previous_status)
             return status_response
             
         except IikoAPIException as e:
             logger.error(f'Ошибка превращения статуса создания для {order.order_id}: {e}')
             raise
 
-    def get_order_details_and_update(self, order: Order) -> Dict:
+    def get_order_details_and_update(self, order: Order, notify: bool = True) -> Dict:
         """
-        Получение полных деталей заказа из iiko и обновление локальных данных
+        Получение полных деталей заказа из iiko и обновление локальных данных.
+        notify=False — без события смены статуса (его публикует вызывающий код).
         """
         if not order.iiko_order_id:
             raise ValueError('iiko_order_id отсутствует')
@@ -584,33 +658,93 @@ class OrderService:
             status_data = client.get_order_status(org_id, str(order.iiko_order_id))
             
             if 'orders' in status_data and len(status_data['orders']) > 0:
-                iiko_order = status_data['orders'][0] or {}
-                creation_status = iiko_order.get('creationStatus')
-                inner_order = iiko_order.get('order') or {}
-
-                # Номер заказа (в ответе приходит как order.number)
-                iiko_number = inner_order.get('number') or iiko_order.get('externalNumber')
-                if iiko_number:
-                    order.iiko_delivery_number = str(iiko_number)
-                    order.order_number = str(iiko_number)
-
-                # Два статуса:
-                # - creationStatus: статус создания
-                # - order.status: реальный статус заказа (Cancelled/Confirmed/Cooking/etc.)
-                if str(creation_status).lower() == 'success':
-                    real_status = inner_order.get('status')
-                    if real_status:
-                        order.status = str(real_status)
-                elif creation_status:
-                    order.status = str(creation_status)
-
-                order.save(update_fields=['iiko_delivery_number', 'order_number', 'status'])
+                previous_status = order.status
+                self._apply_delivery_info(order, status_data['orders'][0] or {})
+                order.status_checked_at = timezone.now()
+                order.save(update_fields=['iiko_delivery_number', 'order_number', 'status', 'status_checked_at'])
+                if notify:
+                    publish_order_status(order, previous_status)
             
             return status_data
         except IikoAPIException as e:
             logger.error(f'Ошибка получения деталей заказа {order.order_id}: {e}')
             raise
 
+    def poll_order_statuses(self, orders: List[Order]) -> Dict[str, int]:
+        """
+        Сверяет статусы заказов одной организации с iiko и сохраняет их одним bulk_update.
+
+        Заказы с iiko_order_id запрашиваются пачками deliveries/by_id (ORDER_STATUS_BATCH_SIZE за вызов).
+        Для заказов, ещё создающихся в iiko (correlation_id, InProgress), пакетного метода нет —
+        commands/status вызывается по одному; успешно созданные сразу попадают в пакетный запрос.
+        Заказы, по которым iiko вернул ошибку, не сохраняются (status_checked_at не меняется).
+        Смена статуса публикуется подписчикам (order_events).
+        """
+        report = {'checked': 0, 'changed': 0, 'errors': 0}
+        if not orders:
+            return report
+        organization = orders[0].organization
+        client = IikoClient(organization.api_key)
+        org_id = str(organization.iiko_organization_id or organization.org_id)
+        tracked = ('status', 'iiko_order_id', 'iiko_delivery_number', 'order_number', 'error_message')
+        before = {order.pk: tuple(getattr(order, f) for f in tracked) for order in orders}
+        checked = {}
+
+        # 1. Статус создания (по одному заказу)
+        still_creating = set()
+        for order in orders:
+            if not (order.correlation_id and (order.status == Order.STATUS_IN_PROGRESS or not order.iiko_order_id)):
+                continue
+            try:
+                self._apply_creation_status(order, client.get_creation_status(org_id, str(order.correlation_id)))
+            except IikoAPIException as e:
+                report['errors'] += 1
+                still_creating.add(order.pk)
+                logger.warning(f'Опрос статусов: статус создания заказа {order.order_id} не получен: {e}')
+                continue
+            checked[order.pk] = order
+            if order.status != Order.STATUS_SUCCESS or not order.iiko_order_id:
+                still_creating.add(order.pk)
+
+        # 2. Детали доставки — пачками
+        by_iiko_id = {
+            str(order.iiko_order_id).lower(): order
+            for order in orders
+            if order.iiko_order_id and order.pk not in still_creating
+        }
+        ids = list(by_iiko_id)
+        batch_size = getattr(settings, 'ORDER_STATUS_BATCH_SIZE', 100)
+        for i in range(0, len(ids), batch_size):
+            chunk = ids[i:i + batch_size]
+            try:
+                response = client.get_orders_by_ids(org_id, chunk)
+            except IikoAPIException as e:
+                report['errors'] += len(chunk)
+                logger.warning(f'Опрос статусов: deliveries/by_id для {len(chunk)} заказов не выполнен: {e}')
+                continue
+            for iiko_order in response.get('orders') or []:
+                order = by_iiko_id.get(str((iiko_order or {}).get('id') or '').lower())
+                if order is None:
+                    continue
+                self._apply_delivery_info(order, iiko_order)
+                checked[order.pk] = order
+
+        if not checked:
+            return report
+        now = timezone.now()
+        for order in checked.values():
+            order.status_checked_at = now
+            if tuple(getattr(order, f) for f in tracked) != before[order.pk]:
+                order.updated_at = now
+                report['changed'] += 1
+        Order.objects.bulk_update(
+            list(checked.values()), [*tracked, 'status_checked_at', 'updated_at'], batch_size=500
+        )
+        for order in checked.values():
+            publish_order_status(order, before[order.pk][0])
+        report['checked'] = len(checked)
+        return report
+
     def send_order_to_backup_webhook(self, order: Order) -> bool:
         """
         Отправляет заказ на резервный вебхук организации (webhook_link).
@@ -637,8 +771,10 @@ class OrderService:
                 timeout=15,
             )
             resp.raise_for_status()
+            previous_status = order.status
             order.status = Order.STATUS_SENT_TO_BACKUP_WEBHOOK
             order.save(update_fields=['status'])
+            publish_order_status(order, previous_status)
             logger.info(f'Order {order.order_id} sent to backup webhook successfully')
             return True
         except requests.RequestException as e:
@@ -2,9 +2,14 @@ import logging
 from datetime import timedelta
 
 from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 
-from .models import Order
+from . import outbox
+from .models import Order, OrderOutbox
 from .services import OrderService
 
 logger = logging.getLogger(__name__)
@@ -14,8 +19,8 @@ logger = logging.getLogger(__name__)
 def send_order_to_iiko_task(self, order_id: str):
     """
     Async отправка заказа в iiko.
-    Важно: дергать через transaction.on_commit в месте создания заказа,
-    чтобы задача не стартовала до коммита.
+    Новые заказы отправляются через очередь OrderOutbox (dispatch_order_outbox); задача оставлена
+    для уже поставленных в Celery заказов. Дергать только после коммита заказа.
     """
     try:
         order = Order.objects.select_related('organization', 'user', 'payment_type', 'terminal', 'delivery_address') \
@@ -57,6 +62,79 @@ def send_order_to_iiko_task(self, order_id: str):
         raise self.retry(exc=exc)
 
 
+@shared_task(ignore_result=True)
+def dispatch_order_outbox():
+    """
+    Диспетчер очереди отправки заказов в iiko (Celery Beat, каждые ORDER_OUTBOX_DISPATCH_INTERVAL секунд,
+    и сразу после создания заказа). Выдаёт записи пачкой (apps.orders.outbox.claim_due) и ставит
+    deliver_order_outbox на каждую после коммита выдачи.
+    """
+    with transaction.atomic():
+        claimed = outbox.claim_due()
+        entry_ids = [entry.pk for entry in claimed]
+
+        def _queue():
+            for entry_id in entry_ids:
+                try:
+                    deliver_order_outbox.delay(entry_id)
+                except Exception as e:
+                    # Запись останется выданной до конца аренды и будет выдана снова
+                    logger.warning(f"order_outbox: entry {entry_id} not queued: {e}")
+
+        transaction.on_commit(_queue)
+
+    stats = outbox.backlog_stats()
+    if entry_ids or stats['pending'] or stats['failed']:
+        logger.info(f"order_outbox: dispatched {len(entry_ids)}, backlog {stats}")
+    purged = outbox.purge_processed()
+    if purged:
+        logger.info(f"order_outbox: purged {purged} processed entries")
+
+
+def _load_order_for_send(order_id):
+    return Order.objects.select_related('organization', 'user', 'payment_type', 'terminal', 'delivery_address') \
+        .prefetch_related('items__modifiers__modifier', 'items__product') \
+        .get(order_id=order_id)
+
+
+@shared_task(ignore_result=True)
+def deliver_order_outbox(entry_id: int):
+    """
+    Отправка в iiko заказа из записи очереди. Строка заказа блокируется на время отправки:
+    повторно выданная запись (истекла аренда) дождётся первой попытки и увидит sent_to_iiko_at.
+    """
+    entry = OrderOutbox.objects.filter(pk=entry_id).first()
+    if entry is None or entry.status != OrderOutbox.STATUS_PROCESSING:
+        return
+
+    try:
+        with transaction.atomic():
+            locked = list(Order.objects.select_for_update().filter(pk=entry.order_id).values_list('pk', flat=True))
+            if not locked:
+                outbox.mark_done(entry, error='Заказ удалён')
+                return
+            order = _load_order_for_send(entry.order_id)
+            if order.sent_to_iiko_at is not None:
+                logger.info(f"order_outbox: order {order.order_id} already sent at {order.sent_to_iiko_at}")
+                sent = True
+            elif order.status in (Order.STATUS_SENT_TO_BACKUP_WEBHOOK, Order.STATUS_CANCELLED):
+                # smart_retry уже отдал заказ на резервный вебхук (или его отменили) — в iiko не дублируем
+                outbox.mark_done(entry, error=f'Не отправлен: статус заказа {order.status}')
+                return
+            else:
+                sent = OrderService().send_to_iiko(order)
+    except Exception as e:
+        logger.error(f"order_outbox: delivery of order {entry.order_id} failed: {e}", exc_info=True)
+        outbox.mark_retry(entry, str(e))
+        return
+
+    # iiko отклонил заказ — статус Error, дальше резервный вебхук (smart_retry), без повтора
+    outbox.mark_done(entry, error=None if sent else (order.error_message or 'iiko error'))
+    if outbox.has_due(entry.organization_id):
+        # Освободилось место в лимите организации — не ждём расписания
+        outbox.kick()
+
+
 @shared_task(ignore_result=True)
 def smart_retry_and_backup_orders_task():
     """
@@ -65,6 +143,7 @@ def smart_retry_and_backup_orders_task():
     - Заказы InProgress, созданные не более 10 минут назад:
       через 5 минут — один раз запускается проверка статуса (как кнопка «Проверить статус» в TMA),
       обновляется статус заказа. Если после проверки статус Error — отправка на вебхук.
+      Заказы, ещё не отправленные в iiko (нет correlation_id и iiko_order_id), не проверяются.
       Если через 10 минут заказ всё ещё InProgress — отправка на вебхук.
     - Логика повторной отправки заказа в iiko (repeat) убрана.
     """
@@ -93,10 +172,10 @@ def smart_retry_and_backup_orders_task():
         created_at__gte=cutoff,
     ).select_related('organization').order_by('created_at')
 
+    to_check = []
     for order in orders:
         try:
-            created_at = order.created_at
-            age_sec = (now - created_at).total_seconds()
+            age_sec = (now - order.created_at).total_seconds()
 
             # Через 10 минут всё ещё InProgress — отправляем на вебхук
             if age_sec >= 600:
@@ -104,23 +183,103 @@ def smart_retry_and_backup_orders_task():
                     logger.info(f"smart_retry: order {order.order_id} (InProgress >= 10 min) sent to backup webhook")
                 continue
 
-            # Через 5 минут — один раз проверяем статус (логика кнопки «Проверить статус» в TMA)
+            # Ещё не отправлен в iiko (ждёт в очереди outbox или отправляется прямо сейчас):
+            # проверять нечего, а вебхук сейчас мог бы продублировать заказ — ждём правила 10 минут
+            if not order.correlation_id and not order.iiko_order_id:
+                continue
+
+            # Через 5 минут — один раз проверяем статус (пакетно по организации, см. ниже)
             if age_sec >= 300 and order.retry_count == 0:
-                order.retry_count = 1
-                order.save(update_fields=['retry_count'])
-                try:
-                    if order.correlation_id and (order.status == Order.STATUS_IN_PROGRESS or not order.iiko_order_id):
-                        service.update_order_creation_status(order)
-                    elif order.iiko_order_id:
-                        service.get_order_details_and_update(order)
-                except Exception as e:
-                    logger.warning(f"smart_retry: order {order.order_id} status check failed: {e}, sending to webhook")
-                    if service.send_order_to_backup_webhook(order):
-                        logger.info(f"smart_retry: order {order.order_id} sent to backup webhook after status check error")
-                    continue
-                order.refresh_from_db()
-                if order.status == Order.STATUS_ERROR:
-                    if service.send_order_to_backup_webhook(order):
-                        logger.info(f"smart_retry: order {order.order_id} status=Error after check, sent to webhook")
+                to_check.append(order)
         except Exception as e:
             logger.exception(f"smart_retry: error processing order {order.order_id}: {e}")
+
+    if not to_check:
+        return
+    Order.objects.filter(pk__in=[order.pk for order in to_check]).update(retry_count=1)
+    for org_orders in _group_by_organization(to_check).values():
+        started = timezone.now()
+        try:
+            service.poll_order_statuses(org_orders)
+        except Exception as e:
+            logger.warning(f"smart_retry: status check failed for {len(org_orders)} orders: {e}")
+        for order in org_orders:
+            try:
+                # Статус не получен (ошибка iiko) или после проверки Error — отправляем на вебхук
+                failed = order.status_checked_at is None or order.status_checked_at < started
+                if failed or order.status == Order.STATUS_ERROR:
+                    if service.send_order_to_backup_webhook(order):
+                        logger.info(
+                            f"smart_retry: order {order.order_id} sent to backup webhook "
+                            f"({'status check error' if failed else 'status=Error after check'})"
+                        )
+            except Exception as e:
+                logger.exception(f"smart_retry: error processing order {order.order_id}: {e}")
+
+
+def _group_by_organization(orders):
+    by_org = {}
+    for order in orders:
+        by_org.setdefault(order.organization_id, []).append(order)
+    return by_org
+
+
+def in_flight_orders():
+    """
+    Заказы, статус которых ещё может измениться в iiko: отправлены (есть iiko_order_id или correlation_id),
+    не в конечном статусе и не старше ORDER_STATUS_POLL_WINDOW_HOURS.
+    """
+    window = timedelta(hours=getattr(settings, 'ORDER_STATUS_POLL_WINDOW_HOURS', 12))
+    return (
+        Order.objects.filter(
+            Q(iiko_order_id__isnull=False) | Q(correlation_id__isnull=False),
+            created_at__gte=timezone.now() - window,
+            organization__is_active=True,
+            organization__api_key__isnull=False,
+        )
+        .exclude(status__in=Order.FINAL_STATUSES)
+        .exclude(organization__api_key='')
+    )
+
+
+def _poll_lock_key(organization_id) -> str:
+    return f'order_status_poll:{organization_id}'
+
+
+@shared_task(ignore_result=True)
+def poll_order_statuses_task():
+    """
+    Пакетный опрос статусов заказов (Celery Beat, каждые ORDER_STATUS_POLL_INTERVAL секунд).
+    Ставит одну задачу poll_organization_order_statuses на организацию с незавершёнными заказами;
+    организация, чей предыдущий опрос ещё идёт, пропускается.
+    """
+    organization_ids = set(in_flight_orders().values_list('organization_id', flat=True))
+    interval = getattr(settings, 'ORDER_STATUS_POLL_INTERVAL', 30)
+    dispatched = 0
+    for organization_id in organization_ids:
+        try:
+            if not cache.add(_poll_lock_key(organization_id), 1, timeout=interval * 4):
+                continue
+        except Exception as e:
+            logger.warning(f"poll_order_statuses: cache unavailable ({e}), dispatching without lock")
+        poll_organization_order_statuses.delay(str(organization_id))
+        dispatched += 1
+    if dispatched:
+        logger.info(f"poll_order_statuses: dispatched {dispatched} organizations")
+
+
+@shared_task(ignore_result=True)
+def poll_organization_order_statuses(organization_id: str):
+    """Сверяет с iiko статусы всех незавершённых заказов организации (OrderService.poll_order_statuses)."""
+    try:
+        orders = list(
+            in_flight_orders().filter(organization_id=organization_id).select_related('organization')
+        )
+        report = OrderService().poll_order_statuses(orders)
+        if report['checked'] or report['errors']:
+            logger.info(f"poll_order_statuses: organization {organization_id}: {report}")
+    finally:
+        try:
+            cache.delete(_poll_lock_key(organization_id))
+        except Exception:
+            pass
@@ -1,10 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import OrderViewSet
+from .views import OrderEventsView, OrderViewSet
 
 router = DefaultRouter()
 router.register(r'orders', OrderViewSet, basename='order')
 
 urlpatterns = [
+    # До маршрутов router: иначе 'events' попадёт в orders/<pk>/
+    path('orders/events/', OrderEventsView.as_view(), name='order-events'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -1,10 +1,14 @@
+import logging
+import uuid
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
 from django.db import transaction
 from django.db.models import F, Sum, Count, Q
+from django.conf import settings
 from django.utils import timezone
 from datetime import datetime, timedelta
 from .models import Order, OrderItem, OrderItemModifier
@@ -12,8 +16,15 @@ from .serializers import (
     OrderListSerializer, OrderDetailSerializer, OrderCreateSerializer
 )
 from .services import OrderService
+from .order_events import channels_for_token, issue_stream_token, load_stream_token, publish_order_status
+from .outbox import enqueue_order
+from .cart_snapshot import CONTEXT_KEY as CART_SNAPSHOT_KEY
+from apps.organizations.models import Organization
+from core.events import sse_enabled, sse_response
 from core.permissions import IsSuperAdmin, IsOrgAdmin, IsOwner
 
+logger = logging.getLogger(__name__)
+
 
 class OrderViewSet(viewsets.ModelViewSet):
     """ViewSet для заказов"""
@@ -93,19 +104,21 @@ class OrderViewSet(viewsets.ModelViewSet):
             order = order_service.create_order(
                 user=request.user,
                 organization=request.user.organization,
-                validated_data=serializer.validated_data
+                validated_data=serializer.validated_data,
+                # Продукты и модификаторы, уже загруженные при валидации
+                snapshot=serializer.context.get(CART_SNAPSHOT_KEY),
             )
             
             # Быстрый ответ пользователю: отправку в iiko выполняем асинхронно (Celery),
             # иначе клиент (TMA) часто ловит таймаут и показывает "ошибка", хотя заказ создаётся.
+            # Запись очереди отправки — в той же транзакции, что и заказ (см. apps.orders.outbox).
             order.status = Order.STATUS_IN_PROGRESS
             order.save(update_fields=['status', 'updated_at'])
-
-            from .tasks import send_order_to_iiko_task
-            transaction.on_commit(lambda: send_order_to_iiko_task.delay(str(order.order_id)))
+            publish_order_status(order, created=True)
+            enqueue_order(order)
             
-            # Возвращаем созданный заказ
-            response_serializer = OrderDetailSerializer(order)
+            # Возвращаем созданный заказ (с prefetch позиций и модификаторов — без запроса на позицию)
+            response_serializer = OrderDetailSerializer(self.get_queryset().get(pk=order.pk))
             
             return Response(
                 response_serializer.data,
@@ -126,56 +139,51 @@ class OrderViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['get'])
     def status(self, request, pk=None):
         """
-        Получение актуального статуса заказа из iiko
+        Статус заказа. Незавершённые заказы сверяет с iiko фоновый пакетный опрос
+        (poll_order_statuses_task), поэтому обычно ответ отдаётся из БД без запроса к iiko.
+        В iiko идём, только если последняя сверка старше ORDER_STATUS_STALE_AFTER секунд
+        (опрос отстаёт или заказ ещё не проверялся) или администратор передал refresh=1.
+        Смена статуса приходит и push-событием (OrderEventsView) — подписанным клиентам опрос не нужен.
         """
         order = self.get_object()
-        
-        # Rate limit check (optional, but requested for the UI)
-        # We can implement a simple check based on updated_at or a dedicated field
-        import datetime
-        from django.utils import timezone
-        
-        # If user is not admin, we might want to restrict frequency
-        if not (request.user.is_superadmin or request.user.is_org_admin):
-            if order.updated_at and (timezone.now() - order.updated_at).total_seconds() < 30:
-                 return Response({
-                    'status': order.status,
-                    'message': 'Запрос слишком часто, попробуйте позже',
-                    'order': OrderDetailSerializer(order).data
-                })
 
-        try:
-            order_service = OrderService()
-            
-            # 1. Если заказ в процессе создания (нет iiko_order_id, но есть correlation_id)
-            if order.correlation_id and (order.status == 'InProgress' or not order.iiko_order_id):
-                status_data = order_service.update_order_creation_status(order)
-            
-            # 2. Если уже есть iiko_order_id, запрашиваем детали доставки
-            elif order.iiko_order_id:
-                status_data = order_service.get_order_details_and_update(order)
-            
-            else:
-                return Response({
-                    'status': order.status,
-                    'message': 'Заказ еще не отправлен в iiko',
-                    'order': OrderDetailSerializer(order).data
-                })
-            
+        if not (order.correlation_id or order.iiko_order_id):
             return Response({
                 'status': order.status,
-                'iiko_status': status_data,
+                'message': 'Заказ еще не отправлен в iiko',
                 'order': OrderDetailSerializer(order).data
             })
-            
+
+        force = request.query_params.get('refresh') == '1' and (
+            request.user.is_superadmin or request.user.is_org_admin
+        )
+        stale_after = timedelta(seconds=getattr(settings, 'ORDER_STATUS_STALE_AFTER', 90))
+        is_fresh = order.status_checked_at and timezone.now() - order.status_checked_at < stale_after
+        if not force and (is_fresh or order.status in Order.FINAL_STATUSES):
+            return Response({
+                'status': order.status,
+                'checked_at': order.status_checked_at,
+                'order': OrderDetailSerializer(order).data
+            })
+
+        try:
+            report = OrderService().poll_order_statuses([order])
         except Exception as e:
-            import logging
-            logger = logging.getLogger(__name__)
             logger.error(f'Ошибка обновления статуса: {e}')
             return Response(
                 {'error': f'Не удалось получить статус: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+        if report['errors'] and not report['checked']:
+            return Response(
+                {'error': 'Не удалось получить статус из iiko, попробуйте позже'},
+                status=status.HTTP_502_BAD_GATEWAY
+            )
+        return Response({
+            'status': order.status,
+            'checked_at': order.status_checked_at,
+            'order': OrderDetailSerializer(order).data
+        })
     
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
@@ -201,8 +209,10 @@ class OrderViewSet(viewsets.ModelViewSet):
             )
         
         # Обновляем статус
+        previous_status = order.status
         order.status = Order.STATUS_CANCELLED
         order.save(update_fields=['status', 'updated_at'])
+        publish_order_status(order, previous_status)
         
         # TODO: Отправить отмену в iiko если заказ уже там
         
@@ -275,6 +285,35 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['post'], url_path='events/token')
+    def events_token(self, request):
+        """
+        Токен подписки на события статусов заказов (GET /orders/events/?token=...).
+        Покупатель получает события своих заказов, администратор организации — ещё и всех
+        заказов организации; суперадмин выбирает организацию параметром organization.
+        enabled = false — события выключены (EVENTS_SSE_ENABLED), клиент не подписывается.
+        """
+        if not sse_enabled():
+            return Response({'enabled': False})
+        user = request.user
+        organization_id = None
+        if user.is_superadmin:
+            organization_id = request.data.get('organization') or request.query_params.get('organization')
+            if organization_id:
+                try:
+                    organization_id = uuid.UUID(str(organization_id))
+                except ValueError:
+                    organization_id = None
+                if not organization_id or not Organization.objects.filter(org_id=organization_id).exists():
+                    return Response({'error': 'Организация не найдена'}, status=status.HTTP_400_BAD_REQUEST)
+        elif user.is_org_admin:
+            organization_id = user.organization_id
+        return Response({
+            'enabled': True,
+            'token': issue_stream_token(user, organization_id),
+            'expires_in': getattr(settings, 'ORDER_EVENTS_TOKEN_TTL', 60 * 60),
+        })
+
     @action(detail=False, methods=['get'])
     def my_orders(self, request):
         """
@@ -442,4 +481,22 @@ class OrderViewSet(viewsets.ModelViewSet):
             'delivery_orders_sum': delivery_orders_sum,
             'pickup_orders_count': pickup_orders_count,
             'pickup_orders_sum': pickup_orders_sum,
-        })
\ No newline at end of file
+        })
+
+
+class OrderEventsView(APIView):
+    """
+    SSE: события статусов заказов (order_status, см. apps.orders.order_events).
+
+    GET /orders/events/?token=<токен из POST /orders/events/token/>. EventSource не передаёт
+    Authorization, поэтому JWT не используется; токен короткоживущий и даёт только подписку.
+    Просроченный токен — 401: клиент запрашивает новый и переподключается.
+    """
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+
+    def get(self, request):
+        payload = load_stream_token(request.query_params.get('token') or '')
+        if payload is None:
+            return Response({'error': 'Недействительный токен подписки'}, status=status.HTTP_401_UNAUTHORIZED)
+        return sse_response(request, channels_for_token(payload), client_key=f"user:{payload['u']}")
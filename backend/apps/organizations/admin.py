@@ -142,15 +142,23 @@ class OrganizationAdmin(BaseAdmin):
         return obj.terminals.count()
     get_terminals_count.short_description = 'Терминалов'
     search_fields = ('org_name', 'org_id', 'iiko_organization_id')
-    actions = ['import_menu_from_iiko']
+    actions = ['import_menu_from_iiko', 'resync_menu_from_iiko']
 
     @admin.action(description='Загрузить меню из iikoCloud')
     def import_menu_from_iiko(self, request, queryset):
+        self._sync_menu_from_iiko(request, queryset, full_resync=False)
+
+    @admin.action(description='Полная пересинхронизация меню из iikoCloud')
+    def resync_menu_from_iiko(self, request, queryset):
+        self._sync_menu_from_iiko(request, queryset, full_resync=True)
+
+    def _sync_menu_from_iiko(self, request, queryset, full_resync):
         from apps.iiko_integration.client import IikoClient
         from apps.iiko_integration.services import MenuSyncService
         from django.contrib import messages
         
         updated_count = 0
+        reports = []
         errors = []
 
         for org in queryset:
@@ -160,17 +168,27 @@ class OrganizationAdmin(BaseAdmin):
             
             try:
                 client = IikoClient(org.api_key)
-                client.authenticate()
-                menu_data = client.get_menu(org.iiko_organization_id)
-                
                 service = MenuSyncService()
-                service.sync_menu(org, menu_data)
+                result = service.sync_nomenclature(org, client, full_resync=full_resync)
                 updated_count += 1
+                if result.get('status') == 'unchanged':
+                    reports.append(f"{org.org_name}: без изменений (ревизия {result.get('revision')})")
+                else:
+                    reports.append(
+                        f"{org.org_name}: создано {result.get('products_created', 0)}, "
+                        f"изменено {result.get('products_changed', 0)}, "
+                        f"без изменений {result.get('products_unchanged', 0)}, "
+                        f"деактивировано {result.get('products_deactivated', 0)}"
+                    )
             except Exception as e:
                 errors.append(f"{org.org_name}: {str(e)}")
 
         if updated_count > 0:
-            self.message_user(request, f"Меню успешно обновлено для {updated_count} организаций.", messages.SUCCESS)
+            self.message_user(
+                request,
+                f"Меню успешно обновлено для {updated_count} организаций. " + "; ".join(reports),
+                messages.SUCCESS,
+            )
         
         if errors:
             self.message_user(request, "Ошибки: " + "; ".join(errors), messages.ERROR)
@@ -325,11 +343,18 @@ class OrganizationAdmin(BaseAdmin):
 
 @admin.register(Terminal)
 class TerminalAdmin(BaseAdmin):
-    list_display = ('terminal_group_name', 'organization', 'city', 'iiko_organization_id', 'is_active')
-    list_filter = ('is_active', 'organization', 'city')
+    list_display = (
+        'terminal_group_name', 'organization', 'city', 'iiko_organization_id',
+        'get_stop_list_interval', 'is_active',
+    )
+    list_filter = ('is_active', 'stop_list_adaptive', 'organization', 'city')
     search_fields = ('terminal_group_name', 'terminal_id', 'iiko_organization_id')
     change_list_template = "admin/organizations/terminal_changelist.html"
 
+    def get_stop_list_interval(self, obj):
+        return obj.stop_list_effective_interval
+    get_stop_list_interval.short_description = 'Интервал стоп-листа (мин)'
+
     # Removed get_organizations as it's now a direct ForeignKey 'organization'
 
     def get_urls(self):
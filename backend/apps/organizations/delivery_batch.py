@@ -0,0 +1,112 @@
+"""
+Пакетный расчет стоимости доставки: N точек по зонам M терминалов.
+
+Нужен там, где точек много: администратор пересчитывает зоны для адресов, TMA считает
+доставку для всех сохраненных адресов пользователя. Вместо вызова calculate_delivery_cost
+на каждую точку попадание проверяется на NumPy: для каждой зоны (в порядке приоритета)
+точки, ещё не попавшие в зону и лежащие в её прямоугольнике, проверяются сразу против всех
+рёбер полигона. Операции те же, что в CompiledZone.contains, в той же точности (float64),
+поэтому результат совпадает со скалярным расчетом. Стоимость считается один раз на зону.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .delivery_utils import CompiledZone, ZoneIndex, compile_zones, zone_cost
+
+# Предел размера матрицы точки x рёбра за один шаг (ячеек)
+CHUNK_CELLS = 1_000_000
+
+NOT_CONFIGURED = {
+    'cost': None,
+    'zone_name': None,
+    'is_free': False,
+    'zone_found': False,
+    'message': 'Зоны доставки не настроены'
+}
+NOT_FOUND = {
+    'cost': None,
+    'zone_name': None,
+    'is_free': False,
+    'zone_found': False,
+    'message': 'Адрес не попадает в зоны доставки'
+}
+
+
+def _zone_arrays(zone: CompiledZone):
+    """Рёбра зоны столбцами (xi, yi, yj, dx, dy), строка на ребро; кэшируются в зоне."""
+    if zone.vector is None:
+        zone.vector = np.array(zone.edges, dtype=np.float64).reshape(-1, 5).T.copy()
+    return zone.vector
+
+
+def _contains(zone: CompiledZone, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Ray Casting для набора точек: булев массив попаданий."""
+    xi, yi, yj, dx, dy = _zone_arrays(zone)
+    result = np.zeros(len(lats), dtype=bool)
+    if not len(xi):
+        return result
+    step = max(1, CHUNK_CELLS // len(xi))
+    for start in range(0, len(lats), step):
+        lat = lats[start:start + step, None]
+        lon = lons[start:start + step, None]
+        crosses = (yi > lat) != (yj > lat)
+        with np.errstate(invalid='ignore'):
+            hits = crosses & (lon < (dx * (lat - yi)) / dy + xi)
+        result[start:start + step] = np.count_nonzero(hits, axis=1) % 2 == 1
+    return result
+
+
+def locate_points(index: ZoneIndex, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Номер зоны index.zones для каждой точки (первая по приоритету), -1 — вне зон."""
+    found = np.full(len(lats), -1, dtype=np.int64)
+    for position, zone in enumerate(index.zones):
+        if zone.bbox is None:
+            continue
+        min_lon, min_lat, max_lon, max_lat = zone.bbox
+        # NaN не отбрасывается прямоугольником — как в скалярной проверке
+        candidates = np.flatnonzero(
+            (found < 0)
+            & ~((lons < min_lon) | (lats < min_lat) | (lons > max_lon) | (lats > max_lat))
+        )
+        if not len(candidates):
+            continue
+        inside = _contains(zone, lats[candidates], lons[candidates])
+        found[candidates[inside]] = position
+    return found
+
+
+def calculate_delivery_costs(points, delivery_zones: Sequence[Any], order_amount=0) -> List[List[Dict[str, Any]]]:
+    """
+    Стоимость доставки для каждой точки по каждому набору зон.
+
+    Args:
+        points: Координаты [(lat, lon), ...]
+        delivery_zones: Наборы зон терминалов — ZoneIndex (get_terminal_zone_index)
+                        или delivery_zones_conditions
+        order_amount: Сумма заказа (одна для всех точек)
+
+    Returns:
+        list: results[i][j] — результат calculate_delivery_cost для точки i и зон j
+    """
+    coords = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    lats = np.ascontiguousarray(coords[:, 0])
+    lons = np.ascontiguousarray(coords[:, 1])
+    results: List[List[Dict[str, Any]]] = [[] for _ in range(len(coords))]
+
+    for zones in delivery_zones:
+        index: Optional[ZoneIndex] = zones if isinstance(zones, ZoneIndex) else compile_zones(zones)
+        if index is None:
+            for row in results:
+                row.append(dict(NOT_CONFIGURED))
+            continue
+        found = locate_points(index, lats, lons)
+        costs = {}
+        for row, position in zip(results, found.tolist()):
+            if position < 0:
+                row.append(dict(NOT_FOUND))
+                continue
+            if position not in costs:
+                costs[position] = zone_cost(index.zones[position], order_amount)
+            row.append(dict(costs[position]))
+    return results
@@ -0,0 +1,392 @@
+"""
+Формулы стоимости доставки зон (поле formula в delivery_zones_conditions).
+
+Формула разбирается один раз (compile_formula) рекурсивным спуском в дерево выражения,
+узлы которого — замыкания Python над дочерними узлами; расчет — вызов корня с переменными
+зоны, без eval().
+Формулы проверяются при сохранении зон (TerminalViewSet.update_delivery_zones,
+TerminalSerializer), поэтому ошибки видны администратору сразу, а не при расчете.
+
+Синтаксис:
+- переменные {{order_sum}} (сумма заказа), {{min_sum}} (min_order_amount зоны),
+  {{price}} (delivery_cost зоны);
+- числа, скобки, + - * / // **, унарные - + !;
+- сравнения < <= > >= == != (цепочки как в Python: a < b < c);
+- логические && и ||;
+- тернарный оператор условие ? значение : значение, в том числе вложенный;
+- функции min, max, round, abs.
+
+Приоритеты и арифметика — как в прежней реализации (Python): формулы, которые она
+вычисляла, дают тот же результат (проверяет bench_delivery_formula).
+"""
+import math
+import operator
+import re
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+VARIABLES = ('order_sum', 'min_sum', 'price')
+# Переменная формулы -> поле зоны
+ZONE_FIELDS = {'min_sum': 'min_order_amount', 'price': 'delivery_cost'}
+
+# Имя -> (функция, минимум аргументов, максимум аргументов или None)
+FUNCTIONS: Dict[str, Tuple[Callable, int, Optional[int]]] = {
+    'min': (min, 1, None),
+    'max': (max, 1, None),
+    'round': (round, 1, 2),
+    'abs': (abs, 1, 1),
+}
+
+MAX_LENGTH = 1000
+MAX_DEPTH = 50
+# Ограничение показателя степени: 9 ** 9 ** 9 не должен занимать воркер
+MAX_EXPONENT = 1000
+# И величины результата (двоичных разрядов): вложенные ((2 ** 1000) ** 1000) ** 100 строили бы
+# огромные целые на каждом расчете. Больше ~2 ** 1024 результат всё равно не конечное float
+MAX_POWER_BITS = 1100
+
+_TOKEN_RE = re.compile(r'''
+    \s*(?:
+        (?P<var>\{\{(?P<var_name>\w+)\}\})
+      | (?P<number>\d+\.?\d*|\.\d+)
+      | (?P<name>[A-Za-z_]\w*)
+      | (?P<op>\*\*|//|&&|\|\||==|!=|<=|>=|[-+*/<>!?:(),])
+    )''', re.VERBOSE)
+
+_COMPARISONS = {
+    '<': operator.lt, '<=': operator.le, '>': operator.gt,
+    '>=': operator.ge, '==': operator.eq, '!=': operator.ne,
+}
+_ARITHMETIC = {
+    '+': operator.add, '-': operator.sub, '*': operator.mul,
+    '/': operator.truediv, '//': operator.floordiv,
+}
+
+Evaluator = Callable[[tuple], Any]
+
+
+class FormulaError(ValueError):
+    """Формула не разбирается или не вычисляется."""
+
+
+def _tokenize(source: str) -> List[Tuple[str, Any]]:
+    tokens = []
+    position = 0
+    source = source.rstrip()
+    while position < len(source):
+        match = _TOKEN_RE.match(source, position)
+        if not match or match.end() == position:
+            raise FormulaError(f'Недопустимый символ в позиции {position + 1}: {source[position:position + 10]!r}')
+        position = match.end()
+        if match.group('var'):
+            name = match.group('var_name')
+            if name not in VARIABLES:
+                raise FormulaError(f'Неизвестная переменная {{{{{name}}}}}')
+            tokens.append(('var', name))
+        elif match.group('number'):
+            text = match.group('number')
+            tokens.append(('number', float(text) if '.' in text else int(text)))
+        elif match.group('name'):
+            tokens.append(('name', match.group('name')))
+        else:
+            tokens.append(('op', match.group('op')))
+    return tokens
+
+
+def _power(base, exponent):
+    if abs(exponent) > MAX_EXPONENT:
+        raise FormulaError('Слишком большой показатель степени')
+    if exponent > 0 and abs(base) > 1 and exponent * math.log2(abs(base)) > MAX_POWER_BITS:
+        raise FormulaError('Слишком большой результат степени')
+    result = base ** exponent
+    if isinstance(result, complex):
+        raise FormulaError('Степень отрицательного числа не определена')
+    return result
+
+
+class _Parser:
+    """Рекурсивный спуск; каждое правило возвращает функцию от кортежа переменных."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+        self.depth = 0
+        self.variables = set()
+
+    def peek(self) -> Optional[Tuple[str, Any]]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def accept(self, *ops) -> Optional[str]:
+        token = self.peek()
+        if token is not None and token[0] == 'op' and token[1] in ops:
+            self.position += 1
+            return token[1]
+        return None
+
+    def expect(self, op: str) -> None:
+        if not self.accept(op):
+            token = self.peek()
+            found = 'конец формулы' if token is None else repr(token[1])
+            raise FormulaError(f"Ожидалось '{op}', найдено {found}")
+
+    def parse(self) -> Evaluator:
+        if not self.tokens:
+            raise FormulaError('Формула пустая')
+        node = self.ternary()
+        token = self.peek()
+        if token is not None:
+            raise FormulaError(f'Лишний фрагмент формулы: {token[1]!r}')
+        return node
+
+    def ternary(self) -> Evaluator:
+        self.depth += 1
+        if self.depth > MAX_DEPTH:
+            raise FormulaError('Слишком глубокая вложенность формулы')
+        condition = self.logical_or()
+        if self.accept('?'):
+            if_true = self.ternary()
+            self.expect(':')
+            if_false = self.ternary()
+            self.depth -= 1
+            return lambda env: if_true(env) if condition(env) else if_false(env)
+        self.depth -= 1
+        return condition
+
+    def logical_or(self) -> Evaluator:
+        operands = [self.logical_and()]
+        while self.accept('||'):
+            operands.append(self.logical_and())
+        if len(operands) == 1:
+            return operands[0]
+
+        def evaluate(env):
+            # Как || в JS и or в Python: первый истинный операнд или последний
+            for operand in operands:
+                value = operand(env)
+                if value:
+                    return value
+            return value
+        return evaluate
+
+    def logical_and(self) -> Evaluator:
+        operands = [self.comparison()]
+        while self.accept('&&'):
+            operands.append(self.comparison())
+        if len(operands) == 1:
+            return operands[0]
+
+        def evaluate(env):
+            for operand in operands:
+                value = operand(env)
+                if not value:
+                    return value
+            return value
+        return evaluate
+
+    def comparison(self) -> Evaluator:
+        first = self.additive()
+        chain = []
+        while True:
+            op = self.accept(*_COMPARISONS)
+            if not op:
+                break
+            chain.append((_COMPARISONS[op], self.additive()))
+        if not chain:
+            return first
+        if len(chain) == 1:
+            compare, second = chain[0]
+            return lambda env: compare(first(env), second(env))
+
+        def evaluate(env):
+            # Цепочка как в Python: a < b < c == (a < b) and (b < c), каждый операнд один раз
+            left = first(env)
+            for compare, operand in chain:
+                right = operand(env)
+                if not compare(left, right):
+                    return False
+                left = right
+            return True
+        return evaluate
+
+    def _binary_chain(self, operand: Callable[[], Evaluator], ops) -> Evaluator:
+        """Левоассоциативная цепочка a op b op c ... одной функцией (без вложенных вызовов)."""
+        first = operand()
+        rest = []
+        while True:
+            op = self.accept(*ops)
+            if not op:
+                break
+            rest.append((_ARITHMETIC[op], operand()))
+        if not rest:
+            return first
+        if len(rest) == 1:
+            apply, second = rest[0]
+            return lambda env: apply(first(env), second(env))
+
+        def evaluate(env):
+            value = first(env)
+            for apply, node in rest:
+                value = apply(value, node(env))
+            return value
+        return evaluate
+
+    def additive(self) -> Evaluator:
+        return self._binary_chain(self.term, ('+', '-'))
+
+    def term(self) -> Evaluator:
+        return self._binary_chain(self.unary, ('*', '/', '//'))
+
+    def unary(self) -> Evaluator:
+        ops = []
+        while True:
+            op = self.accept('-', '+', '!')
+            if not op:
+                break
+            ops.append(op)
+        operand = self.power()
+        if not ops:
+            return operand
+        if ops == ['-']:
+            return lambda env: -operand(env)
+        ops.reverse()
+
+        def evaluate(env):
+            value = operand(env)
+            for op in ops:
+                value = -value if op == '-' else +value if op == '+' else not value
+            return value
+        return evaluate
+
+    def power(self) -> Evaluator:
+        base = self.atom()
+        if self.accept('**'):
+            # Правоассоциативно и сильнее унарного минуса слева: -2 ** 2 == -4, 2 ** -1 == 0.5
+            exponent = self.unary()
+            return lambda env: _power(base(env), exponent(env))
+        return base
+
+    def atom(self) -> Evaluator:
+        token = self.peek()
+        if token is None:
+            raise FormulaError('Формула обрывается')
+        kind, value = token
+        self.position += 1
+        if kind == 'number':
+            return lambda env: value
+        if kind == 'var':
+            self.variables.add(value)
+            index = VARIABLES.index(value)
+            return lambda env: env[index]
+        if kind == 'name':
+            return self.call(value)
+        if value == '(':
+            node = self.ternary()
+            self.expect(')')
+            return node
+        raise FormulaError(f'Неожиданный символ {value!r}')
+
+    def call(self, name: str) -> Evaluator:
+        if name not in FUNCTIONS:
+            raise FormulaError(f'Неизвестная функция {name}')
+        function, min_args, max_args = FUNCTIONS[name]
+        self.expect('(')
+        args = []
+        if not self.accept(')'):
+            args.append(self.ternary())
+            while self.accept(','):
+                args.append(self.ternary())
+            self.expect(')')
+        if len(args) < min_args or (max_args is not None and len(args) > max_args):
+            raise FormulaError(f'Неверное число аргументов {name}: {len(args)}')
+        if len(args) == 1 and name in ('min', 'max'):
+            return args[0]
+        return lambda env: function(*(arg(env) for arg in args))
+
+
+def _number(name: str, value) -> Any:
+    """Значение переменной зоны как число (в настройках зоны бывают строки)."""
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                return float(value)
+            except ValueError:
+                pass
+    raise FormulaError(f'Переменная {{{{{name}}}}} не число: {value!r}')
+
+
+class Formula:
+    """Разобранная формула: source — исходный текст, variables — используемые переменные."""
+
+    __slots__ = ('source', 'variables', '_evaluate')
+
+    def __init__(self, source: str):
+        if not source or not isinstance(source, str):
+            raise FormulaError('Формула должна быть непустой строкой')
+        if len(source) > MAX_LENGTH:
+            raise FormulaError(f'Формула длиннее {MAX_LENGTH} символов')
+        parser = _Parser(_tokenize(source))
+        try:
+            self._evaluate = parser.parse()
+        except RecursionError:
+            raise FormulaError('Слишком глубокая вложенность формулы')
+        self.source = source
+        self.variables = frozenset(parser.variables)
+
+    def __repr__(self):
+        return f'Formula({self.source!r})'
+
+    def evaluate(self, order_sum, min_sum=0, price=0) -> float:
+        """Стоимость доставки, округленная до 2 знаков."""
+        try:
+            result = self._evaluate((order_sum, min_sum, price))
+            if not isinstance(result, (int, float)):
+                raise FormulaError('Формула должна возвращать число')
+            result = float(result)
+        except FormulaError:
+            raise
+        except (ArithmeticError, TypeError, ValueError, RecursionError) as e:
+            raise FormulaError(f'Ошибка вычисления: {e}')
+        if not math.isfinite(result):
+            raise FormulaError('Результат формулы не конечное число')
+        return round(result, 2)
+
+    def zone_values(self, zone: Dict[str, Any]) -> Tuple[Any, Any]:
+        """
+        (min_sum, price) зоны числами. Приводятся только переменные, которые есть в формуле;
+        нечисловое значение — FormulaError.
+        """
+        values = {}
+        for name, field in ZONE_FIELDS.items():
+            if name in self.variables:
+                values[name] = _number(name, zone.get(field, 0))
+        return values.get('min_sum', 0), values.get('price', 0)
+
+
+@lru_cache(maxsize=1024)
+def _compile_cached(source: str) -> Formula:
+    return Formula(source)
+
+
+def compile_formula(source: str) -> Formula:
+    """Разобранная формула; одинаковые формулы разных зон разбираются один раз."""
+    if not source or not isinstance(source, str):
+        raise FormulaError('Формула должна быть непустой строкой')
+    return _compile_cached(source)
+
+
+def validate_zone_formulas(zones) -> Optional[str]:
+    """Проверка формул зон перед сохранением: текст ошибки или None."""
+    if not isinstance(zones, list):
+        return None
+    for i, zone in enumerate(zones):
+        if not isinstance(zone, dict) or not zone.get('formula'):
+            continue
+        try:
+            compile_formula(zone['formula']).zone_values(zone)
+        except FormulaError as e:
+            return f'Ошибка в формуле зоны #{i+1}: {e}'
+    return None
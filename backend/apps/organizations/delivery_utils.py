@@ -1,12 +1,23 @@
 """
 Утилиты для расчета стоимости доставки на основе зон
+
+Зоны терминала (delivery_zones_conditions) компилируются один раз (compile_zones):
+порядок по приоритету, ограничивающие прямоугольники, рёбра полигонов в плоских кортежах
+и разобранные формулы (delivery_formula). Скомпилированный индекс хранится в памяти процесса под
+updated_at терминала (get_terminal_zone_index) — любое сохранение терминала, в том числе
+правка зон, меняет ключ. Поиск зоны отбрасывает точку по прямоугольнику до точной проверки.
 """
 import logging
-import re
-from typing import Dict, Any, Optional
+from typing import Any, Dict, List, Optional, Tuple
+
+from .delivery_formula import Formula, FormulaError, compile_formula
 
 logger = logging.getLogger(__name__)
 
+# Скомпилированные зоны в памяти процесса: терминал -> (updated_at, индекс)
+_local: Dict[str, Tuple[Any, 'ZoneIndex']] = {}
+_LOCAL_MAX_ENTRIES = 2048
+
 
 def point_in_polygon(lat, lon, polygon_coords):
     """
@@ -83,7 +94,7 @@ def point_in_polygon(lat, lon, polygon_coords):
 
 def evaluate_formula(formula: str, order_sum: float, zone: Dict[str, Any]) -> float:
     """
-    Вычисляет стоимость доставки по формуле.
+    Вычисляет стоимость доставки по формуле (синтаксис — apps.organizations.delivery_formula).
     
     Поддерживаемые переменные:
     - {{order_sum}} - сумма заказа
@@ -99,69 +110,197 @@ def evaluate_formula(formula: str, order_sum: float, zone: Dict[str, Any]) -> fl
         float: Рассчитанная стоимость доставки
     
     Raises:
-        ValueError: Если формула содержит недопустимые символы или не может быть вычислена
+        ValueError: Если формула не разбирается или не может быть вычислена
     """
-    if not formula or not isinstance(formula, str):
-        raise ValueError("Formula must be a non-empty string")
-    
-    # Безопасность: проверяем, что формула содержит только разрешенные символы
-    # Разрешаем: числа, операторы, скобки, пробелы, плейсхолдеры
-    allowed_pattern = re.compile(r'^[0-9+\-*/().\s<>=!?:&|{{}}]+$')
-    if not allowed_pattern.match(formula.replace('{{order_sum}}', '').replace('{{min_sum}}', '').replace('{{price}}', '')):
-        raise ValueError("Formula contains invalid characters")
+    compiled = compile_formula(formula)
+    return compiled.evaluate(order_sum, *compiled.zone_values(zone))
+
+
+def _polygon_vertices(coordinates) -> Optional[List[Tuple[float, float]]]:
+    """
+    Вершины полигона в формате (lon, lat) с той же нормализацией, что в point_in_polygon;
+    None — полигон некорректный и точку не содержит.
+    """
+    coords = coordinates
+    if len(coords) > 0 and isinstance(coords[0], list) and len(coords[0]) > 0:
+        if isinstance(coords[0][0], list):
+            # Формат: [[[lat, lon], ...]] - берем первый элемент
+            coords = coords[0]
+    if len(coords) < 3:
+        return None
+    if not all(isinstance(coord, (list, tuple)) and len(coord) >= 2 for coord in coords):
+        return None
+    try:
+        return [(float(coord[1]), float(coord[0])) for coord in coords]
+    except (TypeError, ValueError):
+        return None
+
+
+class CompiledZone:
+    """Зона доставки, подготовленная к поиску: прямоугольник, рёбра полигона, формула."""
+
+    # vector — массивы рёбер для пакетного расчета (delivery_batch), строятся при первом обращении
+    __slots__ = ('zone', 'name', 'bbox', 'edges', 'formula', 'formula_values', 'vector')
+
+    def __init__(self, zone: Dict[str, Any]):
+        self.zone = zone
+        self.name = zone.get('name', 'Unknown')
+        self.bbox = None
+        self.edges: Tuple[Tuple[float, float, float, float, float], ...] = ()
+
+        vertices = _polygon_vertices(zone.get('coordinates'))
+        if vertices:
+            lons = [x for x, _ in vertices]
+            lats = [y for _, y in vertices]
+            self.bbox = (min(lons), min(lats), max(lons), max(lats))
+            # Ребро (xi, yi, yj, xj - xi, yj - yi) для пары соседних вершин; горизонтальные рёбра
+            # луч не пересекают — их отбрасываем сразу
+            edges = []
+            xj, yj = vertices[-1]
+            for xi, yi in vertices:
+                if yj != yi:
+                    edges.append((xi, yi, yj, xj - xi, yj - yi))
+                xj, yj = xi, yi
+            self.edges = tuple(edges)
+
+        self.vector = None
+        # Формула и значения {{min_sum}}, {{price}} зоны; некорректная формула — расчет без нее
+        self.formula: Optional[Formula] = None
+        self.formula_values: Any = None
+        source = zone.get('formula')
+        if source:
+            try:
+                self.formula = compile_formula(source)
+                self.formula_values = self.formula.zone_values(zone)
+            except FormulaError as e:
+                if self.formula is None:
+                    logger.error(f"Error evaluating formula for zone {self.name}: {e}")
+                else:
+                    self.formula_values = e
+
+    def contains(self, lat: float, lon: float) -> bool:
+        """Ray Casting, как в point_in_polygon; точка вне прямоугольника отбрасывается сразу."""
+        bbox = self.bbox
+        if bbox is None or lon < bbox[0] or lat < bbox[1] or lon > bbox[2] or lat > bbox[3]:
+            return False
+        inside = False
+        for xi, yi, yj, dx, dy in self.edges:
+            if (yi > lat) != (yj > lat):
+                if lon < (dx * (lat - yi)) / dy + xi:
+                    inside = not inside
+        return inside
+
+
+class ZoneIndex:
+    """Зоны терминала в порядке приоритета (1 - наивысший приоритет)."""
+
+    __slots__ = ('zones',)
+
+    def __init__(self, zones: List[CompiledZone]):
+        self.zones = zones
+
+    def __len__(self):
+        return len(self.zones)
+
+    def find(self, lat: float, lon: float) -> Optional[CompiledZone]:
+        for zone in self.zones:
+            if zone.contains(lat, lon):
+                return zone
+        return None
+
+
+def compile_zones(delivery_zones) -> Optional[ZoneIndex]:
+    """Компилирует delivery_zones_conditions; None — зоны не настроены."""
+    if not delivery_zones or not isinstance(delivery_zones, list):
+        return None
+    sorted_zones = sorted(
+        (z for z in delivery_zones if isinstance(z, dict)),
+        key=lambda z: z.get('priority', 999)
+    )
+    compiled = []
+    for zone in sorted_zones:
+        coordinates = zone.get('coordinates', [])
+        if not coordinates or len(coordinates) < 3:
+            logger.debug(f"Zone {zone.get('name', 'Unknown')} skipped: invalid coordinates")
+            continue
+        compiled.append(CompiledZone(zone))
+    return ZoneIndex(compiled)
+
+
+def get_terminal_zone_index(terminal) -> Optional[ZoneIndex]:
+    """
+    Скомпилированные зоны терминала из памяти процесса. Ключ — updated_at терминала:
+    после сохранения терминала (правка зон) индекс собирается заново.
+    """
+    key = str(terminal.pk)
+    local = _local.get(key)
+    if local is not None and local[0] == terminal.updated_at:
+        return local[1]
+    index = compile_zones(terminal.delivery_zones_conditions)
+    if len(_local) >= _LOCAL_MAX_ENTRIES:
+        _local.clear()
+    _local[key] = (terminal.updated_at, index)
+    return index
+
+
+def zone_cost(compiled: CompiledZone, order_amount) -> Dict[str, Any]:
+    zone = compiled.zone
+    zone_name = zone.get('name', 'Неизвестная зона')
     
-    # Получаем значения переменных
-    min_sum = zone.get('min_order_amount', 0)
-    price = zone.get('delivery_cost', 0)
+    # Проверяем, есть ли формула для расчета
+    if compiled.formula is not None:
+        # Используем формулу для расчета
+        try:
+            if isinstance(compiled.formula_values, FormulaError):
+                raise compiled.formula_values
+            cost = compiled.formula.evaluate(order_amount, *compiled.formula_values)
+            is_free = cost == 0
+            return {
+                'cost': cost,
+                'zone_name': zone_name,
+                'is_free': is_free,
+                'zone_found': True,
+                'formula_used': True
+            }
+        except Exception as e:
+            logger.error(f"Error evaluating formula for zone {zone_name}: {e}")
+            # Fallback на старую логику при ошибке в формуле
+            pass
     
-    # Заменяем плейсхолдеры на значения
-    formula_eval = formula.replace('{{order_sum}}', str(order_sum))
-    formula_eval = formula_eval.replace('{{min_sum}}', str(min_sum))
-    formula_eval = formula_eval.replace('{{price}}', str(price))
+    # Старая логика (без формул) - для обратной совместимости
+    delivery_type = zone.get('delivery_type', 'free')
     
-    # Безопасное вычисление формулы
-    # Используем eval только с ограниченным набором функций
-    try:
-        # Заменяем тернарный оператор на if-else для Python
-        # Формат: (condition) ? value_if_true : value_if_false
-        # Преобразуем в: value_if_true if condition else value_if_false
-        
-        # Простая замена тернарного оператора
-        if '?' in formula_eval and ':' in formula_eval:
-            # Находим тернарный оператор
-            parts = formula_eval.split('?', 1)
-            if len(parts) == 2:
-                condition = parts[0].strip().strip('()')
-                rest = parts[1].strip()
-                if ':' in rest:
-                    true_part, false_part = rest.split(':', 1)
-                    true_part = true_part.strip()
-                    false_part = false_part.strip()
-                    # Преобразуем в Python if-else
-                    formula_eval = f"({true_part} if ({condition}) else {false_part})"
-        
-        # Безопасное вычисление: только математические операции
-        # Создаем безопасный контекст для eval
-        safe_dict = {
-            "__builtins__": {},
-            "abs": abs,
-            "min": min,
-            "max": max,
-            "round": round,
+    if delivery_type == 'free':
+        # Проверяем минимальную сумму заказа для бесплатной доставки
+        min_order_amount = zone.get('min_order_amount', 0)
+        if order_amount >= min_order_amount:
+            return {
+                'cost': 0,
+                'zone_name': zone_name,
+                'is_free': True,
+                'zone_found': True,
+                'min_order_amount': min_order_amount
+            }
+        else:
+            # Заказ меньше минимальной суммы - доставка платная
+            delivery_cost = zone.get('delivery_cost', 0)
+            return {
+                'cost': delivery_cost,
+                'zone_name': zone_name,
+                'is_free': False,
+                'zone_found': True,
+                'min_order_amount': min_order_amount,
+                'message': f'Для бесплатной доставки минимальная сумма заказа {min_order_amount} ₸'
+            }
+    else:
+        # Платная доставка
+        delivery_cost = zone.get('delivery_cost', 0)
+        return {
+            'cost': delivery_cost,
+            'zone_name': zone_name,
+            'is_free': False,
+            'zone_found': True
         }
-        
-        result = eval(formula_eval, safe_dict)
-        
-        # Проверяем, что результат - число
-        if not isinstance(result, (int, float)):
-            raise ValueError("Formula must return a number")
-        
-        # Округляем до 2 знаков после запятой и возвращаем
-        return round(float(result), 2)
-        
-    except Exception as e:
-        logger.error(f"Error evaluating formula '{formula}': {e}")
-        raise ValueError(f"Invalid formula: {str(e)}")
 
 
 def calculate_delivery_cost(lat, lon, delivery_zones, order_amount=0):
@@ -172,6 +311,7 @@ def calculate_delivery_cost(lat, lon, delivery_zones, order_amount=0):
         lat: Широта точки доставки
         lon: Долгота точки доставки
         delivery_zones: Список зон доставки из delivery_zones_conditions
+                        или индекс, скомпилированный compile_zones / get_terminal_zone_index
         order_amount: Сумма заказа (для проверки min_order_amount)
     
     Returns:
@@ -182,7 +322,8 @@ def calculate_delivery_cost(lat, lon, delivery_zones, order_amount=0):
             'zone_found': bool  # Найдена ли подходящая зона
         }
     """
-    if not delivery_zones or not isinstance(delivery_zones, list):
+    index = delivery_zones if isinstance(delivery_zones, ZoneIndex) else compile_zones(delivery_zones)
+    if index is None:
         return {
             'cost': None,
             'zone_name': None,
@@ -191,81 +332,11 @@ def calculate_delivery_cost(lat, lon, delivery_zones, order_amount=0):
             'message': 'Зоны доставки не настроены'
         }
     
-    # Сортируем зоны по приоритету (1 - наивысший приоритет)
-    sorted_zones = sorted(
-        delivery_zones,
-        key=lambda z: z.get('priority', 999)
-    )
-    
-    # Проверяем каждую зону, начиная с наивысшим приоритетом
-    for zone in sorted_zones:
-        coordinates = zone.get('coordinates', [])
-        if not coordinates or len(coordinates) < 3:
-            logger.debug(f"Zone {zone.get('name', 'Unknown')} skipped: invalid coordinates")
-            continue
-        
-        # Проверяем попадание точки в зону
-        logger.debug(f"Checking point ({lat}, {lon}) in zone {zone.get('name', 'Unknown')} with {len(coordinates)} coordinates")
-        is_inside = point_in_polygon(lat, lon, coordinates)
-        logger.debug(f"Point ({lat}, {lon}) {'INSIDE' if is_inside else 'OUTSIDE'} zone {zone.get('name', 'Unknown')}")
-        
-        if is_inside:
-            zone_name = zone.get('name', 'Неизвестная зона')
-            
-            # Проверяем, есть ли формула для расчета
-            formula = zone.get('formula')
-            
-            if formula:
-                # Используем формулу для расчета
-                try:
-                    cost = evaluate_formula(formula, order_amount, zone)
-                    is_free = cost == 0
-                    return {
-                        'cost': cost,
-                        'zone_name': zone_name,
-                        'is_free': is_free,
-                        'zone_found': True,
-                        'formula_used': True
-                    }
-                except Exception as e:
-                    logger.error(f"Error evaluating formula for zone {zone_name}: {e}")
-                    # Fallback на старую логику при ошибке в формуле
-                    pass
-            
-            # Старая логика (без формул) - для обратной совместимости
-            delivery_type = zone.get('delivery_type', 'free')
-            
-            if delivery_type == 'free':
-                # Проверяем минимальную сумму заказа для бесплатной доставки
-                min_order_amount = zone.get('min_order_amount', 0)
-                if order_amount >= min_order_amount:
-                    return {
-                        'cost': 0,
-                        'zone_name': zone_name,
-                        'is_free': True,
-                        'zone_found': True,
-                        'min_order_amount': min_order_amount
-                    }
-                else:
-                    # Заказ меньше минимальной суммы - доставка платная
-                    delivery_cost = zone.get('delivery_cost', 0)
-                    return {
-                        'cost': delivery_cost,
-                        'zone_name': zone_name,
-                        'is_free': False,
-                        'zone_found': True,
-                        'min_order_amount': min_order_amount,
-                        'message': f'Для бесплатной доставки минимальная сумма заказа {min_order_amount} ₸'
-                    }
-            else:
-                # Платная доставка
-                delivery_cost = zone.get('delivery_cost', 0)
-                return {
-                    'cost': delivery_cost,
-                    'zone_name': zone_name,
-                    'is_free': False,
-                    'zone_found': True
-                }
+    # Первая зона по приоритету, в которую попадает точка
+    zone = index.find(lat, lon)
+    if zone is not None:
+        logger.debug(f"Point ({lat}, {lon}) INSIDE zone {zone.name}")
+        return zone_cost(zone, order_amount)
     
     # Точка не попала ни в одну зону
     return {
@@ -40,6 +40,15 @@ def sync_discounts_from_iiko(organization: Organization) -> dict:
         logger.error(f"Ошибка при запросе скидок из iiko: {e}")
         raise
 
+    return apply_discounts_response(organization, response)
+
+
+def apply_discounts_response(organization: Organization, response: dict) -> dict:
+    """
+    Применяет уже полученный ответ POST /api/1/discounts к организации (только БД).
+    Используется и при синхронном запросе, и при параллельной выборке по всем организациям.
+    """
+    org_id = organization.iiko_organization_id
     discounts_data = response.get("discounts") or []
     active_external_ids = []
     synced_count = 0
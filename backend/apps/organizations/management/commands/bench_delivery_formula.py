@@ -0,0 +1,264 @@
+import math
+import random
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.organizations.delivery_formula import MAX_LENGTH, FormulaError, compile_formula
+from apps.organizations.delivery_utils import calculate_delivery_cost, compile_zones
+
+
+def _legacy_evaluate(formula, order_sum, zone):
+    """Прежняя реализация evaluate_formula (regex, подстановка, перевод тернарного оператора, eval) — эталон."""
+    if not formula or not isinstance(formula, str):
+        raise ValueError("Formula must be a non-empty string")
+    allowed_pattern = re.compile(r'^[0-9+\-*/().\s<>=!?:&|{{}}]+$')
+    if not allowed_pattern.match(formula.replace('{{order_sum}}', '').replace('{{min_sum}}', '').replace('{{price}}', '')):
+        raise ValueError("Formula contains invalid characters")
+    min_sum = zone.get('min_order_amount', 0)
+    price = zone.get('delivery_cost', 0)
+    formula_eval = formula.replace('{{order_sum}}', str(order_sum))
+    formula_eval = formula_eval.replace('{{min_sum}}', str(min_sum))
+    formula_eval = formula_eval.replace('{{price}}', str(price))
+    try:
+        if '?' in formula_eval and ':' in formula_eval:
+            parts = formula_eval.split('?', 1)
+            if len(parts) == 2:
+                condition = parts[0].strip().strip('()')
+                rest = parts[1].strip()
+                if ':' in rest:
+                    true_part, false_part = rest.split(':', 1)
+                    formula_eval = f"({true_part.strip()} if ({condition}) else {false_part.strip()})"
+        result = eval(formula_eval, {"__builtins__": {}, "abs": abs, "min": min, "max": max, "round": round})
+        if not isinstance(result, (int, float)):
+            raise ValueError("Formula must return a number")
+        return round(float(result), 2)
+    except Exception as e:
+        raise ValueError(f"Invalid formula: {str(e)}")
+
+
+# Формулы из подсказок админки и типичные варианты
+SAMPLES = [
+    '({{order_sum}} < {{min_sum}}) ? {{price}} : 0',
+    '{{order_sum}} >= {{min_sum}} ? 0 : {{price}}',
+    '{{price}} * ({{order_sum}} / 1000)',
+    '({{order_sum}} < {{min_sum}}) ? {{price}} + ({{min_sum}} - {{order_sum}}) * 0.1 : 0',
+    '{{price}}',
+]
+
+
+class _Generator:
+    """Случайные формулы в синтаксисе, который понимала прежняя реализация, и расширенные."""
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def number(self):
+        r = self.rng.random()
+        if r < 0.5:
+            return str(self.rng.randint(0, 5000))
+        if r < 0.8:
+            return f'{self.rng.uniform(0, 100):.{self.rng.randint(1, 3)}f}'
+        return self.rng.choice(['0', '1', '1000', '0.5', '.25', '10.'])
+
+    def operand(self, depth):
+        r = self.rng.random()
+        if depth <= 0 or r < 0.35:
+            return self.rng.choice(['{{order_sum}}', '{{min_sum}}', '{{price}}'])
+        if r < 0.55:
+            return self.number()
+        if r < 0.65:
+            return '-' + self.operand(depth - 1)
+        if r < 0.85:
+            return f'({self.arithmetic(depth - 1)})'
+        # Без цепочек a ** b ** c: прежний движок считал бы 5000 ** 3 ** 27 бесконечно
+        return f'({self.arithmetic(depth - 1)}) ** {self.rng.randint(0, 3)}'
+
+    def arithmetic(self, depth):
+        parts = [self.operand(depth)]
+        for _ in range(self.rng.randint(0, 3)):
+            parts.append(self.rng.choice(['+', '-', '*', '/', '//']))
+            parts.append(self.operand(depth))
+        return ' '.join(parts)
+
+    def comparison(self, depth):
+        ops = ['<', '<=', '>', '>=', '==', '!=']
+        text = f'{self.arithmetic(depth)} {self.rng.choice(ops)} {self.arithmetic(depth)}'
+        if self.rng.random() < 0.15:
+            text += f' {self.rng.choice(ops)} {self.arithmetic(depth)}'
+        return text
+
+    def legacy(self):
+        """Формула, которую прежний движок мог вычислить: одно тернарное выражение верхнего уровня."""
+        depth = self.rng.randint(0, 3)
+        r = self.rng.random()
+        if r < 0.3:
+            return self.arithmetic(depth)
+        if r < 0.4:
+            return self.comparison(depth)
+        condition = self.comparison(depth)
+        if self.rng.random() < 0.5:
+            condition = f'({condition})'
+        return f'{condition} ? {self.arithmetic(depth)} : {self.arithmetic(depth)}'
+
+    def extended(self):
+        """Только для нового движка: вложенные тернарные, && || !, функции (не длиннее MAX_LENGTH)."""
+        while True:
+            formula = self._extended()
+            if len(formula) <= MAX_LENGTH:
+                return formula
+
+    def _extended(self):
+        depth = self.rng.randint(0, 2)
+        func = self.rng.choice(['min', 'max', 'round', 'abs'])
+        if func == 'abs':
+            call = f'abs({self.arithmetic(depth)})'
+        elif func == 'round':
+            call = f'round({self.arithmetic(depth)}, {self.rng.randint(0, 2)})'
+        else:
+            call = f'{func}({self.arithmetic(depth)}, {self.arithmetic(depth)})'
+        return (
+            f'{self.comparison(depth)} && !({self.comparison(depth)}) ? {call} : '
+            f'{self.comparison(depth)} || {self.comparison(depth)} ? {self.arithmetic(depth)} : {call}'
+        )
+
+    def zone(self):
+        def value():
+            return self.rng.choice([0, 500, 1000, 5000, 700.5, '800', 3.25])
+        return {'min_order_amount': value(), 'delivery_cost': value()}
+
+    def order_sum(self):
+        return self.rng.choice([0, 0.0, 1000.0, 4999.99, 5000.0, float(self.rng.randint(0, 20000)), self.rng.uniform(0, 10000)])
+
+
+def _reference_extended(formula, order_sum, zone):
+    """Эталон для расширенного синтаксиса: та же формула как выражение Python."""
+    text = formula.replace('{{order_sum}}', f'({order_sum!r})')
+    text = text.replace('{{min_sum}}', f'({float(zone["min_order_amount"])!r})')
+    text = text.replace('{{price}}', f'({float(zone["delivery_cost"])!r})')
+    text = text.replace('&&', ' and ').replace('||', ' or ').replace('!(', ' not (')
+    # a ? b : c ? d : e -> (b if a else (d if c else e)); тернарные только верхнего уровня
+    cond1, rest = text.split('?', 1)
+    value1, rest = rest.split(':', 1)
+    cond2, rest = rest.split('?', 1)
+    value2, value3 = rest.split(':', 1)
+    text = f'(({value1}) if ({cond1}) else (({value2}) if ({cond2}) else ({value3})))'
+    result = eval(text, {'__builtins__': {}, 'abs': abs, 'min': min, 'max': max, 'round': round})
+    result = float(result)
+    if not math.isfinite(result):
+        raise ValueError('not finite')
+    return round(result, 2)
+
+
+class Command(BaseCommand):
+    help = (
+        'Delivery formula engine: fuzz test against the previous eval()-based implementation '
+        '(results and errors must agree) and microbenchmarks (parse, evaluate, per-quote cost). '
+        'No database access.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cases', type=int, default=20000, help='Fuzz cases (legacy syntax)')
+        parser.add_argument('--extended-cases', type=int, default=5000, help='Fuzz cases with nested ternaries, && || ! and functions')
+        parser.add_argument('--iterations', type=int, default=20000, help='Microbenchmark iterations')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        generator = _Generator(rng)
+        failures = self._fuzz_legacy(generator, options['cases'])
+        failures += self._fuzz_extended(generator, options['extended_cases'])
+        self._bench(options['iterations'])
+        if failures:
+            raise CommandError(f'{failures} fuzz mismatches')
+        self.stdout.write(self.style.SUCCESS('New formula engine agrees with the previous implementation'))
+
+    def _fuzz_legacy(self, generator, cases):
+        agreed = both_failed = new_only = mismatches = 0
+        for _ in range(cases):
+            formula, zone, order_sum = generator.legacy(), generator.zone(), generator.order_sum()
+            try:
+                expected = _legacy_evaluate(formula, order_sum, zone)
+                if not math.isfinite(expected):
+                    # Прежний движок возвращал inf/nan как стоимость; новый считает это ошибкой
+                    expected = None
+            except ValueError:
+                expected = None
+            try:
+                compiled = compile_formula(formula)
+                actual = compiled.evaluate(order_sum, *compiled.zone_values(zone))
+            except FormulaError:
+                actual = None
+
+            if expected is None and actual is None:
+                both_failed += 1
+            elif expected is None:
+                # Формулы вида ((a) < b) ? ... прежний движок ломал, снимая скобки условия
+                new_only += 1
+            elif actual == expected:
+                agreed += 1
+            else:
+                mismatches += 1
+                if mismatches <= 10:
+                    self.stdout.write(self.style.ERROR(
+                        f'  mismatch: {formula!r} order_sum={order_sum!r} zone={zone} legacy={expected} new={actual}'
+                    ))
+        self.stdout.write(
+            f'fuzz legacy syntax   cases={cases} agreed={agreed} both errors={both_failed} '
+            f'new engine only={new_only} mismatches={mismatches}'
+        )
+        return mismatches
+
+    def _fuzz_extended(self, generator, cases):
+        agreed = both_failed = mismatches = 0
+        for _ in range(cases):
+            formula, zone, order_sum = generator.extended(), generator.zone(), generator.order_sum()
+            try:
+                expected = _reference_extended(formula, order_sum, zone)
+            except (ArithmeticError, TypeError, ValueError):
+                expected = None
+            try:
+                compiled = compile_formula(formula)
+                actual = compiled.evaluate(order_sum, *compiled.zone_values(zone))
+            except FormulaError:
+                actual = None
+            if expected is None and actual is None:
+                both_failed += 1
+            elif expected == actual:
+                agreed += 1
+            else:
+                mismatches += 1
+                if mismatches <= 10:
+                    self.stdout.write(self.style.ERROR(
+                        f'  mismatch: {formula!r} order_sum={order_sum!r} zone={zone} reference={expected} new={actual}'
+                    ))
+        self.stdout.write(
+            f'fuzz extended syntax cases={cases} agreed={agreed} both errors={both_failed} mismatches={mismatches}'
+        )
+        return mismatches
+
+    def _timeit(self, label, fn, iterations):
+        started = time.perf_counter()
+        for i in range(iterations):
+            fn(i)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{label:<34} {elapsed / iterations * 1e6:8.2f} us')
+        return elapsed
+
+    def _bench(self, iterations):
+        zone = {'min_order_amount': 5000, 'delivery_cost': 700}
+        formula = SAMPLES[3]
+        compiled = compile_formula(formula)
+        values = compiled.zone_values(zone)
+        amounts = [float(i % 10000) for i in range(iterations)]
+
+        legacy = self._timeit('legacy evaluate (regex + eval)', lambda i: _legacy_evaluate(formula, amounts[i], zone), iterations)
+        self._timeit('parse (uncached Formula)', lambda i: type(compiled)(formula), max(1, iterations // 10))
+        compiled_time = self._timeit('evaluate compiled', lambda i: compiled.evaluate(amounts[i], *values), iterations)
+        self.stdout.write(f'{"":<34} x{legacy / compiled_time:.1f} vs legacy')
+
+        # Полный расчет по зоне с формулой (квадрат, точка внутри)
+        zones = [dict(zone, name='Z', formula=formula, coordinates=[[0, 0], [0, 1], [1, 1], [1, 0]])]
+        index = compile_zones(zones)
+        self._timeit('quote, compiled zones', lambda i: calculate_delivery_cost(0.5, 0.5, index, amounts[i]), iterations)
@@ -0,0 +1,111 @@
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.organizations.delivery_batch import calculate_delivery_costs
+from apps.organizations.delivery_utils import calculate_delivery_cost, compile_zones
+
+# Центр города для синтетических зон (Алматы)
+CITY_LAT, CITY_LON = 43.238, 76.945
+
+
+def _polygon(rng, lat, lon, radius_km, vertices):
+    """Зона как у городского полигона: неровный контур с vertices вершинами, [[lat, lon], ...]."""
+    lat_deg = radius_km / 111.0
+    lon_deg = radius_km / (111.0 * math.cos(math.radians(lat)))
+    phase = rng.uniform(0, 2 * math.pi)
+    coords = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        # Крупные изгибы (районы) плюс мелкий шум (улицы)
+        scale = 1 + 0.15 * math.sin(3 * angle + phase) + 0.05 * math.sin(11 * angle) + rng.uniform(-0.02, 0.02)
+        coords.append([round(lat + lat_deg * scale * math.sin(angle), 7), round(lon + lon_deg * scale * math.cos(angle), 7)])
+    return coords
+
+
+def _terminal_zones(rng, rings, vertices):
+    """Кольца зон вокруг терминала: ближняя — бесплатно от суммы, дальние — платно или по формуле."""
+    lat = CITY_LAT + rng.uniform(-0.04, 0.04)
+    lon = CITY_LON + rng.uniform(-0.06, 0.06)
+    zones = []
+    for ring in range(rings):
+        zone = {
+            'name': f'Зона {ring + 1}',
+            'priority': ring + 1,
+            'coordinates': _polygon(rng, lat, lon, 2.5 * (ring + 1), vertices),
+            'delivery_type': 'free' if ring == 0 else 'paid',
+            'delivery_cost': 500 + 300 * ring,
+            'min_order_amount': 5000,
+        }
+        if ring % 2 == 1:
+            zone['formula'] = '({{order_sum}} < {{min_sum}}) ? {{price}} : 0'
+        zones.append(zone)
+    return zones
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark delivery cost for many addresses: scalar calculate_delivery_cost per point and '
+        'terminal versus the NumPy batch (calculate_delivery_costs) on synthetic city zones with '
+        'hundreds of vertices. Fails if the results differ. No database access.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=2000, help='Addresses to quote')
+        parser.add_argument('--terminals', type=int, default=3, help='Terminals, each with its own zones')
+        parser.add_argument('--zones', type=int, default=4, help='Zones (rings) per terminal')
+        parser.add_argument('--vertices', type=int, default=400, help='Vertices per zone polygon')
+        parser.add_argument('--order-amount', type=float, default=3000.0)
+        parser.add_argument('--raw', action='store_true', help='Also time the scalar path on raw zone lists (compiled per call)')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        raw = [_terminal_zones(rng, options['zones'], options['vertices']) for _ in range(options['terminals'])]
+        indexes = [compile_zones(zones) for zones in raw]
+        # Адреса в пределах города и немного за ним
+        points = [
+            (CITY_LAT + rng.uniform(-0.15, 0.15), CITY_LON + rng.uniform(-0.2, 0.2))
+            for _ in range(options['points'])
+        ]
+        amount = options['order_amount']
+        quotes = len(points) * len(indexes)
+
+        started = time.perf_counter()
+        scalar = [[calculate_delivery_cost(lat, lon, index, amount) for index in indexes] for lat, lon in points]
+        scalar_time = time.perf_counter() - started
+
+        if options['raw']:
+            started = time.perf_counter()
+            for lat, lon in points:
+                for zones in raw:
+                    calculate_delivery_cost(lat, lon, zones, amount)
+            raw_time = time.perf_counter() - started
+            self.stdout.write(f'scalar, raw zones      {raw_time * 1000:9.1f} ms  {raw_time / quotes * 1e6:8.1f} us/quote')
+
+        # Первый пакетный вызов строит массивы рёбер — замеряем его отдельно
+        started = time.perf_counter()
+        batch = calculate_delivery_costs(points, indexes, amount)
+        cold_time = time.perf_counter() - started
+        started = time.perf_counter()
+        batch = calculate_delivery_costs(points, indexes, amount)
+        batch_time = time.perf_counter() - started
+
+        found = sum(1 for row in scalar for result in row if result['zone_found'])
+        self.stdout.write(
+            f'points={len(points)} terminals={len(indexes)} zones/terminal={options["zones"]} '
+            f'vertices/zone={options["vertices"]} quotes={quotes} in zone={found}'
+        )
+        self.stdout.write(f'scalar, compiled zones {scalar_time * 1000:9.1f} ms  {scalar_time / quotes * 1e6:8.1f} us/quote')
+        self.stdout.write(f'batch (first call)     {cold_time * 1000:9.1f} ms  {cold_time / quotes * 1e6:8.1f} us/quote')
+        self.stdout.write(
+            f'batch                  {batch_time * 1000:9.1f} ms  {batch_time / quotes * 1e6:8.1f} us/quote  '
+            f'x{scalar_time / batch_time:.1f}'
+        )
+
+        mismatches = sum(1 for a, b in zip(scalar, batch) if a != b)
+        if mismatches:
+            raise CommandError(f'Batch results differ from scalar for {mismatches} points')
+        self.stdout.write(self.style.SUCCESS('Batch results match scalar calculate_delivery_cost'))
@@ -0,0 +1,97 @@
+import copy
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.organizations.delivery_utils import calculate_delivery_cost, compile_zones
+from apps.organizations.management.commands.bench_delivery_zones import CITY_LAT, CITY_LON, _terminal_zones
+from apps.organizations.zone_geometry import _distance, _project, find_self_intersection, prepare_zones
+
+
+def _drawn(rng, zones, step, noise_m):
+    """Контуры «как нарисованы в Яндекс Картах»: на каждом ребре лишние вершины с дрожанием руки."""
+    lat_m = 1 / 111_320.0
+    lon_m = 1 / (111_320.0 * math.cos(math.radians(CITY_LAT)))
+    for zone in zones:
+        coords = zone['coordinates']
+        dense = []
+        for (lat0, lon0), (lat1, lon1) in zip(coords, coords[1:] + coords[:1]):
+            for k in range(step):
+                t = k / step
+                jitter = rng.uniform(-noise_m, noise_m) if k else 0.0
+                dense.append([lat0 + (lat1 - lat0) * t + jitter * lat_m, lon0 + (lon1 - lon0) * t + jitter * lon_m])
+        zone['coordinates'] = dense
+    return zones
+
+
+class Command(BaseCommand):
+    help = (
+        'Zone geometry simplification: vertex counts and quote latency before and after '
+        'prepare_zones on synthetic hand-drawn polygons. Fails if a simplified zone self-intersects '
+        'or a point farther than the tolerance from the original boundary changes its zone. '
+        'No database access.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--zones', type=int, default=4, help='Zones (rings) of the terminal')
+        parser.add_argument('--vertices', type=int, default=60, help='Vertices of the underlying shape')
+        parser.add_argument('--step', type=int, default=10, help='Drawn vertices per underlying edge')
+        parser.add_argument('--noise', type=float, default=3.0, help='Drawing noise, meters')
+        parser.add_argument('--tolerance', type=float, default=10.0, help='Simplification tolerance, meters')
+        parser.add_argument('--points', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        tolerance = options['tolerance']
+        original = _drawn(rng, _terminal_zones(rng, options['zones'], options['vertices']), options['step'], options['noise'])
+        simplified = copy.deepcopy(original)
+        started = time.perf_counter()
+        prepare_zones(simplified, tolerance)
+        prepare_time = time.perf_counter() - started
+
+        for zone in simplified:
+            stats = zone['simplification']
+            self.stdout.write(
+                f'{zone["name"]:<8} vertices {stats["vertices_before"]:5} -> {stats["vertices_after"]:5}  '
+                f'max deviation {stats["max_deviation_m"]:6.2f} m'
+            )
+            if find_self_intersection(zone['coordinates']):
+                raise CommandError(f'{zone["name"]}: simplified contour self-intersects')
+        self.stdout.write(f'prepare_zones {prepare_time * 1000:.1f} ms')
+
+        points = [
+            (CITY_LAT + rng.uniform(-0.12, 0.12), CITY_LON + rng.uniform(-0.16, 0.16))
+            for _ in range(options['points'])
+        ]
+        timings = {}
+        results = {}
+        for label, zones in (('original', original), ('simplified', simplified)):
+            index = compile_zones(zones)
+            started = time.perf_counter()
+            results[label] = [calculate_delivery_cost(lat, lon, index, 3000) for lat, lon in points]
+            timings[label] = time.perf_counter() - started
+            self.stdout.write(f'quote, {label:<10} {timings[label] / len(points) * 1e6:8.1f} us/quote')
+        self.stdout.write(f'{"":<17} x{timings["original"] / timings["simplified"]:.1f}')
+
+        # Точки дальше допуска от любой исходной границы обязаны остаться в той же зоне
+        rings = [_project(zone['coordinates']) for zone in original]
+        lat0 = math.radians(sum(lat for lat, _ in original[0]['coordinates']) / len(original[0]['coordinates']))
+        changed = near = 0
+        for (lat, lon), before, after in zip(points, results['original'], results['simplified']):
+            if before['zone_name'] == after['zone_name']:
+                continue
+            point = (lon * 111_320.0 * math.cos(lat0), lat * 111_320.0)
+            distance = min(
+                _distance(point, ring[k], ring[k - 1]) for ring in rings for k in range(len(ring))
+            )
+            if distance <= tolerance * 1.01:
+                near += 1
+            else:
+                changed += 1
+        self.stdout.write(f'zone changed: within tolerance of a boundary={near} farther={changed}')
+        if changed:
+            raise CommandError(f'{changed} points farther than the tolerance changed their zone')
+        self.stdout.write(self.style.SUCCESS('Simplified zones agree with the drawn ones beyond the tolerance'))
@@ -0,0 +1,22 @@
+# Generated manually: отпечаток последнего стоп-листа iiko и время последней проверки терминала
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("organizations", "0023_fix_unreflected_model_changes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="terminal",
+            name="stop_list_digest",
+            field=models.CharField(blank=True, default="", max_length=64, verbose_name="Хэш стоп-листа iiko"),
+        ),
+        migrations.AddField(
+            model_name="terminal",
+            name="stop_list_checked_at",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="Стоп-лист проверен"),
+        ),
+    ]
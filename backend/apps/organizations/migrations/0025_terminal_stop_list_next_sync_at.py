@@ -0,0 +1,19 @@
+# Generated manually: время следующей синхронизации стоп-листа терминала (планировщик по терминалам)
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("organizations", "0024_terminal_stop_list_digest"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="terminal",
+            name="stop_list_next_sync_at",
+            field=models.DateTimeField(
+                blank=True, db_index=True, null=True, verbose_name="Следующая синхронизация стоп-листа"
+            ),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated manually: адаптивный интервал синхронизации стоп-листа терминала
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("organizations", "0025_terminal_stop_list_next_sync_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="terminal",
+            name="stop_list_adaptive",
+            field=models.BooleanField(
+                default=False,
+                help_text="Чаще проверять стоп-лист, когда он часто меняется, и реже — когда не меняется",
+                verbose_name="Адаптивный интервал стоп-листа",
+            ),
+        ),
+        migrations.AddField(
+            model_name="terminal",
+            name="stop_list_change_rate",
+            field=models.FloatField(default=0.0, verbose_name="Доля проверок с изменениями стоп-листа"),
+        ),
+        migrations.AddField(
+            model_name="terminal",
+            name="stop_list_effective_interval_min",
+            field=models.IntegerField(blank=True, null=True, verbose_name="Текущий интервал стоп-листа (мин)"),
+        ),
+    ]
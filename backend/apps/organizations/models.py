@@ -33,6 +33,16 @@ class Terminal(models.Model):
         help_text='Частота обновления стоп-листа в минутах'
     )
     
+    # Адаптивный режим: интервал подстраивается под частоту изменений стоп-листа
+    # (в пределах STOP_LIST_ADAPTIVE_MIN_INTERVAL..STOP_LIST_ADAPTIVE_MAX_INTERVAL)
+    stop_list_adaptive = models.BooleanField(
+        'Адаптивный интервал стоп-листа',
+        default=False,
+        help_text='Чаще проверять стоп-лист, когда он часто меняется, и реже — когда не меняется'
+    )
+    stop_list_change_rate = models.FloatField('Доля проверок с изменениями стоп-листа', default=0.0)
+    stop_list_effective_interval_min = models.IntegerField('Текущий интервал стоп-листа (мин)', blank=True, null=True)
+    
     # Зоны доставки (JSONB поле для хранения массива объектов зон)
     delivery_zones_conditions = models.JSONField(
         'Условия зон доставки',
@@ -51,6 +61,15 @@ class Terminal(models.Model):
         help_text="Рабочее время терминала в формате {'start': 'HH:mm', 'end': 'HH:mm'}"
     )
     
+    # Отпечаток последнего применённого ответа iiko по стоп-листу: при совпадении запись в БД пропускается
+    stop_list_digest = models.CharField('Хэш стоп-листа iiko', max_length=64, blank=True, default='')
+    stop_list_checked_at = models.DateTimeField('Стоп-лист проверен', blank=True, null=True)
+    # Когда стоп-лист терминала пора синхронизировать (по stop_list_interval_min и рабочему времени);
+    # планировщик выбирает по индексу только наступившие
+    stop_list_next_sync_at = models.DateTimeField(
+        'Следующая синхронизация стоп-листа', blank=True, null=True, db_index=True
+    )
+    
     is_active = models.BooleanField('Активен', default=True)
     
     # Ссылка на Instagram терминала (для брендинга в TMA)
@@ -74,6 +93,19 @@ class Terminal(models.Model):
     def __str__(self):
         return self.terminal_group_name or str(self.terminal_id)
 
+    @property
+    def stop_list_effective_interval(self) -> int:
+        """Интервал синхронизации стоп-листа в минутах с учётом адаптивного режима."""
+        if self.stop_list_adaptive and self.stop_list_effective_interval_min:
+            return self.stop_list_effective_interval_min
+        return self.stop_list_interval_min or 30
+
+    @classmethod
+    def reset_stop_list_digests(cls, organization_id):
+        """Сбрасывает отпечатки стоп-листа организации: следующая синхронизация применит ответ iiko заново."""
+        if organization_id is not None:
+            cls.objects.filter(organization_id=organization_id).exclude(stop_list_digest='').update(stop_list_digest='')
+
 
 class Organization(models.Model):
     """Организация (ресторан)"""
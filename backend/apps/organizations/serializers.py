@@ -1,5 +1,7 @@
 from rest_framework import serializers
+from .delivery_formula import validate_zone_formulas
 from .models import Organization, Terminal, Street, PaymentType, City, Discount
+from .zone_geometry import ZoneGeometryError, prepare_zones
 
 
 class TerminalSerializer(serializers.ModelSerializer):
@@ -9,6 +11,8 @@ class TerminalSerializer(serializers.ModelSerializer):
     iiko_terminal_id = serializers.UUIDField(source='terminal_id', read_only=True)
     city_id = serializers.UUIDField(source='city.city_id', read_only=True, allow_null=True)
     city_name = serializers.CharField(source='city.name', read_only=True, allow_null=True)
+    # Интервал, по которому сейчас синхронизируется стоп-лист (в адаптивном режиме — подобранный)
+    stop_list_effective_interval = serializers.IntegerField(read_only=True)
     
     class Meta:
         model = Terminal
@@ -16,12 +20,32 @@ class TerminalSerializer(serializers.ModelSerializer):
             'id', 'terminal_id', 'iiko_terminal_id', 'iiko_organization_id', 
             'terminal_group_name', 'name', 'is_active', 'organization',
             'city', 'city_id', 'city_name',
-            'stop_list_interval_min', 'delivery_zones_conditions',
+            'stop_list_interval_min', 'stop_list_adaptive', 'stop_list_effective_interval',
+            'stop_list_change_rate', 'stop_list_checked_at', 'stop_list_next_sync_at',
+            'delivery_zones_conditions',
             'working_hours', 'is_delivery_calculation_apply',
             'instagram_link',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'terminal_id', 'created_at', 'updated_at']
+        read_only_fields = [
+            'id', 'terminal_id', 'stop_list_change_rate', 'stop_list_checked_at', 'stop_list_next_sync_at',
+            'created_at', 'updated_at'
+        ]
+    
+    def validate_delivery_zones_conditions(self, value):
+        error = validate_zone_formulas(value)
+        if error:
+            raise serializers.ValidationError(error)
+        if isinstance(value, list):
+            # Те же нормализация и проверка контуров, что в update_delivery_zones (без упрощения)
+            for i, zone in enumerate(value):
+                if not isinstance(zone, dict):
+                    raise serializers.ValidationError(f'Зона #{i+1} должна быть объектом')
+            try:
+                prepare_zones(value)
+            except ZoneGeometryError as e:
+                raise serializers.ValidationError(str(e))
+        return value
 
 
 class OrganizationSerializer(serializers.ModelSerializer):
@@ -305,3 +305,65 @@ def send_mailing_test_to_chat(self, mailing_id: int, chat_id: int):
         )
         raise self.retry(exc=exc)
 
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def sync_iiko_reference_data(self):
+    """
+    Периодическая задача (Celery Beat): терминальные группы, типы оплаты и скидки
+    всех активных организаций.
+
+    Запросы к iiko для всех организаций идут параллельно (AsyncIikoClient,
+    не более IIKO_ASYNC_CONCURRENCY одновременно), затем ответы применяются к БД
+    последовательно. Отключённые вручную терминалы и типы оплаты не включаются обратно.
+    """
+    import asyncio
+
+    from apps.iiko_integration.async_client import fetch_for_organizations
+    from apps.iiko_integration.services import MenuSyncService
+    from apps.organizations.discount_services import apply_discounts_response
+
+    organizations = list(
+        Organization.objects.filter(is_active=True, api_key__isnull=False)
+        .exclude(api_key="")
+        .exclude(iiko_organization_id__isnull=True)
+        .exclude(iiko_organization_id="")
+    )
+
+    async def fetch(client, org):
+        org_ids = [org.iiko_organization_id]
+        return await asyncio.gather(
+            client.get_terminal_groups(org_ids),
+            client.get_payment_types(org_ids),
+            client.get_discounts(org_ids),
+        )
+
+    try:
+        responses = fetch_for_organizations(organizations, fetch)
+    except Exception as exc:
+        logger.error("sync_iiko_reference_data: ошибка выборки из iiko: %s", exc, exc_info=True)
+        raise self.retry(exc=exc)
+
+    service = MenuSyncService()
+    synced = 0
+    errors = 0
+    for org in organizations:
+        result = responses.get(org.pk)
+        if isinstance(result, BaseException):
+            errors += 1
+            logger.error("sync_iiko_reference_data: org=%s ошибка iiko: %s", org.org_name, result)
+            continue
+        terminal_groups_data, payment_types_data, discounts_data = result
+        try:
+            service.sync_terminal_groups(terminal_groups_data, org, activate=False)
+            service.sync_payment_types(org, payment_types_data, activate=False)
+            apply_discounts_response(org, discounts_data)
+            synced += 1
+        except Exception as exc:
+            errors += 1
+            logger.error(
+                "sync_iiko_reference_data: org=%s ошибка применения: %s", org.org_name, exc, exc_info=True
+            )
+
+    logger.info("sync_iiko_reference_data: синхронизировано %s, ошибок %s", synced, errors)
+    return {"synced": synced, "errors": errors}
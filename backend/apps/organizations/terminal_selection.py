@@ -0,0 +1,184 @@
+"""
+Выбор терминала по координатам доставки.
+
+Раньше при нескольких терминалах клиент выбирал филиал сам, а TMA запрашивала
+calculate-delivery-cost по каждому терминалу отдельно. Здесь зоны всех активных терминалов
+организации с расчетом доставки собраны в один пространственный индекс (OrganizationZoneIndex):
+равномерная сетка по общему прямоугольнику, в ячейке — зоны, чьи прямоугольники её задевают.
+Точка проверяется только против зон своей ячейки; для каждого терминала берется первая
+по приоритету зона, содержащая точку, и ее стоимость (zone_cost), затем лучший терминал —
+по приоритету зоны или по стоимости (DELIVERY_TERMINAL_STRATEGY).
+
+Индекс хранится в памяти процесса под набором (терминал, updated_at): проверка актуальности —
+один запрос id и updated_at терминалов организации, без чтения зон.
+"""
+import logging
+import math
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+
+from .delivery_utils import CompiledZone, get_terminal_zone_index, zone_cost
+from .models import Terminal
+
+logger = logging.getLogger(__name__)
+
+STRATEGY_PRIORITY = 'priority'
+STRATEGY_COST = 'cost'
+STRATEGIES = (STRATEGY_PRIORITY, STRATEGY_COST)
+
+# Ячеек сетки по каждой оси
+GRID_SIZE = 64
+
+# Индексы организаций в памяти процесса: организация -> (ключ набора терминалов, индекс)
+_local: Dict[str, Tuple[tuple, 'OrganizationZoneIndex']] = {}
+_LOCAL_MAX_ENTRIES = 512
+
+
+def _priority(zone: CompiledZone) -> float:
+    try:
+        return float(zone.zone.get('priority', 999))
+    except (TypeError, ValueError):
+        return 999.0
+
+
+def _cost(quote: Dict[str, Any]) -> float:
+    try:
+        return float(quote.get('cost'))
+    except (TypeError, ValueError):
+        return math.inf
+
+
+class OrganizationZoneIndex:
+    """Зоны терминалов организации в сетке по ограничивающим прямоугольникам."""
+
+    def __init__(self, terminals: List[Terminal]):
+        self.terminals = terminals
+        # (номер терминала, номер зоны в порядке приоритета терминала, зона)
+        self.entries: List[Tuple[int, int, CompiledZone]] = []
+        for t_pos, terminal in enumerate(terminals):
+            index = get_terminal_zone_index(terminal)
+            for z_pos, zone in enumerate(index.zones if index else ()):
+                if zone.bbox is not None:
+                    self.entries.append((t_pos, z_pos, zone))
+
+        self.cells: Dict[Tuple[int, int], Tuple[int, ...]] = {}
+        self.bounds = None
+        if not self.entries:
+            return
+        min_lon = min(e[2].bbox[0] for e in self.entries)
+        min_lat = min(e[2].bbox[1] for e in self.entries)
+        max_lon = max(e[2].bbox[2] for e in self.entries)
+        max_lat = max(e[2].bbox[3] for e in self.entries)
+        self.bounds = (min_lon, min_lat, max_lon, max_lat)
+        self.cell_lon = (max_lon - min_lon) / GRID_SIZE or 1.0
+        self.cell_lat = (max_lat - min_lat) / GRID_SIZE or 1.0
+
+        cells: Dict[Tuple[int, int], List[int]] = {}
+        for i, (_, _, zone) in enumerate(self.entries):
+            x0, y0 = self._cell(zone.bbox[0], zone.bbox[1])
+            x1, y1 = self._cell(zone.bbox[2], zone.bbox[3])
+            for x in range(x0, x1 + 1):
+                for y in range(y0, y1 + 1):
+                    cells.setdefault((x, y), []).append(i)
+        # Внутри ячейки — по терминалу и приоритету зоны: первая содержащая точку зона терминала — его зона
+        self.cells = {
+            key: tuple(sorted(ids, key=lambda i: (self.entries[i][0], self.entries[i][1])))
+            for key, ids in cells.items()
+        }
+
+    def _cell(self, lon: float, lat: float) -> Tuple[int, int]:
+        x = int((lon - self.bounds[0]) / self.cell_lon)
+        y = int((lat - self.bounds[1]) / self.cell_lat)
+        return min(max(x, 0), GRID_SIZE - 1), min(max(y, 0), GRID_SIZE - 1)
+
+    def locate(self, lat: float, lon: float) -> List[Tuple[Terminal, CompiledZone]]:
+        """Терминалы, в зону которых попадает точка, с первой по приоритету такой зоной."""
+        if self.bounds is None:
+            return []
+        min_lon, min_lat, max_lon, max_lat = self.bounds
+        if not (min_lon <= lon <= max_lon and min_lat <= lat <= max_lat):
+            return []
+        found = []
+        matched = set()
+        for i in self.cells.get(self._cell(lon, lat), ()):
+            t_pos, _, zone = self.entries[i]
+            if t_pos not in matched and zone.contains(lat, lon):
+                matched.add(t_pos)
+                found.append((self.terminals[t_pos], zone))
+        return found
+
+
+def _candidate_terminals(organization_id):
+    return Terminal.objects.filter(
+        organization_id=organization_id, is_active=True, is_delivery_calculation_apply=True
+    )
+
+
+def get_organization_zone_index(organization_id) -> OrganizationZoneIndex:
+    """Индекс организации; пересобирается, если изменился набор терминалов или их updated_at."""
+    key = tuple(_candidate_terminals(organization_id).order_by('pk').values_list('pk', 'updated_at'))
+    cache_key = str(organization_id)
+    local = _local.get(cache_key)
+    if local is not None and local[0] == key:
+        return local[1]
+    terminals = list(_candidate_terminals(organization_id).order_by('pk'))
+    index = OrganizationZoneIndex(terminals)
+    if len(_local) >= _LOCAL_MAX_ENTRIES:
+        _local.clear()
+    # Ключ — по фактически загруженным терминалам (между запросами набор мог измениться)
+    _local[cache_key] = (tuple((t.pk, t.updated_at) for t in terminals), index)
+    return index
+
+
+def select_terminal(
+    organization_id,
+    latitude: float,
+    longitude: float,
+    order_amount=0,
+    strategy: Optional[str] = None,
+    terminal_ids: Optional[Iterable] = None,
+) -> Dict[str, Any]:
+    """
+    Лучший терминал для точки доставки.
+
+    Args:
+        terminal_ids: Ограничить выбор этими терминалами (например, выданными пользователю)
+        strategy: 'priority' — зона с наивысшим приоритетом (при равенстве — дешевле),
+                  'cost' — самая дешевая доставка (при равенстве — выше приоритет зоны)
+
+    Returns:
+        dict: {'terminal': Terminal или None, 'quote': результат как у calculate_delivery_cost,
+               'candidates': [{'terminal': Terminal, 'quote': dict, 'zone_priority': float}, ...]}
+    """
+    strategy = strategy or getattr(settings, 'DELIVERY_TERMINAL_STRATEGY', STRATEGY_PRIORITY)
+    allowed = {str(t) for t in terminal_ids} if terminal_ids is not None else None
+
+    candidates = []
+    for position, (terminal, zone) in enumerate(get_organization_zone_index(organization_id).locate(latitude, longitude)):
+        if allowed is not None and str(terminal.pk) not in allowed:
+            continue
+        quote = zone_cost(zone, order_amount)
+        candidates.append({'terminal': terminal, 'quote': quote, 'zone_priority': _priority(zone), '_position': position})
+
+    if strategy == STRATEGY_COST:
+        candidates.sort(key=lambda c: (_cost(c['quote']), c['zone_priority'], c['_position']))
+    else:
+        candidates.sort(key=lambda c: (c['zone_priority'], _cost(c['quote']), c['_position']))
+    for candidate in candidates:
+        del candidate['_position']
+
+    if not candidates:
+        return {
+            'terminal': None,
+            'quote': {
+                'cost': None,
+                'zone_name': None,
+                'is_free': False,
+                'zone_found': False,
+                'message': 'Адрес не попадает в зоны доставки'
+            },
+            'candidates': [],
+        }
+    best = candidates[0]
+    return {'terminal': best['terminal'], 'quote': best['quote'], 'candidates': candidates}
@@ -1,8 +1,11 @@
 import logging
+import uuid
 from rest_framework import viewsets, permissions, filters, status, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from django.shortcuts import get_object_or_404
 
 logger = logging.getLogger(__name__)
@@ -26,9 +29,16 @@ from .mailing_serializers import MailingTaskSerializer
 from .tasks import send_mailing_test_to_chat, get_mailing_recipients_queryset
 from apps.iiko_integration.client import IikoClient, IikoAPIException
 from apps.iiko_integration.services import MenuSyncService, StopListSyncService
-from apps.products.tasks import is_global_sync_allowed, is_working_time
-from .delivery_utils import calculate_delivery_cost
+from apps.products.catalog_cache import invalidate_catalog
+from apps.products.models import MenuImportJob
+from apps.products.menu_import import MenuImportAlreadyRunning, get_job_payload, start_menu_import
+from apps.products.tasks import is_global_sync_allowed, is_working_time, next_stop_list_sync_at
+from .delivery_batch import calculate_delivery_costs
+from .delivery_formula import validate_zone_formulas
+from .delivery_utils import calculate_delivery_cost, get_terminal_zone_index
 from .discount_services import sync_discounts_from_iiko
+from .terminal_selection import STRATEGIES as TERMINAL_STRATEGIES, select_terminal
+from .zone_geometry import MAX_TOLERANCE_M as MAX_SIMPLIFY_TOLERANCE_M, ZoneGeometryError, prepare_zones
 
 
 class OrganizationViewSet(viewsets.ModelViewSet):
@@ -93,10 +103,84 @@ class OrganizationViewSet(viewsets.ModelViewSet):
             )
             serializer.is_valid(raise_exception=True)
             serializer.save()
+            invalidate_catalog(organization.pk)
             return Response(serializer.data)
         serializer = self.get_serializer(organization)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['post'], url_path='select-terminal')
+    def select_delivery_terminal(self, request):
+        """
+        Подобрать терминал организации пользователя по координатам доставки
+        
+        Ожидает:
+        {
+            "latitude": float,
+            "longitude": float,
+            "order_amount": float (опционально),
+            "strategy": "priority" | "cost" (опционально, по умолчанию DELIVERY_TERMINAL_STRATEGY)
+        }
+        
+        Возвращает результат calculate-delivery-cost лучшего терминала с полями terminal_id,
+        terminal_name и candidates — все подходящие терминалы в порядке выбора.
+        Если пользователю выданы терминалы, выбор идет только среди них.
+        """
+        user = request.user
+        organization_id = getattr(user, 'organization_id', None)
+        if not organization_id:
+            return Response(
+                {'error': 'Пользователь не привязан к организации'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        strategy = request.data.get('strategy') or None
+        if strategy is not None and strategy not in TERMINAL_STRATEGIES:
+            return Response(
+                {'error': f'strategy должен быть одним из: {", ".join(TERMINAL_STRATEGIES)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        latitude = request.data.get('latitude')
+        longitude = request.data.get('longitude')
+        if latitude is None or longitude is None:
+            return Response(
+                {'error': 'Поля latitude и longitude обязательны'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            latitude = float(latitude)
+            longitude = float(longitude)
+            order_amount = request.data.get('order_amount', 0)
+            order_amount = float(order_amount) if order_amount else 0
+        except (ValueError, TypeError):
+            return Response(
+                {'error': 'latitude, longitude и order_amount должны быть числами'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        user_terminals = list(user.terminals.values_list('terminal_id', flat=True)) if hasattr(user, 'terminals') else []
+        choice = select_terminal(
+            organization_id, latitude, longitude, order_amount,
+            strategy=strategy, terminal_ids=user_terminals or None,
+        )
+        terminal = choice['terminal']
+        logger.info(
+            f"Terminal selection for point ({latitude}, {longitude}), order_amount={order_amount}: "
+            f"{terminal.pk if terminal else None} of {len(choice['candidates'])} candidates"
+        )
+        return Response({
+            'terminal_id': terminal.pk if terminal else None,
+            'terminal_name': terminal.terminal_group_name if terminal else None,
+            **choice['quote'],
+            'candidates': [
+                {
+                    'terminal_id': c['terminal'].pk,
+                    'terminal_name': c['terminal'].terminal_group_name,
+                    **c['quote'],
+                }
+                for c in choice['candidates']
+            ],
+        })
+
     @action(detail=False, methods=['post'], url_path='test-webhook')
     def test_webhook(self, request):
         """Отправить тестовый JSON на webhook_link организации (для проверки ссылки)."""
@@ -400,20 +484,20 @@ class OrganizationViewSet(viewsets.ModelViewSet):
             traceback.print_exc()
             return Response({'error': str(e)}, status=500)
 
-    @action(detail=False, methods=['post'], url_path='load-menu')
-    def load_menu(self, request):
-        """Загрузить меню из iiko: внешнее (external_menu_id + price_category_id) или номенклатура."""
+    def _menu_import_organization(self, request):
         user = request.user
-        external_menu_id = request.data.get('external_menu_id')
-        price_category_id = request.data.get('price_category_id')
-        menu_name = request.data.get('menu_name')
-        price_category_name = request.data.get('price_category_name', '')
-
         if hasattr(user, 'organization') and user.organization:
-            organization = user.organization
-        else:
-            organization = Organization.objects.filter(is_active=True).first()
+            return user.organization
+        return Organization.objects.filter(is_active=True).first()
 
+    @action(detail=False, methods=['post'], url_path='load-menu')
+    def load_menu(self, request):
+        """
+        Загрузить меню из iiko: внешнее (external_menu_id + price_category_id) или номенклатура.
+        Импорт выполняется в фоне (Celery): ответ 202 с job_id, статус — GET load-menu/<job_id>/.
+        Если импорт этой организации уже идёт — 409 с job_id текущего импорта.
+        """
+        organization = self._menu_import_organization(request)
         if not organization:
             return Response(
                 {'error': 'Организация не найдена'},
@@ -426,51 +510,59 @@ class OrganizationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        external_menu_id = request.data.get('external_menu_id')
+        if external_menu_id:
+            params = {
+                'external_menu_id': str(external_menu_id),
+                'price_category_id': request.data.get('price_category_id') or None,
+                'menu_name': request.data.get('menu_name') or None,
+                'price_category_name': request.data.get('price_category_name') or None,
+            }
+        else:
+            # Номенклатура (API v1): инкрементально по ревизии, full_resync — полная перезагрузка
+            params = {
+                'full_resync': str(request.data.get('full_resync', '')).lower() in ('1', 'true', 'yes'),
+            }
+
         try:
-            client = IikoClient(organization.api_key)
-            org_id = organization.iiko_organization_id
+            job = start_menu_import(organization, request.user, params)
+        except MenuImportAlreadyRunning as e:
+            return Response(
+                {
+                    'error': 'Импорт меню уже выполняется',
+                    'job_id': str(e.job.pk),
+                    'job': get_job_payload(e.job),
+                },
+                status=status.HTTP_409_CONFLICT
+            )
 
-            if external_menu_id:
-                menu_data = client.get_external_menu_by_id(
-                    organization_ids=[org_id],
-                    external_menu_id=str(external_menu_id),
-                    price_category_id=str(price_category_id) if price_category_id else None,
-                )
-                service = MenuSyncService()
-                service.sync_external_menu(
-                    organization=organization,
-                    menu_data=menu_data,
-                    menu_name=menu_name or None,
-                    price_category_id=str(price_category_id) if price_category_id else None,
-                    price_category_name=price_category_name or None,
-                    external_menu_id=str(external_menu_id),
-                    set_active=True,
-                )
-                return Response({
-                    'message': 'Внешнее меню успешно загружено',
-                    'success': True,
-                })
-            else:
-                # Номенклатура (API v1)
-                menu_data = client.get_menu(org_id)
-                service = MenuSyncService()
-                service.sync_menu(organization, menu_data)
-                return Response({
-                    'message': 'Меню успешно загружено из iiko',
-                    'success': True,
-                })
-        except IikoAPIException as e:
+        return Response(
+            {
+                'message': 'Импорт меню запущен',
+                'success': True,
+                'job_id': str(job.pk),
+                'job': get_job_payload(job),
+            },
+            status=status.HTTP_202_ACCEPTED
+        )
+
+    @action(detail=False, methods=['get'], url_path=r'load-menu/(?P<job_id>[^/.]+)')
+    def load_menu_status(self, request, job_id=None):
+        """Статус фонового импорта меню: status (pending/running/done/error), phase, processed/total, result."""
+        organization = self._menu_import_organization(request)
+        if not organization:
             return Response(
-                {'error': f'Ошибка при загрузке меню из iiko: {str(e)}'},
-                status=status.HTTP_400_BAD_REQUEST
+                {'error': 'Организация не найдена'},
+                status=status.HTTP_404_NOT_FOUND
             )
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
+        try:
+            job = MenuImportJob.objects.get(pk=job_id, organization=organization)
+        except (MenuImportJob.DoesNotExist, ValidationError, ValueError):
             return Response(
-                {'error': f'Неожиданная ошибка: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {'error': 'Импорт меню не найден'},
+                status=status.HTTP_404_NOT_FOUND
             )
+        return Response(get_job_payload(job))
 
 
 class TerminalViewSet(viewsets.ModelViewSet):
@@ -479,6 +571,17 @@ class TerminalViewSet(viewsets.ModelViewSet):
     serializer_class = TerminalSerializer
     permission_classes = [permissions.IsAuthenticated]
     
+    def perform_update(self, serializer):
+        # Новый интервал или рабочее время — пересчитать расписание стоп-листа при ближайшем запуске планировщика
+        changed = set(serializer.validated_data)
+        extra = {}
+        if {'stop_list_interval_min', 'working_hours', 'stop_list_adaptive'} & changed:
+            extra['stop_list_next_sync_at'] = None
+        if {'stop_list_interval_min', 'stop_list_adaptive'} & changed:
+            # Адаптация начинается заново от базового интервала
+            extra.update(stop_list_effective_interval_min=None, stop_list_change_rate=0.0)
+        serializer.save(**extra)
+    
     @action(detail=True, methods=['post'], url_path='sync-stop-list')
     def sync_stop_list(self, request, pk=None):
         """Принудительно синхронизировать стоп-лист для терминала (только для активных и в рабочее время)."""
@@ -517,6 +620,9 @@ class TerminalViewSet(viewsets.ModelViewSet):
         try:
             service = StopListSyncService(organization.api_key)
             result = service.sync_terminal_stop_list(terminal)
+            Terminal.objects.filter(pk=terminal.pk).update(
+                stop_list_next_sync_at=next_stop_list_sync_at(terminal)
+            )
             
             return Response({
                 'message': 'Стоп-лист успешно синхронизирован',
@@ -542,7 +648,13 @@ class TerminalViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['patch'], url_path='delivery-zones')
     def update_delivery_zones(self, request, pk=None):
-        """Обновить зоны доставки для терминала"""
+        """
+        Обновить зоны доставки для терминала.
+
+        Координаты нормализуются, самопересекающиеся контуры отклоняются (zone_geometry).
+        simplify (по умолчанию DELIVERY_ZONE_SIMPLIFY) — упростить контуры с допуском
+        simplify_tolerance_m метров (по умолчанию DELIVERY_ZONE_SIMPLIFY_TOLERANCE_M).
+        """
         terminal = self.get_object()
         
         delivery_zones = request.data.get('delivery_zones_conditions')
@@ -575,12 +687,6 @@ class TerminalViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            if not isinstance(zone['coordinates'], list) or len(zone['coordinates']) < 3:
-                return Response(
-                    {'error': f'В зоне #{i+1} должно быть минимум 3 точки координат'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
             # Установка значений по умолчанию
             zone.setdefault('name', f'Зона {i+1}')
             zone.setdefault('priority', i+1)
@@ -589,6 +695,32 @@ class TerminalViewSet(viewsets.ModelViewSet):
             zone.setdefault('delivery_cost', 0)
             zone.setdefault('min_order_amount', 0)
         
+        formula_error = validate_zone_formulas(delivery_zones)
+        if formula_error:
+            return Response({'error': formula_error}, status=status.HTTP_400_BAD_REQUEST)
+        
+        simplify = request.data.get('simplify', settings.DELIVERY_ZONE_SIMPLIFY)
+        tolerance_m = None
+        if str(simplify).lower() in ('1', 'true', 'yes'):
+            try:
+                tolerance_m = float(request.data.get('simplify_tolerance_m', settings.DELIVERY_ZONE_SIMPLIFY_TOLERANCE_M))
+            except (TypeError, ValueError):
+                tolerance_m = -1
+            if not 0 < tolerance_m <= MAX_SIMPLIFY_TOLERANCE_M:
+                return Response(
+                    {'error': f'simplify_tolerance_m должен быть числом от 0 до {MAX_SIMPLIFY_TOLERANCE_M:g} метров'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        try:
+            prepare_zones(delivery_zones, tolerance_m)
+        except ZoneGeometryError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if tolerance_m:
+            before = sum(zone['simplification']['vertices_before'] for zone in delivery_zones)
+            after = sum(zone['simplification']['vertices_after'] for zone in delivery_zones)
+            logger.info(f"Зоны терминала {terminal.pk} упрощены (допуск {tolerance_m:g} м): вершин {before} -> {after}")
+        
         try:
             terminal.delivery_zones_conditions = delivery_zones
             terminal.save()
@@ -613,7 +745,11 @@ class TerminalViewSet(viewsets.ModelViewSet):
         
         try:
             terminal.is_active = not terminal.is_active
+            if terminal.is_active:
+                # Включённый терминал синхронизируется при ближайшем запуске планировщика
+                terminal.stop_list_next_sync_at = None
             terminal.save()
+            invalidate_catalog(terminal.organization_id)
             
             serializer = self.get_serializer(terminal)
             return Response({
@@ -672,10 +808,10 @@ class TerminalViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Получаем зоны доставки
-        delivery_zones = terminal.delivery_zones_conditions
+        # Зоны доставки терминала, скомпилированные под его updated_at
+        delivery_zones = get_terminal_zone_index(terminal)
         
-        if not delivery_zones:
+        if delivery_zones is None:
             return Response({
                 'cost': None,
                 'zone_name': None,
@@ -690,6 +826,78 @@ class TerminalViewSet(viewsets.ModelViewSet):
         logger.info(f"Delivery cost calculation result: {result}")
         
         return Response(result)
+    
+    @action(detail=False, methods=['post'], url_path='calculate-delivery-costs')
+    def calculate_delivery_costs(self, request):
+        """
+        Рассчитать стоимость доставки для набора координат по нескольким терминалам
+        (например, для всех сохраненных адресов пользователя)
+        
+        Ожидает:
+        {
+            "terminal_ids": [uuid, ...],
+            "points": [{"latitude": float, "longitude": float}, ...],
+            "order_amount": float (опционально)
+        }
+        
+        Возвращает results[i][j] — результат calculate-delivery-cost для точки i и терминала j
+        """
+        terminal_ids = request.data.get('terminal_ids')
+        points = request.data.get('points')
+        order_amount = request.data.get('order_amount', 0)
+        
+        if not isinstance(terminal_ids, list) or not terminal_ids or not isinstance(points, list):
+            return Response(
+                {'error': 'Поля terminal_ids (непустой массив) и points (массив) обязательны'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        max_points = getattr(settings, 'DELIVERY_BATCH_MAX_POINTS', 1000)
+        if len(points) > max_points:
+            return Response(
+                {'error': f'Не больше {max_points} точек за запрос'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            coordinates = [(float(p['latitude']), float(p['longitude'])) for p in points]
+            order_amount = float(order_amount) if order_amount else 0
+            terminal_ids = [str(uuid.UUID(str(t))) for t in terminal_ids]
+        except (KeyError, ValueError, TypeError, AttributeError):
+            return Response(
+                {'error': 'points должны содержать числовые latitude и longitude, terminal_ids — UUID'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        terminals = {str(t.pk): t for t in self.get_queryset().filter(pk__in=terminal_ids)}
+        missing = [t for t in terminal_ids if t not in terminals]
+        if missing:
+            return Response(
+                {'error': f'Терминалы не найдены: {", ".join(missing)}'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        # Терминал без расчета стоимости — тот же ответ, что у calculate-delivery-cost
+        disabled = {
+            'cost': None,
+            'zone_name': None,
+            'is_free': False,
+            'zone_found': False,
+            'message': 'Расчет стоимости доставки не включен для этого терминала'
+        }
+        enabled = [t for t in terminal_ids if terminals[t].is_delivery_calculation_apply]
+        computed = calculate_delivery_costs(
+            coordinates, [get_terminal_zone_index(terminals[t]) for t in enabled], order_amount
+        )
+        column = {t: j for j, t in enumerate(enabled)}
+        results = [
+            [row[column[t]] if t in column else dict(disabled) for t in terminal_ids]
+            for row in computed
+        ]
+        logger.info(
+            f"Batch delivery cost: points={len(coordinates)}, terminals={len(terminal_ids)}, "
+            f"order_amount={order_amount}"
+        )
+        return Response({'terminal_ids': terminal_ids, 'results': results})
 
 
 class StreetViewSet(viewsets.ModelViewSet):
@@ -0,0 +1,233 @@
+"""
+Геометрия зон доставки при сохранении (TerminalViewSet.update_delivery_zones).
+
+Полигоны, нарисованные в Яндекс Картах, приходят с сотнями почти коллинеарных вершин,
+а каждая вершина — ребро, которое проверяется при каждом расчете доставки. При сохранении:
+- координаты приводятся к одному виду [[lat, lon], ...] (вложенный [[[lat, lon], ...]] —
+  берется внешний контур, как при расчете), числа — float, повторы вершин и замыкающая
+  вершина убираются; на попадание точек это не влияет;
+- контур, пересекающий сам себя, отклоняется: для него Ray Casting дает зону «с дырами»;
+- по запросу контур упрощается (Дуглас — Пекер) с допуском в метрах: вершины, отклонение
+  которых от упрощенного контура не больше допуска, удаляются. Если упрощенный контур
+  пересекает сам себя, остается исходный. Статистика сохраняется в зоне (simplification).
+"""
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+# Метров в градусе широты (долготы — умножается на cos широты)
+METERS_PER_DEGREE = 111_320.0
+# Верхняя граница допуска упрощения: больше — уже искажение зоны, а не шум рисования
+MAX_TOLERANCE_M = 500.0
+
+Point = Tuple[float, float]
+
+
+class ZoneGeometryError(ValueError):
+    """Координаты зоны некорректны."""
+
+
+def normalize_coordinates(coordinates) -> List[List[float]]:
+    """
+    Контур зоны как [[lat, lon], ...] без повторов вершин и замыкающей вершины.
+
+    Raises:
+        ZoneGeometryError: не массив, некорректная точка или меньше 3 различных вершин
+    """
+    if not isinstance(coordinates, list):
+        raise ZoneGeometryError('координаты должны быть массивом')
+    coords = coordinates
+    if coords and isinstance(coords[0], list) and coords[0] and isinstance(coords[0][0], list):
+        # Формат: [[[lat, lon], ...]] - берем первый (внешний) контур
+        coords = coords[0]
+
+    ring: List[List[float]] = []
+    for number, coord in enumerate(coords, 1):
+        if not isinstance(coord, (list, tuple)) or len(coord) < 2:
+            raise ZoneGeometryError(f'точка {number} должна быть парой [широта, долгота]')
+        try:
+            lat, lon = float(coord[0]), float(coord[1])
+        except (TypeError, ValueError):
+            raise ZoneGeometryError(f'точка {number}: координаты должны быть числами')
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ZoneGeometryError(f'точка {number}: координаты вне допустимого диапазона')
+        if ring and ring[-1] == [lat, lon]:
+            continue
+        ring.append([lat, lon])
+    if len(ring) > 1 and ring[0] == ring[-1]:
+        ring.pop()
+
+    if len(ring) < 3:
+        raise ZoneGeometryError('должно быть минимум 3 различные точки координат')
+    return ring
+
+
+def _area2(points: List[Point]) -> float:
+    """Удвоенная ориентированная площадь контура (формула шнурования)."""
+    total = 0.0
+    x0, y0 = points[-1]
+    for x1, y1 in points:
+        total += x0 * y1 - x1 * y0
+        x0, y0 = x1, y1
+    return total
+
+
+def _orientation(a: Point, b: Point, c: Point) -> float:
+    return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+
+def _on_segment(a: Point, b: Point, p: Point) -> bool:
+    """p на отрезке ab при условии, что три точки на одной прямой."""
+    return min(a[0], b[0]) <= p[0] <= max(a[0], b[0]) and min(a[1], b[1]) <= p[1] <= max(a[1], b[1])
+
+
+def _segments_intersect(a: Point, b: Point, c: Point, d: Point) -> bool:
+    """Отрезки ab и cd имеют общую точку (включая касание и наложение)."""
+    o1, o2 = _orientation(a, b, c), _orientation(a, b, d)
+    o3, o4 = _orientation(c, d, a), _orientation(c, d, b)
+    if ((o1 > 0 and o2 < 0) or (o1 < 0 and o2 > 0)) and ((o3 > 0 and o4 < 0) or (o3 < 0 and o4 > 0)):
+        return True
+    return (
+        (o1 == 0 and _on_segment(a, b, c)) or (o2 == 0 and _on_segment(a, b, d))
+        or (o3 == 0 and _on_segment(c, d, a)) or (o4 == 0 and _on_segment(c, d, b))
+    )
+
+
+def find_self_intersection(ring: List[List[float]]) -> Optional[Tuple[int, int]]:
+    """
+    Пара номеров рёбер (ребро i — из вершины i в i+1), которые пересекаются, или None.
+
+    Рёбра перебираются по возрастанию левого края; пара проверяется, только если их
+    прямоугольники перекрываются — для реальных контуров это почти линейно.
+    Соседние рёбра имеют общую вершину и пересечением не считаются, кроме «шипа»
+    (контур возвращается по тому же отрезку).
+    """
+    points = [(lon, lat) for lat, lon in ring]
+    n = len(points)
+    edges = []
+    for i in range(n):
+        a, b = points[i], points[(i + 1) % n]
+        edges.append((min(a[0], b[0]), max(a[0], b[0]), min(a[1], b[1]), max(a[1], b[1]), i, a, b))
+
+    for i in range(n):
+        a, b, c = points[i - 1], points[i], points[(i + 1) % n]
+        if _orientation(a, b, c) == 0 and (b[0] - a[0]) * (c[0] - b[0]) + (b[1] - a[1]) * (c[1] - b[1]) < 0:
+            return tuple(sorted(((i - 1) % n, i)))
+
+    active = []
+    for edge in sorted(edges):
+        min_x, _, min_y, max_y, i, a, b = edge
+        active = [other for other in active if other[1] >= min_x]
+        for other in active:
+            j = other[4]
+            if abs(i - j) == 1 or abs(i - j) == n - 1:
+                continue
+            if other[3] < min_y or other[2] > max_y:
+                continue
+            if _segments_intersect(a, b, other[5], other[6]):
+                return min(i, j), max(i, j)
+        active.append(edge)
+    return None
+
+
+def _project(ring: List[List[float]]) -> List[Point]:
+    """Вершины в метрах в локальной равнопромежуточной проекции (для масштаба города)."""
+    lat0 = math.radians(sum(lat for lat, _ in ring) / len(ring))
+    kx = METERS_PER_DEGREE * math.cos(lat0)
+    return [(lon * kx, lat * METERS_PER_DEGREE) for lat, lon in ring]
+
+
+def _distance(p: Point, a: Point, b: Point) -> float:
+    """Расстояние от p до отрезка ab."""
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    length2 = dx * dx + dy * dy
+    if length2 == 0:
+        return math.hypot(p[0] - a[0], p[1] - a[1])
+    t = max(0.0, min(1.0, ((p[0] - a[0]) * dx + (p[1] - a[1]) * dy) / length2))
+    return math.hypot(p[0] - a[0] - t * dx, p[1] - a[1] - t * dy)
+
+
+def _douglas_peucker(points: List[Point], first: int, last: int, tolerance: float, keep: List[bool]) -> float:
+    """Отмечает в keep вершины цепочки first..last (индексы по модулю), возвращает макс. отклонение."""
+    n = len(points)
+    deviation = 0.0
+    stack = [(first, last)]
+    while stack:
+        start, end = stack.pop()
+        a, b = points[start % n], points[end % n]
+        farthest, distance = None, -1.0
+        for k in range(start + 1, end):
+            d = _distance(points[k % n], a, b)
+            if d > distance:
+                farthest, distance = k, d
+        if farthest is None:
+            continue
+        if distance > tolerance:
+            keep[farthest % n] = True
+            stack.append((start, farthest))
+            stack.append((farthest, end))
+        else:
+            deviation = max(deviation, distance)
+    return deviation
+
+
+def simplify_ring(ring: List[List[float]], tolerance_m: float) -> Tuple[List[List[float]], float]:
+    """
+    Упрощенный контур (Дуглас — Пекер для замкнутого контура) и максимальное отклонение
+    удаленных вершин в метрах. Контур делится на две цепочки: от первой вершины до самой
+    удаленной от нее и обратно.
+    """
+    points = _project(ring)
+    n = len(points)
+    far = max(range(n), key=lambda k: math.hypot(points[k][0] - points[0][0], points[k][1] - points[0][1]))
+    keep = [False] * n
+    keep[0] = keep[far] = True
+    deviation = max(
+        _douglas_peucker(points, 0, far, tolerance_m, keep),
+        _douglas_peucker(points, far, n, tolerance_m, keep),
+    )
+    simplified = [vertex for vertex, kept in zip(ring, keep) if kept]
+    if len(simplified) < 3:
+        return ring, 0.0
+    return simplified, deviation
+
+
+def prepare_zone(zone: Dict[str, Any], tolerance_m: Optional[float] = None) -> None:
+    """
+    Нормализует, проверяет и (если задан tolerance_m) упрощает контур зоны на месте.
+
+    При упрощении в zone['simplification'] записываются вершины до и после, допуск и
+    фактическое отклонение; без упрощения прежняя статистика удаляется.
+
+    Raises:
+        ZoneGeometryError: координаты некорректны, контур пересекает сам себя или вырожден
+    """
+    ring = normalize_coordinates(zone.get('coordinates'))
+    crossing = find_self_intersection(ring)
+    if crossing:
+        raise ZoneGeometryError(f'контур пересекает сам себя (рёбра {crossing[0] + 1} и {crossing[1] + 1})')
+    if _area2([(lon, lat) for lat, lon in ring]) == 0:
+        raise ZoneGeometryError('все точки лежат на одной прямой')
+
+    zone.pop('simplification', None)
+    if tolerance_m:
+        simplified, deviation = simplify_ring(ring, tolerance_m)
+        # Упрощение могло свести далекие участки контура вместе — тогда оставляем исходный
+        if find_self_intersection(simplified) is not None:
+            simplified, deviation = ring, 0.0
+        zone['simplification'] = {
+            'tolerance_m': tolerance_m,
+            'vertices_before': len(ring),
+            'vertices_after': len(simplified),
+            'max_deviation_m': round(deviation, 2),
+        }
+        ring = simplified
+    zone['coordinates'] = ring
+
+
+def prepare_zones(zones: List[Dict[str, Any]], tolerance_m: Optional[float] = None) -> None:
+    """prepare_zone для каждой зоны; ZoneGeometryError с номером зоны в тексте."""
+    for i, zone in enumerate(zones):
+        try:
+            prepare_zone(zone, tolerance_m)
+        except ZoneGeometryError as e:
+            raise ZoneGeometryError(f'Зона #{i+1}: {e}')
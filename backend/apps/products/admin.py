@@ -1,8 +1,43 @@
 from django.contrib import admin
-from .models import Menu, ProductCategory, Product, Modifier, StopList, FastMenuGroup, FastMenuItem
+from apps.organizations.models import Terminal
+from .catalog_cache import invalidate_catalog
+from .stop_list_index import invalidate_stop_list
+from .models import Menu, ProductCategory, Product, Modifier, StopList, FastMenuGroup, FastMenuItem, MenuImportJob
+
+
+def _catalog_organization_id(obj):
+    """Организация, каталог которой затрагивает правка obj (для сброса снимков каталога)."""
+    for path in ('organization_id', 'menu.organization_id', 'product.organization_id', 'group.organization_id'):
+        value = obj
+        for attr in path.split('.'):
+            value = getattr(value, attr, None)
+            if value is None:
+                break
+        if value is not None:
+            return value
+    return None
+
 
 class BaseProductAdmin(admin.ModelAdmin):
     """Базовый класс для админки с поддержкой UUID фильтров и прав доступа по организации"""
+    def delete_model(self, request, obj):
+        organization_id = _catalog_organization_id(obj)
+        super().delete_model(request, obj)
+        self._invalidate(organization_id)
+
+    def delete_queryset(self, request, queryset):
+        organization_ids = {_catalog_organization_id(obj) for obj in queryset}
+        super().delete_queryset(request, queryset)
+        for organization_id in organization_ids:
+            self._invalidate(organization_id)
+
+    def _invalidate(self, organization_id):
+        invalidate_catalog(organization_id)
+        if self.model is StopList:
+            invalidate_stop_list(organization_id)
+            # Ручная правка расходится с iiko: следующая синхронизация должна применить ответ, а не пропустить его
+            Terminal.reset_stop_list_digests(organization_id)
+
     def get_queryset(self, request):
         self.request = request
         qs = super().get_queryset(request)
@@ -63,7 +98,13 @@ class BaseProductAdmin(admin.ModelAdmin):
                 if hasattr(obj, 'menu') and not obj.menu_id:
                      # Attempt to find a menu for this organization if not set
                      pass 
+        # Правка могла перенести запись в другую организацию — её индекс стоп-листа и каталог тоже устарели
+        previous = type(obj)._default_manager.filter(pk=obj.pk).first() if change else None
         super().save_model(request, obj, form, change)
+        organization_id = _catalog_organization_id(obj)
+        self._invalidate(organization_id)
+        if previous is not None and _catalog_organization_id(previous) != organization_id:
+            self._invalidate(_catalog_organization_id(previous))
 
     def lookup_allowed(self, lookup, value):
         # Разрешаем фильтрацию по UUID первичным ключам, даже если Django считает их слишком глубокими
@@ -136,3 +177,17 @@ class FastMenuItemAdmin(BaseProductAdmin):
     )
     search_fields = ('group__name', 'product__product_name')
     ordering = ('group', 'order')
+
+@admin.register(MenuImportJob)
+class MenuImportJobAdmin(BaseProductAdmin):
+    list_display = ('organization', 'source_type', 'status', 'phase', 'created_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'source_type', ('organization', admin.RelatedOnlyFieldListFilter))
+    readonly_fields = (
+        'organization', 'created_by', 'source_type', 'params', 'status', 'phase', 'processed', 'total',
+        'result', 'error', 'created_at', 'started_at', 'finished_at', 'updated_at',
+    )
+    ordering = ('-created_at',)
+
+    def has_add_permission(self, request):
+        # Импорт запускается через load-menu, а не созданием записи вручную
+        return False
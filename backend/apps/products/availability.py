@@ -0,0 +1,56 @@
+"""
+Стоп-лист в рамках одного запроса.
+
+Сериализаторы каталога проверяли стоп-лист для каждого продукта отдельно
+(Terminal.objects.get + StopList...exists() — два запроса на продукт). StopListResolver
+берёт множество стоп-листа организации/терминала из индекса (stop_list_index) один раз
+и передаётся сериализаторам через context['stop_list']; без контекста берётся резолвер,
+закэшированный на объекте запроса.
+"""
+from functools import cached_property
+from typing import FrozenSet, Optional
+
+from apps.products.stop_list_index import blocked_product_pks
+
+CONTEXT_KEY = 'stop_list'
+
+
+class StopListResolver:
+    """Множество Product.pk в стоп-листе организации (и терминала, если он указан и найден)."""
+
+    def __init__(self, organization_id, terminal_id: Optional[str] = None):
+        self.organization_id = organization_id
+        self.terminal_id = terminal_id
+
+    @cached_property
+    def stopped_pks(self) -> FrozenSet:
+        # Терминал не найден или невалидный id — стоп-лист всей организации
+        return blocked_product_pks(self.organization_id, self.terminal_id)
+
+    def is_stopped(self, product) -> bool:
+        return product.pk in self.stopped_pks
+
+    @classmethod
+    def for_request(cls, request) -> Optional['StopListResolver']:
+        """
+        Резолвер для организации пользователя и terminal_id из query-параметров, один на запрос.
+        None — анонимный пользователь или пользователь без организации.
+        """
+        if request is None:
+            return None
+        cached = getattr(request, '_stop_list_resolver', False)
+        if cached is not False:
+            return cached
+        user = getattr(request, 'user', None)
+        resolver = None
+        if user is not None and user.is_authenticated and getattr(user, 'organization_id', None):
+            resolver = cls(user.organization_id, request.query_params.get('terminal_id'))
+        request._stop_list_resolver = resolver
+        return resolver
+
+
+def resolver_from_context(context) -> Optional[StopListResolver]:
+    """Резолвер из контекста сериализатора (или закэшированный на запросе)."""
+    if CONTEXT_KEY in context:
+        return context[CONTEXT_KEY]
+    return StopListResolver.for_request(context.get('request'))
@@ -0,0 +1,137 @@
+"""
+Готовые снимки каталога для покупателей (TMA и сайт).
+
+Каталог (ProductViewSet.list, WebsiteMenuView, FastMenuGroupPublicViewSet) одинаков для всех
+покупателей организации и терминала, а собирается из нескольких join и подзапроса стоп-листа
+при каждом открытии приложения. Здесь он сериализуется один раз в JSON-байты и хранится в кэше
+(Redis) вместе с ETag; повторный запрос — чтение из кэша, при совпадении If-None-Match — 304.
+
+Инвалидация — через версию каталога организации: invalidate_catalog меняет её после коммита
+(синхронизация/активация меню, изменения стоп-листа и быстрого меню), старые снимки просто
+перестают читаться и истекают по CATALOG_CACHE_TTL. Недоступность кэша не ломает выдачу:
+снимок собирается заново на каждый запрос, как раньше.
+"""
+import hashlib
+import logging
+import uuid
+from typing import Any, Callable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.renderers import JSONRenderer
+
+from apps.products.catalog_events import publish_catalog_changed
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'catalog'
+
+
+def _ttl() -> int:
+    return getattr(settings, 'CATALOG_CACHE_TTL', 10 * 60)
+
+
+def _version_key(organization_id) -> str:
+    return f'{KEY_PREFIX}:ver:{organization_id}'
+
+
+def _get_version(organization_id) -> Optional[str]:
+    """Текущая версия каталога организации; None — кэш недоступен (работаем без снимков)."""
+    key = _version_key(organization_id)
+    try:
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            version = cache.get(key)
+        return version
+    except Exception as e:
+        logger.warning(f"Кэш каталога недоступен (version): {e}")
+        return None
+
+
+def _bump_version(organization_id) -> None:
+    try:
+        cache.set(_version_key(organization_id), uuid.uuid4().hex, timeout=None)
+    except Exception as e:
+        logger.warning(f"Кэш каталога недоступен (invalidate): {e}")
+
+
+def invalidate_catalog(organization_id, reason: str = 'catalog', notify: bool = True) -> None:
+    """
+    Сбрасывает снимки каталога организации.
+    После коммита текущей транзакции: иначе параллельный запрос пересобрал бы снимок
+    из ещё не закоммиченных (старых) данных под новой версией.
+    notify — отправить открытым сессиям событие catalog (catalog_events); синхронизация
+    стоп-листа вместо него публикует точную разницу по терминалу.
+    """
+    if organization_id is None:
+        return
+    transaction.on_commit(lambda: _bump_version(organization_id))
+    if notify:
+        publish_catalog_changed(organization_id, reason)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(','))
+    return any(tag.removeprefix('W/') == etag for tag in candidates)
+
+
+def _json_response(request, etag: str, body: bytes) -> HttpResponse:
+    if _etag_matches(request.META.get('HTTP_IF_NONE_MATCH', ''), etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    # Клиент может хранить ответ, но обязан перепроверить его по ETag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def catalog_response(
+    request,
+    kind: str,
+    organization_id,
+    build: Callable[[], Any],
+    terminal_id: Optional[str] = None,
+) -> HttpResponse:
+    """
+    Ответ со снимком каталога kind ('products', 'website', 'fast_menu') для организации и терминала.
+    build() вызывается только при промахе кэша и возвращает данные для сериализации.
+    Хост входит в ключ: сериализаторы строят абсолютные URL изображений.
+    """
+    version = _get_version(organization_id)
+    key = f'{KEY_PREFIX}:{organization_id}:{version}:{kind}:{terminal_id or "-"}:{request.get_host()}'
+    entry = None
+    if version is not None:
+        try:
+            entry = cache.get(key)
+        except Exception as e:
+            logger.warning(f"Кэш каталога недоступен (get): {e}")
+
+    if entry is None:
+        body = JSONRenderer().render(build())
+        entry = (f'"{hashlib.sha256(body).hexdigest()[:32]}"', body)
+        if version is not None:
+            try:
+                cache.set(key, entry, timeout=_ttl())
+            except Exception as e:
+                logger.warning(f"Кэш каталога недоступен (set): {e}")
+
+    etag, body = entry
+    return _json_response(request, etag, body)
+
+
+def normalize_terminal_id(value) -> Optional[str]:
+    """terminal_id из query-параметра в каноничном виде для ключа снимка (невалидный — как отсутствующий)."""
+    if not value:
+        return None
+    try:
+        return str(uuid.UUID(str(value)))
+    except (ValueError, TypeError, AttributeError):
+        return None
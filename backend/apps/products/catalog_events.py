@@ -0,0 +1,91 @@
+"""
+События каталога для открытых сессий TMA (core.events, SSE).
+
+Каналы:
+- терминал — stop_list: {"terminal_id", "blocked": [product_id], "unblocked": [product_id]} по итогам
+  синхронизации стоп-листа; клиент убирает blocked из каталога, при непустом unblocked — перезапрашивает
+  каталог (ETag, обычно 304 не будет — снимок уже новый);
+- организация — catalog: {"reason"} при остальных изменениях каталога (импорт/активация меню,
+  правки стоп-листа и быстрого меню в админке): клиент перезапрашивает каталог по ETag.
+
+product_id — идентификатор iiko, тот же, что id в ответе каталога.
+
+Подписка — по короткоживущему подписанному токену (issue_stream_token, как у событий заказов):
+он выдается авторизованному пользователю и ограничен его организацией и терминалами.
+"""
+from typing import Iterable, List, Optional
+
+from django.conf import settings
+from django.core import signing
+
+from apps.organizations.models import Terminal
+from core.events import channel_name, publish_on_commit
+
+TOKEN_SALT = 'catalog.events'
+
+
+def organization_channel(organization_id) -> str:
+    return channel_name('catalog', organization_id)
+
+
+def terminal_channel(terminal_id) -> str:
+    return channel_name('stop_list', terminal_id)
+
+
+def publish_catalog_changed(organization_id, reason: str = 'catalog') -> None:
+    if organization_id is None:
+        return
+    publish_on_commit(organization_channel(organization_id), 'catalog', {'reason': reason})
+
+
+def publish_stop_list_delta(terminal_id, blocked: Iterable, unblocked: Iterable) -> None:
+    blocked = [str(product_id) for product_id in blocked]
+    unblocked = [str(product_id) for product_id in unblocked]
+    if not blocked and not unblocked:
+        return
+    publish_on_commit(
+        terminal_channel(terminal_id),
+        'stop_list',
+        {'terminal_id': str(terminal_id), 'blocked': blocked, 'unblocked': unblocked},
+    )
+
+
+def _token_ttl() -> int:
+    return getattr(settings, 'CATALOG_EVENTS_TOKEN_TTL', 60 * 60)
+
+
+def issue_stream_token(user) -> Optional[str]:
+    """
+    Токен подписки на события каталога организации пользователя: терминалы, выданные пользователю,
+    иначе все активные терминалы организации. None — у пользователя нет организации.
+    """
+    if not user.organization_id:
+        return None
+    terminals = Terminal.objects.filter(organization_id=user.organization_id, is_active=True)
+    own = terminals.filter(users=user)
+    if own.exists():
+        terminals = own
+    payload = {
+        'u': str(user.pk),
+        'o': str(user.organization_id),
+        't': sorted(str(tid) for tid in terminals.values_list('terminal_id', flat=True)),
+    }
+    return signing.dumps(payload, salt=TOKEN_SALT, compress=True)
+
+
+def load_stream_token(token: str) -> Optional[dict]:
+    """Содержимое токена; None — токен неверный или просрочен."""
+    try:
+        return signing.loads(token, salt=TOKEN_SALT, max_age=_token_ttl())
+    except signing.BadSignature:
+        return None
+
+
+def channels_for_token(payload: dict, terminal_id=None) -> Optional[List[str]]:
+    """Каналы подписки: организация и терминал (или все терминалы токена); None — терминал вне токена."""
+    terminal_ids = payload.get('t') or []
+    if terminal_id:
+        if str(terminal_id) not in terminal_ids:
+            return None
+        terminal_ids = [str(terminal_id)]
+    return [organization_channel(payload['o'])] + [terminal_channel(tid) for tid in terminal_ids]
@@ -0,0 +1,220 @@
+"""
+Фоновый импорт меню из iiko.
+
+Загрузка большого меню занимает десятки секунд и раньше выполнялась прямо в HTTP-запросе
+load-menu (таймауты gunicorn/прокси, повторные нажатия запускали параллельные импорты).
+Теперь запрос только создаёт MenuImportJob и ставит Celery-задачу, а клиент опрашивает статус.
+
+Прогресс пишется в кэш (Redis), а не в БД: синхронизация идёт в одной транзакции,
+и промежуточные UPDATE записи задачи были бы не видны опрашивающему до её конца.
+Итог (статус, отчёт, ошибка) сохраняется в MenuImportJob.
+"""
+import logging
+import time
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from apps.products.models import Menu, MenuImportJob, MenuImportStatus
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_KEY_PREFIX = 'menu_import'
+
+
+class MenuImportAlreadyRunning(Exception):
+    """У организации уже есть незавершённый импорт меню."""
+
+    def __init__(self, job: MenuImportJob):
+        super().__init__(f"Импорт меню уже выполняется: {job.pk}")
+        self.job = job
+
+
+def _progress_key(job_id) -> str:
+    return f'{PROGRESS_KEY_PREFIX}:{job_id}'
+
+
+def _job_timeout() -> int:
+    return getattr(settings, 'MENU_IMPORT_JOB_TIMEOUT', 30 * 60)
+
+
+def expire_stale_jobs(organization) -> int:
+    """Помечает ошибкой активные задачи, которые не обновлялись дольше MENU_IMPORT_JOB_TIMEOUT (упал воркер)."""
+    now = timezone.now()
+    return MenuImportJob.objects.filter(
+        organization=organization,
+        status__in=MenuImportJob.ACTIVE_STATUSES,
+        updated_at__lt=now - timedelta(seconds=_job_timeout()),
+    ).update(
+        status=MenuImportStatus.ERROR,
+        error='Импорт не завершился за отведённое время',
+        finished_at=now,
+        updated_at=now,
+    )
+
+
+def start_menu_import(organization, user=None, params: Optional[Dict[str, Any]] = None) -> MenuImportJob:
+    """
+    Создаёт задачу импорта и ставит её в очередь после коммита транзакции.
+    Если у организации уже есть активный импорт — MenuImportAlreadyRunning
+    (гарантируется частичным уникальным индексом, а не только проверкой).
+    """
+    from .tasks import run_menu_import_job
+
+    params = dict(params or {})
+    source_type = Menu.SOURCE_EXTERNAL if params.get('external_menu_id') else Menu.SOURCE_NOMENCLATURE
+    expire_stale_jobs(organization)
+    try:
+        with transaction.atomic():
+            job = MenuImportJob.objects.create(
+                organization=organization,
+                created_by=user if getattr(user, 'is_authenticated', False) else None,
+                source_type=source_type,
+                params=params,
+            )
+    except IntegrityError:
+        active = (
+            MenuImportJob.objects.filter(organization=organization, status__in=MenuImportJob.ACTIVE_STATUSES)
+            .order_by('-created_at')
+            .first()
+        )
+        if active is None:
+            raise
+        raise MenuImportAlreadyRunning(active)
+
+    transaction.on_commit(lambda: run_menu_import_job.delay(str(job.pk)))
+    logger.info(f"Импорт меню {job.pk} поставлен в очередь (org={organization.org_name}, {source_type})")
+    return job
+
+
+class CacheProgress:
+    """Колбэк прогресса для MenuSyncService: пишет в кэш не чаще MENU_IMPORT_PROGRESS_INTERVAL."""
+
+    def __init__(self, job_id):
+        self.key = _progress_key(job_id)
+        self.interval = getattr(settings, 'MENU_IMPORT_PROGRESS_INTERVAL', 0.5)
+        self._last_phase = None
+        self._last_write = 0.0
+
+    def __call__(self, phase: str, processed: int = 0, total: int = 0):
+        now = time.monotonic()
+        # Смену этапа пишем всегда, обновления внутри этапа — с ограничением частоты
+        if phase == self._last_phase and now - self._last_write < self.interval:
+            return
+        self._last_phase = phase
+        self._last_write = now
+        try:
+            cache.set(
+                self.key,
+                {'phase': phase, 'processed': processed, 'total': total},
+                timeout=_job_timeout(),
+            )
+        except Exception as e:
+            logger.warning(f"Кэш прогресса импорта меню недоступен: {e}")
+
+    def clear(self):
+        try:
+            cache.delete(self.key)
+        except Exception as e:
+            logger.warning(f"Кэш прогресса импорта меню недоступен: {e}")
+
+
+def get_job_payload(job: MenuImportJob) -> Dict[str, Any]:
+    """Состояние задачи для API: запись в БД плюс живой прогресс из кэша для активной задачи."""
+    payload = {
+        'job_id': str(job.pk),
+        'status': job.status,
+        'source_type': job.source_type,
+        'phase': job.phase,
+        'processed': job.processed,
+        'total': job.total,
+        'result': job.result,
+        'error': job.error or None,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
+    if job.is_active:
+        try:
+            progress = cache.get(_progress_key(job.pk))
+        except Exception as e:
+            logger.warning(f"Кэш прогресса импорта меню недоступен: {e}")
+            progress = None
+        if progress:
+            payload.update(progress)
+    return payload
+
+
+def _sync(job: MenuImportJob, progress: CacheProgress) -> Dict[str, Any]:
+    from apps.iiko_integration.client import IikoClient
+    from apps.iiko_integration.services import MenuSyncService
+
+    organization = job.organization
+    params = job.params or {}
+    client = IikoClient(organization.api_key)
+    service = MenuSyncService(progress=progress)
+
+    external_menu_id = params.get('external_menu_id')
+    if not external_menu_id:
+        return service.sync_nomenclature(organization, client, full_resync=bool(params.get('full_resync')))
+
+    price_category_id = params.get('price_category_id')
+    progress('fetch')
+    menu_data = client.get_external_menu_by_id(
+        organization_ids=[organization.iiko_organization_id],
+        external_menu_id=str(external_menu_id),
+        price_category_id=str(price_category_id) if price_category_id else None,
+    )
+    return service.sync_external_menu(
+        organization=organization,
+        menu_data=menu_data,
+        menu_name=params.get('menu_name') or None,
+        price_category_id=str(price_category_id) if price_category_id else None,
+        price_category_name=params.get('price_category_name') or None,
+        external_menu_id=str(external_menu_id),
+        set_active=True,
+    ) or {}
+
+
+def run_menu_import(job_id) -> Optional[Dict[str, Any]]:
+    """Выполняет импорт (вызывается из Celery-задачи) и сохраняет итог в MenuImportJob."""
+    claimed = MenuImportJob.objects.filter(pk=job_id, status=MenuImportStatus.PENDING).update(
+        status=MenuImportStatus.RUNNING, phase='fetch', started_at=timezone.now(), updated_at=timezone.now()
+    )
+    if not claimed:
+        # Задача уже выполнена, истекла или взята другим воркером (повторная доставка)
+        logger.info(f"Импорт меню {job_id} пропущен: задача не в статусе pending")
+        return None
+
+    job = MenuImportJob.objects.select_related('organization').get(pk=job_id)
+    progress = CacheProgress(job.pk)
+    try:
+        result = _sync(job, progress)
+    except Exception as e:
+        logger.exception(f"Импорт меню {job.pk} (org={job.organization.org_name}) завершился ошибкой")
+        MenuImportJob.objects.filter(pk=job.pk).update(
+            status=MenuImportStatus.ERROR,
+            error=str(e),
+            finished_at=timezone.now(),
+            updated_at=timezone.now(),
+        )
+        progress.clear()
+        return None
+
+    processed = (result.get('products_created', 0) + result.get('products_changed', 0)
+                 + result.get('products_unchanged', 0))
+    MenuImportJob.objects.filter(pk=job.pk).update(
+        status=MenuImportStatus.DONE,
+        phase='done',
+        processed=processed,
+        total=processed,
+        result=result,
+        finished_at=timezone.now(),
+        updated_at=timezone.now(),
+    )
+    progress.clear()
+    return result
@@ -0,0 +1,161 @@
+"""
+Версии меню (blue/green).
+
+Каталог (ProductViewSet, WebsiteMenuView, FastMenuGroupPublicViewSet) читает меню с is_active=True.
+Импорт внешнего меню пишет не в активную версию, а в резервную (неактивную) копию с тем же
+названием: покупатели всё это время видят старую версию целиком. Готовая версия включается
+короткой транзакцией activate_menu — переключение is_active и перенос ссылок быстрого меню
+и стоп-листа на продукты новой версии. Предыдущая версия остаётся нетронутой до следующего
+импорта (metadata['previous_menu_id']), поэтому откат — то же переключение (rollback_menu).
+"""
+import logging
+from typing import Dict, Optional, Tuple
+
+from django.db import transaction
+
+from apps.organizations.models import Terminal
+from apps.products.catalog_cache import invalidate_catalog
+from apps.products.stop_list_index import invalidate_stop_list
+from apps.products.models import FastMenuItem, Menu, Product, StopList
+
+logger = logging.getLogger(__name__)
+
+PREVIOUS_MENU_KEY = 'previous_menu_id'
+
+
+class MenuRollbackError(Exception):
+    """Нет предыдущей версии меню, на которую можно откатиться."""
+    pass
+
+
+def get_build_target(organization, menu_name: str, source_type: str) -> Tuple[Menu, Optional[Menu]]:
+    """
+    Версия меню, в которую писать импорт, и текущая активная версия (или None).
+
+    Если версия с этим названием сейчас активна — импорт идёт в её резервную копию
+    (предыдущую версию, при отсутствии создаётся новая неактивная). Если не активна —
+    её никто не читает, и она обновляется на месте.
+    """
+    live = (
+        Menu.objects.filter(organization=organization, menu_name=menu_name, source_type=source_type)
+        .order_by('-is_active', '-updated_at')
+        .first()
+    )
+    if live is None:
+        return Menu.objects.create(
+            organization=organization, menu_name=menu_name, source_type=source_type, is_active=False
+        ), None
+    if not live.is_active:
+        return live, None
+
+    standby_id = (live.metadata or {}).get(PREVIOUS_MENU_KEY)
+    standby = None
+    if standby_id:
+        standby = Menu.objects.filter(
+            pk=standby_id, organization=organization, source_type=source_type, is_active=False
+        ).first()
+    if standby is None:
+        standby = Menu.objects.create(
+            organization=organization,
+            menu_name=menu_name,
+            source_type=source_type,
+            is_active=False,
+            metadata={k: v for k, v in (live.metadata or {}).items() if k != PREVIOUS_MENU_KEY} or None,
+        )
+    return standby, live
+
+
+def _remap_product_refs(organization, menu: Menu) -> Dict[str, int]:
+    """
+    Переносит позиции быстрого меню и стоп-листа организации с продуктов других версий
+    на продукты menu с тем же product_id (iiko). Позиции без пары в новой версии не трогаются.
+    """
+    new_by_product_id = dict(
+        Product.objects.filter(menu=menu).values_list('product_id', 'pk')
+    )
+    report = {'fast_menu_items_remapped': 0, 'stop_list_remapped': 0}
+    if not new_by_product_id:
+        return report
+
+    for model, owner_field, key in (
+        (FastMenuItem, 'group_id', 'fast_menu_items_remapped'),
+        (StopList, 'terminal_id', 'stop_list_remapped'),
+    ):
+        if model is FastMenuItem:
+            refs = model.objects.filter(group__organization=organization)
+        else:
+            refs = model.objects.filter(organization=organization)
+        refs = list(refs.exclude(product__menu=menu).select_related('product'))
+        if not refs:
+            continue
+        # unique_together (group|terminal, product): если у владельца уже есть строка с новым продуктом — старую удаляем
+        taken = set(
+            model.objects.filter(product__menu=menu, **{f'{owner_field}__in': {getattr(r, owner_field) for r in refs}})
+            .values_list(owner_field, 'product_id')
+        )
+        to_update, to_delete = [], []
+        for ref in refs:
+            new_pk = new_by_product_id.get(ref.product.product_id)
+            if new_pk is None:
+                continue
+            pair = (getattr(ref, owner_field), new_pk)
+            if pair in taken:
+                to_delete.append(ref.pk)
+                continue
+            taken.add(pair)
+            ref.product_id = new_pk
+            to_update.append(ref)
+        if to_update:
+            model.objects.bulk_update(to_update, ['product'], batch_size=500)
+        if to_delete:
+            model.objects.filter(pk__in=to_delete).delete()
+        report[key] = len(to_update)
+    return report
+
+
+def activate_menu(menu: Menu) -> Dict[str, int]:
+    """
+    Атомарно делает menu единственным активным меню организации.
+    Предыдущая активная версия с тем же названием запоминается для отката.
+    """
+    with transaction.atomic():
+        # Блокируем меню организации: параллельные активации выполняются по очереди
+        menus = list(Menu.objects.select_for_update().filter(organization_id=menu.organization_id))
+        current = next((m for m in menus if m.is_active and m.pk != menu.pk), None)
+        target = next(m for m in menus if m.pk == menu.pk)
+
+        metadata = dict(target.metadata or {})
+        if current is not None and current.menu_name == target.menu_name:
+            metadata[PREVIOUS_MENU_KEY] = str(current.pk)
+        Menu.objects.filter(organization_id=menu.organization_id, is_active=True).exclude(pk=menu.pk).update(
+            is_active=False
+        )
+        target.is_active = True
+        target.metadata = metadata or None
+        target.save(update_fields=['is_active', 'metadata', 'updated_at'])
+
+        report = _remap_product_refs(menu.organization, target)
+        invalidate_catalog(menu.organization_id, reason='menu')
+        invalidate_stop_list(menu.organization_id)
+        # Стоп-лист сопоставляется с продуктами активного меню — применить заново при следующей синхронизации
+        Terminal.reset_stop_list_digests(menu.organization_id)
+
+    menu.is_active = target.is_active
+    menu.metadata = target.metadata
+    logger.info(
+        "Активирована версия меню %s (%s), предыдущая: %s; %s",
+        target.pk, target.menu_name, current.pk if current else None, report,
+    )
+    return report
+
+
+def rollback_menu(menu: Menu) -> Menu:
+    """Возвращает предыдущую версию активного меню menu и делает её активной."""
+    previous_id = (menu.metadata or {}).get(PREVIOUS_MENU_KEY)
+    previous = None
+    if previous_id:
+        previous = Menu.objects.filter(pk=previous_id, organization_id=menu.organization_id).first()
+    if previous is None:
+        raise MenuRollbackError('Нет предыдущей версии меню для отката')
+    activate_menu(previous)
+    return previous
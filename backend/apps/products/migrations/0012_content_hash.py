@@ -0,0 +1,22 @@
+# Generated manually: отпечаток данных iiko для пропуска неизменных строк при синхронизации меню
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("products", "0011_modifier_is_available"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="productcategory",
+            name="content_hash",
+            field=models.CharField(blank=True, default="", max_length=64, verbose_name="Хэш данных iiko"),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="content_hash",
+            field=models.CharField(blank=True, default="", max_length=64, verbose_name="Хэш данных iiko"),
+        ),
+    ]
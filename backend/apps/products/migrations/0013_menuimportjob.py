@@ -0,0 +1,93 @@
+# Generated manually: фоновые задачи импорта меню из iiko
+
+import uuid
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("organizations", "0023_fix_unreflected_model_changes"),
+        ("products", "0012_content_hash"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MenuImportJob",
+            fields=[
+                ("id", models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                (
+                    "source_type",
+                    models.CharField(
+                        choices=[("nomenclature", "Номенклатура"), ("external", "Внешнее")],
+                        default="nomenclature",
+                        max_length=20,
+                        verbose_name="Тип меню",
+                    ),
+                ),
+                ("params", models.JSONField(blank=True, default=dict, verbose_name="Параметры")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "В очереди"),
+                            ("running", "Выполняется"),
+                            ("done", "Завершён"),
+                            ("error", "Ошибка"),
+                        ],
+                        default="pending",
+                        max_length=20,
+                        verbose_name="Статус",
+                    ),
+                ),
+                ("phase", models.CharField(blank=True, default="", max_length=32, verbose_name="Этап")),
+                ("processed", models.PositiveIntegerField(default=0, verbose_name="Обработано")),
+                ("total", models.PositiveIntegerField(default=0, verbose_name="Всего")),
+                ("result", models.JSONField(blank=True, null=True, verbose_name="Результат")),
+                ("error", models.TextField(blank=True, default="", verbose_name="Ошибка")),
+                ("created_at", models.DateTimeField(auto_now_add=True, verbose_name="Создан")),
+                ("started_at", models.DateTimeField(blank=True, null=True, verbose_name="Начат")),
+                ("finished_at", models.DateTimeField(blank=True, null=True, verbose_name="Завершён")),
+                ("updated_at", models.DateTimeField(auto_now=True, verbose_name="Обновлён")),
+                (
+                    "created_by",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="menu_import_jobs",
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Запустил",
+                    ),
+                ),
+                (
+                    "organization",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="menu_import_jobs",
+                        to="organizations.organization",
+                        verbose_name="Организация",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Импорт меню",
+                "verbose_name_plural": "Импорты меню",
+                "db_table": "menu_import_jobs",
+                "ordering": ["-created_at"],
+                "indexes": [
+                    models.Index(fields=["organization", "-created_at"], name="menu_import_org_created_idx"),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        condition=models.Q(("status__in", ["pending", "running"])),
+                        fields=("organization",),
+                        name="menu_import_jobs_one_active_per_org",
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -64,6 +64,8 @@ class ProductCategory(models.Model):
     
     # Хранение исходных данных для синхронизации
     outer_data = models.JSONField('Данные из iiko', blank=True, null=True)
+    # Отпечаток данных iiko (sha256): неизменные при синхронизации строки не перезаписываются
+    content_hash = models.CharField('Хэш данных iiko', max_length=64, blank=True, default='')
     
     created_at = models.DateTimeField('Создана', auto_now_add=True)
     updated_at = models.DateTimeField('Обновлена', auto_now=True)
@@ -126,6 +128,8 @@ class Product(models.Model):
     
     # Хранение исходных данных
     outer_data = models.JSONField('Данные из iiko', blank=True, null=True)
+    # Отпечаток данных iiko (sha256, включая модификаторы): неизменные строки не перезаписываются
+    content_hash = models.CharField('Хэш данных iiko', max_length=64, blank=True, default='')
     
     # Синхронизация с iiko
     updated_from_iiko = models.DateTimeField('Обновлено из iiko', blank=True, null=True)
@@ -323,4 +327,84 @@ class FastMenuItem(models.Model):
         ]
     
     def __str__(self):
-        return f"{self.group.name} - {self.product.product_name}"
\ No newline at end of file
+        return f"{self.group.name} - {self.product.product_name}"
+
+
+class MenuImportStatus(models.TextChoices):
+    PENDING = 'pending', 'В очереди'
+    RUNNING = 'running', 'Выполняется'
+    DONE = 'done', 'Завершён'
+    ERROR = 'error', 'Ошибка'
+
+
+class MenuImportJob(models.Model):
+    """
+    Фоновая загрузка меню из iiko (Celery). Одновременно у организации может быть
+    только один активный (pending/running) импорт — обеспечивается частичным уникальным индексом.
+    """
+    ACTIVE_STATUSES = (MenuImportStatus.PENDING, MenuImportStatus.RUNNING)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    organization = models.ForeignKey(
+        'organizations.Organization',
+        on_delete=models.CASCADE,
+        related_name='menu_import_jobs',
+        verbose_name='Организация'
+    )
+    created_by = models.ForeignKey(
+        'users.User',
+        on_delete=models.SET_NULL,
+        related_name='menu_import_jobs',
+        verbose_name='Запустил',
+        blank=True,
+        null=True
+    )
+    source_type = models.CharField(
+        'Тип меню',
+        max_length=20,
+        choices=Menu.SOURCE_CHOICES,
+        default=Menu.SOURCE_NOMENCLATURE
+    )
+    # Параметры запуска: external_menu_id, price_category_id, menu_name, full_resync и т.п.
+    params = models.JSONField('Параметры', default=dict, blank=True)
+
+    status = models.CharField(
+        'Статус',
+        max_length=20,
+        choices=MenuImportStatus.choices,
+        default=MenuImportStatus.PENDING
+    )
+    phase = models.CharField('Этап', max_length=32, blank=True, default='')
+    processed = models.PositiveIntegerField('Обработано', default=0)
+    total = models.PositiveIntegerField('Всего', default=0)
+    # Отчёт MenuSyncService (создано/изменено/без изменений/деактивировано)
+    result = models.JSONField('Результат', blank=True, null=True)
+    error = models.TextField('Ошибка', blank=True, default='')
+
+    created_at = models.DateTimeField('Создан', auto_now_add=True)
+    started_at = models.DateTimeField('Начат', blank=True, null=True)
+    finished_at = models.DateTimeField('Завершён', blank=True, null=True)
+    updated_at = models.DateTimeField('Обновлён', auto_now=True)
+
+    class Meta:
+        db_table = 'menu_import_jobs'
+        verbose_name = 'Импорт меню'
+        verbose_name_plural = 'Импорты меню'
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['organization'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='menu_import_jobs_one_active_per_org',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['organization', '-created_at'], name='menu_import_org_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Импорт меню {self.organization_id} ({self.status})"
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in self.ACTIVE_STATUSES
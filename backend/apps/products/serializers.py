@@ -2,6 +2,7 @@ from rest_framework import serializers
 from drf_spectacular.utils import extend_schema_field
 from drf_spectacular.types import OpenApiTypes
 from .models import Menu, ProductCategory, Product, Modifier, StopList, FastMenuGroup, FastMenuItem
+from .availability import resolver_from_context
 from apps.organizations.models import Organization
 
 
@@ -84,38 +85,11 @@ class ProductListSerializer(serializers.ModelSerializer):
     @extend_schema_field(OpenApiTypes.BOOL)
     def get_is_in_stop_list(self, obj):
         """Проверяет, находится ли продукт в стоп-листе для указанного терминала"""
-        request = self.context.get('request')
-        if not request or not hasattr(request, 'user'):
+        # Стоп-лист организации/терминала загружается один раз на запрос (StopListResolver)
+        resolver = resolver_from_context(self.context)
+        if resolver is None:
             return False
-        
-        user = request.user
-        if not user.is_authenticated:
-            return False
-        organization = getattr(user, 'organization', None)
-        if not organization:
-            return False
-        
-        # Получаем terminal_id из query параметров
-        terminal_id = request.query_params.get('terminal_id')
-        
-        from apps.products.models import StopList
-        stop_list_query = StopList.objects.filter(
-            product=obj,
-            organization=organization
-        )
-        
-        # Если указан terminal_id, проверяем по нему
-        if terminal_id:
-            try:
-                from apps.organizations.models import Terminal
-                terminal = Terminal.objects.get(terminal_id=terminal_id)
-                return stop_list_query.filter(terminal=terminal).exists()
-            except (Terminal.DoesNotExist, ValueError):
-                # Если terminal не найден, проверяем по организации
-                return stop_list_query.exists()
-        
-        # Если terminal_id не указан, проверяем по организации
-        return stop_list_query.exists()
+        return resolver.is_stopped(obj)
 
 
 class ProductDetailSerializer(serializers.ModelSerializer):
@@ -139,38 +113,11 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     @extend_schema_field(OpenApiTypes.BOOL)
     def get_is_in_stop_list(self, obj):
         """Проверяет, находится ли продукт в стоп-листе для указанного терминала"""
-        request = self.context.get('request')
-        if not request or not hasattr(request, 'user'):
-            return False
-        
-        user = request.user
-        if not user.is_authenticated:
-            return False
-        organization = getattr(user, 'organization', None)
-        if not organization:
+        # Стоп-лист организации/терминала загружается один раз на запрос (StopListResolver)
+        resolver = resolver_from_context(self.context)
+        if resolver is None:
             return False
-        
-        # Получаем terminal_id из query параметров
-        terminal_id = request.query_params.get('terminal_id')
-        
-        from apps.products.models import StopList
-        stop_list_query = StopList.objects.filter(
-            product=obj,
-            organization=organization
-        )
-        
-        # Если указан terminal_id, проверяем по нему
-        if terminal_id:
-            try:
-                from apps.organizations.models import Terminal
-                terminal = Terminal.objects.get(terminal_id=terminal_id)
-                return stop_list_query.filter(terminal=terminal).exists()
-            except (Terminal.DoesNotExist, ValueError):
-                # Если terminal не найден, проверяем по организации
-                return stop_list_query.exists()
-        
-        # Если terminal_id не указан, проверяем по организации
-        return stop_list_query.exists()
+        return resolver.is_stopped(obj)
 
 
 class StopListSerializer(serializers.ModelSerializer):
@@ -268,49 +215,22 @@ class FastMenuGroupPublicSerializer(serializers.ModelSerializer):
     @extend_schema_field(OpenApiTypes.OBJECT)
     def get_products(self, obj):
         """Возвращает список продуктов группы, исключая те, что в стоп-листе"""
-        request = self.context.get('request')
-        if not request or not hasattr(request, 'user'):
-            return []
-        
-        user = request.user
-        if not user.organization:
+        resolver = resolver_from_context(self.context)
+        if resolver is None:
             return []
         
-        # Получаем terminal_id из query параметров
-        terminal_id = request.query_params.get('terminal_id')
-        
-        # Получаем все элементы группы с продуктами
-        items = obj.items.select_related('product', 'product__category').prefetch_related(
-            'product__modifiers'
-        ).order_by('order')
-        
-        # Фильтруем продукты по стоп-листу
-        from apps.products.models import StopList
-        stop_list_query = StopList.objects.filter(
-            organization=user.organization
-        )
-        
-        # Если указан terminal_id, фильтруем по нему
-        if terminal_id:
-            try:
-                from apps.organizations.models import Terminal
-                terminal = Terminal.objects.get(terminal_id=terminal_id)
-                stop_list_query = stop_list_query.filter(terminal=terminal)
-            except (Terminal.DoesNotExist, ValueError):
-                pass
-        
-        # product_id column in stop_list references Product.pk (Product.id)
-        stop_list_product_pks = set(stop_list_query.values_list('product_id', flat=True))
+        # Элементы группы с продуктами, меню и категориями предзагружены во view
+        # (FastMenuGroupPublicViewSet); стоп-лист — один запрос на весь ответ
         products = []
-        for item in items:
+        for item in obj.items.all():
             product = item.product
             if not product.menu.is_active:
                 continue
-            if product.pk in stop_list_product_pks or not product.is_available:
+            if resolver.is_stopped(product) or not product.is_available:
                 continue
             
             # Используем ProductListSerializer для сериализации
-            product_serializer = ProductListSerializer(product, context={'request': request})
+            product_serializer = ProductListSerializer(product, context=self.context)
             products.append(product_serializer.data)
         
         return products
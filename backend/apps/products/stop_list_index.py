@@ -0,0 +1,156 @@
+"""
+Индекс стоп-листа: множество Product.pk, заблокированных для организации и терминала.
+
+Доступность продукта проверяется в каталоге (ProductViewSet, WebsiteMenuView, быстрое меню),
+при валидации и создании заказа (снимок корзины apps.orders.cart_snapshot);
+раньше каждая проверка шла запросом к StopList. Здесь множество собирается одним запросом,
+хранится в кэше (Redis) под версией стоп-листа организации и дополнительно в памяти процесса,
+так что проверка — чтение версии из кэша и поиск в frozenset, без обращения к БД.
+
+Версия меняется после коммита при любом изменении стоп-листа: синхронизация с iiko
+(update_terminal_index сразу кладёт новое множество терминала), правки в StopListViewSet
+и админке, перенос ссылок при активации меню (invalidate_stop_list). Недоступность кэша
+не ломает проверки: множество загружается из БД, как раньше.
+"""
+import logging
+import uuid
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from apps.products.models import StopList
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'stop_list'
+ORGANIZATION_SCOPE = '-'
+
+# Копия индекса в памяти процесса: (организация, терминал) -> (версия, множество)
+_local: Dict[Tuple[str, str], Tuple[str, FrozenSet]] = {}
+_LOCAL_MAX_ENTRIES = 2048
+
+
+def _ttl() -> int:
+    return getattr(settings, 'STOP_LIST_INDEX_TTL', 60 * 60)
+
+
+def _version_key(organization_id) -> str:
+    return f'{KEY_PREFIX}:ver:{organization_id}'
+
+
+def _entry_key(organization_id, version: str, scope: str) -> str:
+    return f'{KEY_PREFIX}:idx:{organization_id}:{version}:{scope}'
+
+
+def _scope(terminal_id) -> str:
+    """Терминал в каноничном виде; без терминала или с невалидным id — стоп-лист всей организации."""
+    if not terminal_id:
+        return ORGANIZATION_SCOPE
+    try:
+        return str(uuid.UUID(str(terminal_id)))
+    except (ValueError, TypeError, AttributeError):
+        return ORGANIZATION_SCOPE
+
+
+def _get_version(organization_id) -> Optional[str]:
+    """Текущая версия стоп-листа организации; None — кэш недоступен."""
+    key = _version_key(organization_id)
+    try:
+        version = cache.get(key)
+        if version is None:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+            version = cache.get(key)
+        return version
+    except Exception as e:
+        logger.warning(f"Кэш стоп-листа недоступен (version): {e}")
+        return None
+
+
+def _load(organization_id, scope: str) -> FrozenSet:
+    """Множество из БД. Терминал не из этой организации — стоп-лист всей организации."""
+    from apps.organizations.models import Terminal
+
+    stop_list = StopList.objects.filter(organization_id=organization_id)
+    if scope != ORGANIZATION_SCOPE and Terminal.objects.filter(
+        terminal_id=scope, organization_id=organization_id
+    ).exists():
+        stop_list = stop_list.filter(terminal_id=scope)
+    return frozenset(stop_list.values_list('product_id', flat=True))
+
+
+def _remember(organization_id, scope: str, version: str, pks: FrozenSet) -> None:
+    if len(_local) >= _LOCAL_MAX_ENTRIES:
+        _local.clear()
+    _local[(str(organization_id), scope)] = (version, pks)
+
+
+def blocked_product_pks(organization_id, terminal_id=None) -> FrozenSet:
+    """Product.pk в стоп-листе терминала terminal_id (или всей организации, если терминал не задан/не найден)."""
+    scope = _scope(terminal_id)
+    version = _get_version(organization_id)
+    if version is None:
+        return _load(organization_id, scope)
+
+    local = _local.get((str(organization_id), scope))
+    if local is not None and local[0] == version:
+        return local[1]
+
+    key = _entry_key(organization_id, version, scope)
+    try:
+        pks = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Кэш стоп-листа недоступен (get): {e}")
+        pks = None
+    if pks is None:
+        pks = _load(organization_id, scope)
+        try:
+            cache.set(key, pks, timeout=_ttl())
+        except Exception as e:
+            logger.warning(f"Кэш стоп-листа недоступен (set): {e}")
+    _remember(organization_id, scope, version, pks)
+    return pks
+
+
+def is_blocked(product_pk, organization_id, terminal_id=None) -> bool:
+    return product_pk in blocked_product_pks(organization_id, terminal_id)
+
+
+def _bump_version(organization_id) -> Optional[str]:
+    version = uuid.uuid4().hex
+    try:
+        cache.set(_version_key(organization_id), version, timeout=None)
+    except Exception as e:
+        logger.warning(f"Кэш стоп-листа недоступен (invalidate): {e}")
+        return None
+    return version
+
+
+def invalidate_stop_list(organization_id) -> None:
+    """Новая версия индекса организации после коммита: множества пересоберутся при следующем чтении."""
+    if organization_id is None:
+        return
+    transaction.on_commit(lambda: _bump_version(organization_id))
+
+
+def update_terminal_index(organization_id, terminal_id, product_pks: Iterable) -> None:
+    """
+    После коммита синхронизации: новая версия индекса организации и готовое множество терминала
+    (остальные области, в т.ч. вся организация, пересоберутся при следующем чтении).
+    """
+    if organization_id is None:
+        return
+    pks = frozenset(product_pks)
+    scope = _scope(terminal_id)
+
+    def _update():
+        version = _bump_version(organization_id)
+        if version is None:
+            return
+        try:
+            cache.set(_entry_key(organization_id, version, scope), pks, timeout=_ttl())
+        except Exception as e:
+            logger.warning(f"Кэш стоп-листа недоступен (set): {e}")
+
+    transaction.on_commit(_update)
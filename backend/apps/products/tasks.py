@@ -1,12 +1,14 @@
 import logging
 from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
 from celery import shared_task
 from django.utils import timezone
 from django.conf import settings
-from django.db.models import Q, Max
+from django.db import transaction
+from django.db.models import Q
 
 from apps.organizations.models import Terminal
-from apps.iiko_integration.services import StopListSyncService, IikoAPIException
+from apps.iiko_integration.services import StopListSyncService
 
 logger = logging.getLogger(__name__)
 
@@ -54,23 +56,28 @@ def is_global_sync_allowed() -> bool:
     return is_time_in_working_window(start, end)
 
 
-def is_working_time(terminal: Terminal) -> bool:
-    """
-    Проверяет, находится ли текущее время сервера (TIME_ZONE, например +5) в рабочем времени терминала.
-    Если у терминала не задано working_hours — используется глобальное окно из настроек
-    (STOP_LIST_SYNC_WORKING_START / STOP_LIST_SYNC_WORKING_END), чтобы не слать запросы ночью.
-    """
+def _terminal_window(terminal: Terminal):
+    """Рабочее окно терминала ('HH:mm', 'HH:mm'): свои working_hours или глобальное окно; (None, None) — без ограничений."""
     start_time = None
     end_time = None
     if terminal.working_hours:
         start_time = terminal.working_hours.get('start')
         end_time = terminal.working_hours.get('end')
     if not start_time or not end_time:
-        # Нет своих часов — используем глобальное окно (по умолчанию 08:00–23:59)
         start_time = getattr(settings, 'STOP_LIST_SYNC_WORKING_START', None)
         end_time = getattr(settings, 'STOP_LIST_SYNC_WORKING_END', None)
-        if not start_time or not end_time:
-            return True
+    return start_time, end_time
+
+
+def is_working_time(terminal: Terminal) -> bool:
+    """
+    Проверяет, находится ли текущее время сервера (TIME_ZONE, например +5) в рабочем времени терминала.
+    Если у терминала не задано working_hours — используется глобальное окно из настроек
+    (STOP_LIST_SYNC_WORKING_START / STOP_LIST_SYNC_WORKING_END), чтобы не слать запросы ночью.
+    """
+    start_time, end_time = _terminal_window(terminal)
+    if not start_time or not end_time:
+        return True
     try:
         return is_time_in_working_window(start_time, end_time)
     except Exception as e:
@@ -78,72 +85,108 @@ def is_working_time(terminal: Terminal) -> bool:
         return True
 
 
-def should_sync_stop_list(terminal: Terminal) -> bool:
+def next_window_start(start_str: str, end_str: str, at: datetime) -> datetime:
     """
-    Проверяет, нужно ли синхронизировать стоп-лист для терминала.
-    
-    Проверяет:
-    1. Терминал активен
-    2. Текущее время в рабочем времени терминала
-    3. Прошло ли достаточно времени с последнего обновления (по stop_list_interval_min)
-    
-    Args:
-        terminal: Терминал для проверки
-        
-    Returns:
-        bool: True если нужно синхронизировать, False иначе
-    """
-    # Проверяем, активен ли терминал
-    if not terminal.is_active:
-        return False
-    
-    # Проверяем рабочее время
-    if not is_working_time(terminal):
-        return False
-    
-    # Проверяем интервал обновления
-    interval_minutes = terminal.stop_list_interval_min or 30
-    
-    # Получаем последнее обновление стоп-листа для терминала
-    # Используем максимальное время updated_at из записей стоп-листа
-    from apps.products.models import StopList
-    last_update = StopList.objects.filter(
-        terminal=terminal
-    ).aggregate(
-        max_updated_at=Max('updated_at')
-    )['max_updated_at']
-    
-    # Если записей стоп-листа еще нет, нужно обновить
-    if not last_update:
-        return True
-    
-    # Проверяем, прошло ли достаточно времени с последнего обновления
-    time_since_update = timezone.now() - last_update
-    if time_since_update < timedelta(minutes=interval_minutes):
+    Ближайший момент не раньше at, попадающий в окно [start_str, end_str] (TIME_ZONE проекта):
+    at, если он уже в окне, иначе ближайшее начало окна.
+    """
+    if not start_str or not end_str:
+        return at
+    try:
+        start_minutes = _time_to_minutes(start_str)
+        end_minutes = _time_to_minutes(end_str)
+    except Exception as e:
+        logger.warning(f"Ошибка разбора рабочего окна [{start_str}-{end_str}]: {e}")
+        return at
+    local = timezone.localtime(at)
+    current_minutes = local.hour * 60 + local.minute
+    if start_minutes <= end_minutes:
+        in_window = start_minutes <= current_minutes <= end_minutes
+    else:
+        in_window = current_minutes >= start_minutes or current_minutes <= end_minutes
+    if in_window:
+        return at
+    window_start = local.replace(hour=start_minutes // 60, minute=start_minutes % 60, second=0, microsecond=0)
+    if window_start <= local:
+        window_start += timedelta(days=1)
+    return window_start
+
+
+def next_stop_list_sync_at(terminal: Terminal, now: Optional[datetime] = None) -> datetime:
+    """
+    Когда синхронизировать стоп-лист терминала в следующий раз: через stop_list_interval_min,
+    а если этот момент вне рабочего времени терминала или глобального окна — в начале ближайшего окна.
+    """
+    now = now or timezone.now()
+    due = now + timedelta(minutes=terminal.stop_list_effective_interval)
+    terminal_window = _terminal_window(terminal)
+    global_window = (
+        getattr(settings, 'STOP_LIST_SYNC_WORKING_START', None),
+        getattr(settings, 'STOP_LIST_SYNC_WORKING_END', None),
+    )
+    # Окна могут не совпадать: сдвигаем, пока момент не попадёт в оба (несколько шагов достаточно)
+    for _ in range(4):
+        shifted = next_window_start(*global_window, next_window_start(*terminal_window, due))
+        if shifted == due:
+            break
+        due = shifted
+    return due
+
+
+def _retry_delay(terminal: Terminal) -> timedelta:
+    """Повтор после ошибки iiko: не позже обычного интервала терминала."""
+    retry = timedelta(seconds=getattr(settings, 'STOP_LIST_SYNC_RETRY_DELAY', 300))
+    return min(retry, timedelta(minutes=terminal.stop_list_effective_interval))
+
+
+# Адаптивный интервал: доля проверок с изменениями (EWMA) выше верхнего порога — интервал сокращается,
+# ниже нижнего — увеличивается; между порогами остаётся прежним
+ADAPTIVE_TIGHTEN_RATE = 0.5
+ADAPTIVE_RELAX_RATE = 0.1
+ADAPTIVE_TIGHTEN_FACTOR = 0.5
+ADAPTIVE_RELAX_FACTOR = 1.5
+
+
+def _stop_list_changed(result: Dict[str, Any]) -> bool:
+    """Изменился ли стоп-лист терминала по итогу apply_stop_list_response."""
+    if result.get('skipped'):
         return False
-    
-    return True
+    return bool(result.get('created') or result.get('updated') or result.get('deleted_count'))
 
 
-def _group_terminals_by_organization(terminals):
-    """Группирует терминалы по организации (по organization_id). Возвращает dict[org_id, list[Terminal]]."""
-    by_org = {}
-    for t in terminals:
-        org_id = t.organization_id
-        if org_id not in by_org:
-            by_org[org_id] = []
-        by_org[org_id].append(t)
-    return by_org
+def adapt_stop_list_interval(terminal: Terminal, changed: bool) -> None:
+    """
+    Обновляет оценку частоты изменений стоп-листа и текущий интервал терминала (без сохранения).
+    В неадаптивном режиме ничего не делает: используется stop_list_interval_min.
+    """
+    if not terminal.stop_list_adaptive:
+        return
+    alpha = getattr(settings, 'STOP_LIST_ADAPTIVE_ALPHA', 0.3)
+    low = getattr(settings, 'STOP_LIST_ADAPTIVE_MIN_INTERVAL', 2)
+    high = getattr(settings, 'STOP_LIST_ADAPTIVE_MAX_INTERVAL', 60)
+    rate = alpha * (1.0 if changed else 0.0) + (1 - alpha) * (terminal.stop_list_change_rate or 0.0)
+    interval = terminal.stop_list_effective_interval
+    if rate > ADAPTIVE_TIGHTEN_RATE:
+        interval *= ADAPTIVE_TIGHTEN_FACTOR
+    elif rate < ADAPTIVE_RELAX_RATE:
+        interval *= ADAPTIVE_RELAX_FACTOR
+    terminal.stop_list_change_rate = round(rate, 4)
+    terminal.stop_list_effective_interval_min = max(low, min(high, round(interval)))
 
 
 @shared_task(bind=True, max_retries=3, default_retry_delay=60)
 def sync_all_terminals_stop_lists(self):
     """
-    Периодическая задача для автоматической синхронизации стоп-листов всех активных терминалов.
+    Планировщик синхронизации стоп-листов (Celery Beat, каждые STOP_LIST_SCHEDULER_INTERVAL секунд).
+    
+    Для каждого терминала хранится время следующей синхронизации (Terminal.stop_list_next_sync_at),
+    поэтому задача не обходит все терминалы, а выбирает по индексу только наступившие и ставит
+    одну задачу sync_organization_stop_lists на организацию. Выбранные терминалы сразу сдвигаются
+    на STOP_LIST_SYNC_LEASE секунд вперёд: следующий запуск планировщика их не возьмёт повторно,
+    а если воркер упадёт — они снова станут наступившими.
     
     Запросы отправляются только в рабочее время (часовой пояс сервера = TIME_ZONE, например +5).
     Вне глобального окна (STOP_LIST_SYNC_WORKING_START/END) задача сразу завершается без запросов.
-    Для каждого терминала дополнительно учитывается working_hours (или то же глобальное окно).
     """
     try:
         # Глобальная проверка: вне рабочего времени запросы не отправляем
@@ -153,63 +196,120 @@ def sync_all_terminals_stop_lists(self):
                 f"Синхронизация стоп-листов пропущена: вне рабочего времени "
                 f"(локально: {now_local.strftime('%H:%M')} {getattr(settings, 'TIME_ZONE', '')})"
             )
-            return {'synced': 0, 'skipped': 0, 'errors': 0, 'reason': 'outside_working_hours'}
-
-        # Только активные терминалы и активные организации с API-ключом
-        terminals = Terminal.objects.filter(
-            is_active=True,
-            organization__is_active=True,
-            organization__api_key__isnull=False
-        ).select_related('organization')
-        
-        # Синхронизация только для активных терминалов, прошедших проверки (время, интервал)
-        to_sync = [t for t in terminals if t.is_active and should_sync_stop_list(t)]
-        skipped_count = len(terminals) - len(to_sync)
-        synced_count = 0
-        error_count = 0
-        
-        # Группируем по организации: один запрос к API на организацию
-        by_org = _group_terminals_by_organization(to_sync)
-        
-        for org_id, org_terminals in by_org.items():
-            if not org_terminals:
-                continue
-            api_key = org_terminals[0].organization.api_key
-            if not api_key:
-                skipped_count += len(org_terminals)
-                continue
-            try:
-                service = StopListSyncService(api_key)
-                results = service.sync_stop_lists_for_terminals(org_terminals)
-                synced_count += len(results)
-                logger.info(
-                    f"Стоп-листы для организации (терминалов {len(org_terminals)}): "
-                    f"обработано {len(results)}"
-                )
-            except IikoAPIException as e:
-                error_count += len(org_terminals)
-                logger.error(
-                    f"Ошибка API iiko при синхронизации стоп-листов организации: {e}",
-                    exc_info=True
+            return {'dispatched': 0, 'organizations': 0, 'reason': 'outside_working_hours'}
+
+        now = timezone.now()
+        lease = timedelta(seconds=getattr(settings, 'STOP_LIST_SYNC_LEASE', 600))
+        by_org = {}
+        with transaction.atomic():
+            # Только активные терминалы активных организаций с API-ключом, у которых наступило время синхронизации
+            due = (
+                Terminal.objects.select_for_update(skip_locked=True)
+                .filter(
+                    Q(stop_list_next_sync_at__isnull=True) | Q(stop_list_next_sync_at__lte=now),
+                    is_active=True,
+                    organization__is_active=True,
+                    organization__api_key__isnull=False,
+                    organization__iiko_organization_id__isnull=False,
                 )
-            except Exception as e:
-                error_count += len(org_terminals)
-                logger.error(
-                    f"Неожиданная ошибка при синхронизации стоп-листов организации: {e}",
-                    exc_info=True
+                .exclude(organization__api_key='')
+                .values_list('terminal_id', 'organization_id')
+            )
+            for terminal_id, org_id in due:
+                by_org.setdefault(org_id, []).append(str(terminal_id))
+            if by_org:
+                Terminal.objects.filter(
+                    terminal_id__in=[tid for tids in by_org.values() for tid in tids]
+                ).update(stop_list_next_sync_at=now + lease)
+
+        for org_id, terminal_ids in by_org.items():
+            transaction.on_commit(
+                lambda org_id=org_id, terminal_ids=terminal_ids: sync_organization_stop_lists.delay(
+                    str(org_id), terminal_ids
                 )
-        
-        logger.info(
-            f"Завершена синхронизация стоп-листов: синхронизировано {synced_count}, "
-            f"пропущено {skipped_count}, ошибок {error_count}"
-        )
-        
-        return {
-            'synced': synced_count,
-            'skipped': skipped_count,
-            'errors': error_count
-        }
-        
+            )
+
+        dispatched = sum(len(tids) for tids in by_org.values())
+        if dispatched:
+            logger.info(
+                f"Планировщик стоп-листов: к синхронизации {dispatched} терминалов в {len(by_org)} организациях"
+            )
+        return {'dispatched': dispatched, 'organizations': len(by_org)}
+
     except Exception as exc:
         logger.error(f"Критическая ошибка в задаче sync_all_terminals_stop_lists: {exc}", exc_info=True)
         raise self.retry(exc=exc)
+
+
+@shared_task
+def sync_organization_stop_lists(organization_id: str, terminal_ids: List[str]):
+    """
+    Синхронизирует стоп-листы выбранных планировщиком терминалов одной организации:
+    один запрос get_stop_lists к iiko на организацию, затем применение к каждому терминалу.
+    Организации опрашиваются параллельно отдельными задачами на воркерах Celery, поэтому
+    запрос синхронный (IikoClient): в задаче он один, асинхронному клиенту нечего распараллеливать.
+    После синхронизации (или ошибки) каждому терминалу назначается время следующей;
+    в адаптивном режиме интервал перед этим подстраивается под то, изменился ли стоп-лист.
+    """
+    terminals = list(
+        Terminal.objects.filter(terminal_id__in=terminal_ids, organization_id=organization_id, is_active=True)
+        .select_related('organization')
+    )
+    if not terminals:
+        return {'synced': 0, 'skipped': 0, 'errors': 0}
+    organization = terminals[0].organization
+
+    # Терминалы вне своего рабочего времени не синхронизируем, только переносим на начало окна
+    to_sync = [t for t in terminals if is_working_time(t)]
+    skipped_count = len(terminals) - len(to_sync)
+    synced_count = 0
+    error_count = 0
+    failed = set()
+
+    if to_sync:
+        try:
+            service = StopListSyncService(organization.api_key)
+            api_response = service.client.get_stop_lists([organization.iiko_organization_id])
+            results = service.apply_stop_lists_for_terminals(to_sync, api_response)
+            synced_count = len(results)
+            changed = {r['terminal_id']: _stop_list_changed(r) for r in results}
+            for terminal in to_sync:
+                if str(terminal.terminal_id) in changed:
+                    adapt_stop_list_interval(terminal, changed[str(terminal.terminal_id)])
+            applied = set(changed)
+            failed = {t.terminal_id for t in to_sync if str(t.terminal_id) not in applied}
+            error_count = len(failed)
+        except Exception as e:
+            failed = {t.terminal_id for t in to_sync}
+            error_count = len(failed)
+            logger.error(
+                f"Ошибка API iiko при синхронизации стоп-листов организации {organization.org_name}: {e}"
+            )
+
+    now = timezone.now()
+    for terminal in terminals:
+        if terminal.terminal_id in failed:
+            terminal.stop_list_next_sync_at = now + _retry_delay(terminal)
+        else:
+            terminal.stop_list_next_sync_at = next_stop_list_sync_at(terminal, now)
+    Terminal.objects.bulk_update(
+        terminals, ['stop_list_next_sync_at', 'stop_list_change_rate', 'stop_list_effective_interval_min']
+    )
+
+    logger.info(
+        f"Стоп-листы организации {organization.org_name}: синхронизировано {synced_count}, "
+        f"пропущено {skipped_count}, ошибок {error_count}"
+    )
+    return {'synced': synced_count, 'skipped': skipped_count, 'errors': error_count}
+
+
+@shared_task
+def run_menu_import_job(job_id: str):
+    """
+    Фоновый импорт меню из iiko (MenuImportJob), ставится из load-menu.
+    Без автоповторов: ошибка сохраняется в задаче, пользователь запускает импорт заново.
+    """
+    from apps.products.menu_import import run_menu_import
+
+    result = run_menu_import(job_id)
+    return {'job_id': job_id, 'done': result is not None}
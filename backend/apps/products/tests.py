@@ -0,0 +1,81 @@
+"""
+Регрессия N+1 в каталоге: список продуктов, быстрое меню и меню сайта должны делать
+одинаковое число запросов при любом размере каталога.
+"""
+import uuid
+
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from apps.organizations.models import Organization, Terminal
+from apps.products.models import FastMenuGroup, FastMenuItem, Menu, Product, ProductCategory, StopList
+from apps.products.views import FastMenuGroupPublicViewSet, ProductViewSet
+from apps.users.models import Role, User
+from apps.website.views import WebsiteMenuView
+
+SMALL, LARGE = 10, 40
+
+
+def _catalog(size):
+    """Организация с активным меню из size продуктов; каждый пятый — в стоп-листе терминала."""
+    org = Organization.objects.create(org_name=f'catalog-{uuid.uuid4().hex[:8]}', is_active=True)
+    terminal = Terminal.objects.create(terminal_id=uuid.uuid4(), organization=org, is_active=True)
+    menu = Menu.objects.create(organization=org, menu_name='catalog', is_active=True)
+    category = ProductCategory.objects.create(subgroup_id=uuid.uuid4(), subgroup_name='C', menu=menu)
+    products = Product.objects.bulk_create([
+        Product(
+            product_id=uuid.uuid4(), menu=menu, organization=org, category=category,
+            product_name=f'p{i}', price=i, is_available=True,
+        )
+        for i in range(size)
+    ])
+    StopList.objects.bulk_create([
+        StopList(product=p, product_name=p.product_name, balance=0, terminal=terminal, organization=org)
+        for p in products[::5]
+    ])
+    group = FastMenuGroup.objects.create(name='g', organization=org)
+    FastMenuItem.objects.bulk_create([
+        FastMenuItem(group=group, product=p, order=i) for i, p in enumerate(products)
+    ])
+    role, _ = Role.objects.get_or_create(role_name=Role.CUSTOMER)
+    user = User.objects.create(username=f'catalog-{uuid.uuid4().hex[:8]}', role=role, organization=org)
+    return org, terminal, user
+
+
+def _viewset_call(view):
+    def call(org, terminal, user):
+        # ordering — в обход снимков catalog_cache: проверяется сборка каталога
+        request = APIRequestFactory().get('/', {'terminal_id': str(terminal.terminal_id), 'ordering': 'order_index'})
+        force_authenticate(request, user=user)
+        response = view(request)
+        response.render()
+        assert response.status_code == 200
+        assert response.data
+    return call
+
+
+def _website_call(org, terminal, user):
+    request = WebsiteMenuView().initialize_request(APIRequestFactory().get('/', {'org': str(org.org_id)}))
+    assert WebsiteMenuView()._build_menu(request, org, str(terminal.terminal_id))
+
+
+ENDPOINTS = {
+    'products': _viewset_call(ProductViewSet.as_view({'get': 'list'})),
+    'fast_menu': _viewset_call(FastMenuGroupPublicViewSet.as_view({'get': 'list'})),
+    'website_menu': _website_call,
+}
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('endpoint', ENDPOINTS)
+def test_catalog_query_count_does_not_grow_with_catalog(endpoint, django_assert_num_queries):
+    call = ENDPOINTS[endpoint]
+    small = _catalog(SMALL)
+    with CaptureQueriesContext(connection) as ctx:
+        call(*small)
+
+    large = _catalog(LARGE)
+    with django_assert_num_queries(len(ctx)):
+        call(*large)
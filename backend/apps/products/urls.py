@@ -3,7 +3,7 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     MenuViewSet, ProductCategoryViewSet, 
     ProductViewSet, ModifierViewSet, StopListViewSet,
-    FastMenuGroupViewSet, FastMenuGroupPublicViewSet
+    FastMenuGroupViewSet, FastMenuGroupPublicViewSet, CatalogEventsView, CatalogEventsTokenView
 )
 
 router = DefaultRouter()
@@ -28,4 +28,6 @@ urlpatterns = [
     path('', include(stop_list_router.urls)),
     path('', include(fast_menu_router.urls)),
     path('', include(fast_menu_public_router.urls)),
+    path('catalog/events/', CatalogEventsView.as_view(), name='catalog-events'),
+    path('catalog/events/token/', CatalogEventsTokenView.as_view(), name='catalog-events-token'),
 ]
@@ -4,12 +4,21 @@ from rest_framework.response import Response
 from rest_framework.exceptions import PermissionDenied, ValidationError
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import Q, Prefetch
+from django.conf import settings
 from django.db import transaction
 import logging
 import uuid
 from django.db.models.deletion import ProtectedError
 from django.db import IntegrityError
 from .models import Menu, ProductCategory, Product, Modifier, StopList, FastMenuGroup, FastMenuItem
+from apps.organizations.models import Terminal
+from .menu_versions import MenuRollbackError, activate_menu, rollback_menu
+from .catalog_cache import catalog_response, invalidate_catalog, normalize_terminal_id
+from .availability import CONTEXT_KEY as STOP_LIST_CONTEXT_KEY, StopListResolver
+from .stop_list_index import invalidate_stop_list
+from .catalog_events import channels_for_token, issue_stream_token, load_stream_token
+from core.events import sse_enabled, sse_response
+from rest_framework.views import APIView
 
 logger = logging.getLogger(__name__)
 from .serializers import (
@@ -53,7 +62,7 @@ class MenuViewSet(viewsets.ModelViewSet):
         # partial_update (toggle is_active) — только IsAuthenticated; объект проверяется в check_object_permissions
         if self.action == 'partial_update':
             return [permissions.IsAuthenticated()]
-        if self.action in ('update', 'destroy', 'create'):
+        if self.action in ('update', 'destroy', 'create', 'rollback'):
             return [permissions.IsAuthenticated(), IsSuperAdmin() | IsOrgAdmin()]
         return [permissions.IsAuthenticated()]
 
@@ -73,6 +82,7 @@ class MenuViewSet(viewsets.ModelViewSet):
         """Удаление меню каскадно (категории, продукты, модификаторы). Запрет при наличии заказов с блюдами из меню."""
         try:
             instance.delete()
+            invalidate_catalog(instance.organization_id)
         except ProtectedError:
             raise ValidationError(
                 'Невозможно удалить меню: есть заказы, в которых есть блюда из этого меню. '
@@ -90,9 +100,24 @@ class MenuViewSet(viewsets.ModelViewSet):
             )
 
     def perform_update(self, serializer):
+        # Включение меню — через activate_menu: переключение и перенос быстрого меню/стоп-листа одной транзакцией
+        activate = serializer.validated_data.get('is_active') is True and not serializer.instance.is_active
+        if activate:
+            serializer.validated_data.pop('is_active')
         instance = serializer.save()
-        if getattr(instance, 'is_active', False):
-            Menu.objects.filter(organization=instance.organization).exclude(pk=instance.pk).update(is_active=False)
+        if activate:
+            activate_menu(instance)
+        invalidate_catalog(instance.organization_id)
+
+    @action(detail=True, methods=['post'], url_path='rollback')
+    def rollback(self, request, menu_id=None):
+        """Откат на предыдущую версию меню (сохраняется при каждом импорте внешнего меню)."""
+        menu = self.get_object()
+        try:
+            previous = rollback_menu(menu)
+        except MenuRollbackError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(previous).data)
 
 
 class ProductCategoryViewSet(viewsets.ReadOnlyModelViewSet):
@@ -137,6 +162,23 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         if self.action == 'retrieve':
             return ProductDetailSerializer
         return ProductListSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context[STOP_LIST_CONTEXT_KEY] = StopListResolver.for_request(self.request)
+        return context
+
+    def list(self, request, *args, **kwargs):
+        """Каталог покупателя без фильтров — из снимка (catalog_cache) с ETag/304."""
+        user = request.user
+        if user.is_customer and user.organization_id and set(request.query_params) <= {'terminal_id'}:
+            build = super().list
+            return catalog_response(
+                request, 'products', user.organization_id,
+                lambda: build(request, *args, **kwargs).data,
+                terminal_id=normalize_terminal_id(request.query_params.get('terminal_id')),
+            )
+        return super().list(request, *args, **kwargs)
     
     def get_queryset(self):
         """
@@ -159,28 +201,10 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
         if user.is_customer:
             queryset = queryset.filter(is_available=True)
             
-            # Исключаем продукты из стоп-листа
-            if user.organization:
-                # Получаем terminal_id из query параметров
-                terminal_id = self.request.query_params.get('terminal_id')
-                
-                stop_list_query = StopList.objects.filter(
-                    organization=user.organization
-                )
-                
-                # Если указан terminal_id, фильтруем по нему
-                if terminal_id:
-                    try:
-                        from apps.organizations.models import Terminal
-                        terminal = Terminal.objects.get(terminal_id=terminal_id)
-                        stop_list_query = stop_list_query.filter(terminal=terminal)
-                    except (Terminal.DoesNotExist, ValueError):
-                        # Если terminal не найден, используем все стоп-листы организации
-                        pass
-                
-                # stop_list.product_id references Product.pk (Product.id)
-                stop_list_product_pks = stop_list_query.values_list('product_id', flat=True)
-                queryset = queryset.exclude(pk__in=stop_list_product_pks)
+            # Исключаем продукты из стоп-листа (терминал из terminal_id, иначе вся организация)
+            resolver = StopListResolver.for_request(self.request)
+            if resolver is not None:
+                queryset = queryset.exclude(pk__in=resolver.stopped_pks)
 
         if self.request.query_params.get('for_management') == '1' and (
             getattr(user, 'is_superadmin', False) or getattr(user, 'is_org_admin', False)
@@ -282,7 +306,24 @@ class StopListViewSet(viewsets.ModelViewSet):
         """Автоматическое заполнение product_name при создании"""
         product = serializer.validated_data.get('product')
         if product:
-            serializer.save(product_name=product.product_name)
+            instance = serializer.save(product_name=product.product_name)
+            self._stop_list_changed(instance.organization_id)
+
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        self._stop_list_changed(instance.organization_id)
+
+    def perform_destroy(self, instance):
+        organization_id = instance.organization_id
+        instance.delete()
+        self._stop_list_changed(organization_id)
+
+    @staticmethod
+    def _stop_list_changed(organization_id):
+        invalidate_catalog(organization_id, reason='stop_list')
+        invalidate_stop_list(organization_id)
+        # Ручная правка расходится с iiko: следующая синхронизация должна применить ответ, а не пропустить его
+        Terminal.reset_stop_list_digests(organization_id)
 
 
 class FastMenuGroupViewSet(viewsets.ModelViewSet):
@@ -361,9 +402,19 @@ class FastMenuGroupViewSet(viewsets.ModelViewSet):
                     pass
         
         if organization:
-            serializer.save(organization=organization)
+            instance = serializer.save(organization=organization)
         else:
-            serializer.save()
+            instance = serializer.save()
+        invalidate_catalog(instance.organization_id)
+
+    def perform_update(self, serializer):
+        instance = serializer.save()
+        invalidate_catalog(instance.organization_id)
+
+    def perform_destroy(self, instance):
+        organization_id = instance.organization_id
+        instance.delete()
+        invalidate_catalog(organization_id)
     
     @action(detail=True, methods=['put', 'patch'], url_path='items')
     def update_items(self, request, pk=None):
@@ -413,6 +464,7 @@ class FastMenuGroupViewSet(viewsets.ModelViewSet):
                         )
                     )
                 FastMenuItem.objects.bulk_create(items)
+                invalidate_catalog(group.organization_id)
                 serializer = self.get_serializer(group)
                 return Response(serializer.data)
         except Exception as e:
@@ -428,7 +480,7 @@ class FastMenuGroupPublicViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = FastMenuGroup.objects.filter(is_active=True).prefetch_related(
         Prefetch(
             'items',
-            queryset=FastMenuItem.objects.select_related('product', 'product__category')
+            queryset=FastMenuItem.objects.select_related('product', 'product__category', 'product__menu')
                 .prefetch_related(
                     Prefetch(
                         'product__modifiers',
@@ -454,4 +506,62 @@ class FastMenuGroupPublicViewSet(viewsets.ReadOnlyModelViewSet):
         if not user.is_superadmin and user.organization:
             queryset = queryset.filter(organization=user.organization)
         
-        return queryset
\ No newline at end of file
+        return queryset
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context[STOP_LIST_CONTEXT_KEY] = StopListResolver.for_request(self.request)
+        return context
+
+    def list(self, request, *args, **kwargs):
+        """Группы быстрого меню организации — из снимка (catalog_cache) с ETag/304."""
+        user = request.user
+        if not user.is_superadmin and user.organization_id and set(request.query_params) <= {'terminal_id'}:
+            build = super().list
+            return catalog_response(
+                request, 'fast_menu', user.organization_id,
+                lambda: build(request, *args, **kwargs).data,
+                terminal_id=normalize_terminal_id(request.query_params.get('terminal_id')),
+            )
+        return super().list(request, *args, **kwargs)
+
+
+class CatalogEventsView(APIView):
+    """
+    GET /api/catalog/events/?token=<токен из POST /api/catalog/events/token/>[&terminal_id=<uuid>]
+    Поток SSE изменений каталога (catalog_events): разница стоп-листа терминала и события каталога
+    организации. Без terminal_id — стоп-листы всех терминалов токена.
+    EventSource не передаёт Authorization, поэтому подписка — по короткоживущему токену;
+    просроченный токен — 401, клиент запрашивает новый.
+    """
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+
+    def get(self, request):
+        payload = load_stream_token(request.query_params.get('token') or '')
+        if payload is None:
+            return Response({'error': 'Недействительный токен подписки'}, status=status.HTTP_401_UNAUTHORIZED)
+        channels = channels_for_token(payload, normalize_terminal_id(request.query_params.get('terminal_id')))
+        if channels is None:
+            return Response({'error': 'Терминал недоступен'}, status=status.HTTP_403_FORBIDDEN)
+        return sse_response(request, channels, client_key=f"user:{payload['u']}")
+
+
+class CatalogEventsTokenView(APIView):
+    """
+    POST /api/catalog/events/token/ — токен подписки на события каталога.
+    enabled = false — события выключены (EVENTS_SSE_ENABLED): клиент перепроверяет каталог по ETag.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        if not sse_enabled():
+            return Response({'enabled': False})
+        token = issue_stream_token(request.user)
+        if token is None:
+            return Response({'error': 'Организация не определена'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'enabled': True,
+            'token': token,
+            'expires_in': getattr(settings, 'CATALOG_EVENTS_TOKEN_TTL', 60 * 60),
+        })
@@ -14,7 +14,9 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from django.shortcuts import get_object_or_404
 
 from apps.organizations.models import Organization, Terminal
-from apps.products.models import Menu, ProductCategory, Product, StopList
+from apps.products.catalog_cache import catalog_response, normalize_terminal_id
+from apps.products.stop_list_index import blocked_product_pks
+from apps.products.models import Menu, ProductCategory, Product
 from apps.products.serializers import ProductCategorySerializer, ProductListSerializer, ProductDetailSerializer
 from apps.users.models import User, Role
 from .models import WebsiteStyles
@@ -117,7 +119,15 @@ class WebsiteMenuView(APIView):
         if err:
             return err
 
-        terminal_id = request.query_params.get('terminal_id')
+        # Снимок на организацию и терминал; пересобирается после синхронизации меню/стоп-листа
+        terminal_id = normalize_terminal_id(request.query_params.get('terminal_id'))
+        return catalog_response(
+            request, 'website', org.pk,
+            lambda: self._build_menu(request, org, terminal_id),
+            terminal_id=terminal_id,
+        )
+
+    def _build_menu(self, request, org, terminal_id):
         terminal = None
         if terminal_id:
             try:
@@ -135,7 +145,7 @@ class WebsiteMenuView(APIView):
         ).first()
 
         if not active_menu:
-            return Response({
+            return {
                 'organization': {
                     'org_id': str(org.org_id),
                     'org_name': org.org_name,
@@ -146,7 +156,7 @@ class WebsiteMenuView(APIView):
                 'terminals': [],
                 'categories': [],
                 'products': [],
-            })
+            }
 
         categories = ProductCategory.objects.filter(
             menu=active_menu
@@ -158,15 +168,9 @@ class WebsiteMenuView(APIView):
             is_available=True
         ).select_related('category').prefetch_related('modifiers').order_by('order_index', 'product_name')
 
-        stop_list_pks = StopList.objects.filter(
-            organization=org
-        ).values_list('product_id', flat=True)
-        if terminal:
-            stop_list_pks = StopList.objects.filter(
-                organization=org,
-                terminal=terminal
-            ).values_list('product_id', flat=True)
-        products_qs = products_qs.exclude(pk__in=stop_list_pks)
+        stop_list_pks = blocked_product_pks(org.pk, terminal.terminal_id if terminal else None)
+        if stop_list_pks:
+            products_qs = products_qs.exclude(pk__in=stop_list_pks)
 
         terminals = [
             {
@@ -177,7 +181,7 @@ class WebsiteMenuView(APIView):
             for t in Terminal.objects.filter(organization=org, is_active=True).select_related('city')
         ]
 
-        return Response({
+        return {
             'organization': {
                 'org_id': str(org.org_id),
                 'org_name': org.org_name,
@@ -193,7 +197,7 @@ class WebsiteMenuView(APIView):
                 many=True,
                 context={'request': request, 'website_public': True}
             ).data,
-        })
+        }
 
 
 class TelegramLoginWidgetView(APIView):
@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 from datetime import timedelta
+from urllib.parse import urlsplit
 from decouple import config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -203,20 +204,55 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Общий кэш (Redis) для всех gunicorn/celery процессов: токены iiko и т.п.
+# По умолчанию — тот же Redis, что у Celery, но отдельная база (/1): в URL брокера меняется
+# только путь, пароль и параметры (?ssl_cert_reqs=...) сохраняются. Для других схем
+# (unix-сокет и т.п.) REDIS_CACHE_URL нужно задать явно.
+_broker_url = urlsplit(CELERY_BROKER_URL)
+if _broker_url.scheme in ('redis', 'rediss'):
+    REDIS_CACHE_URL = config('REDIS_CACHE_URL', default=_broker_url._replace(path='/1').geturl())
+else:
+    REDIS_CACHE_URL = config('REDIS_CACHE_URL')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_CACHE_URL,
+        'KEY_PREFIX': 'tgdelivery',
+    }
+}
+
+# Интервал пакетного опроса статусов заказов в iiko, секунд (используется и расписанием ниже)
+ORDER_STATUS_POLL_INTERVAL = config('ORDER_STATUS_POLL_INTERVAL', default=30.0, cast=float)
+
 # Celery Beat Schedule - периодические задачи
 CELERY_BEAT_SCHEDULE = {
     'sync-stop-lists': {
         'task': 'apps.products.tasks.sync_all_terminals_stop_lists',
-        'schedule': 300.0,  # Каждые 5 минут проверяем терминалы и обновляем стоп-листы
+        # Планировщик: ставит синхронизацию терминалов, у которых наступило stop_list_next_sync_at
+        'schedule': config('STOP_LIST_SCHEDULER_INTERVAL', default=60.0, cast=float),
     },
     'run-mailings-scheduler': {
         'task': 'apps.organizations.tasks.run_mailings_scheduler',
         'schedule': 60.0,  # Каждую минуту проверяем отложенные рассылки
     },
+    'dispatch-order-outbox': {
+        'task': 'apps.orders.tasks.dispatch_order_outbox',
+        # Очередь отправки заказов в iiko: новые заказы, повторы и записи, не поставленные из-за сбоя брокера
+        'schedule': config('ORDER_OUTBOX_DISPATCH_INTERVAL', default=10.0, cast=float),
+    },
     'smart-retry-and-backup-orders': {
         'task': 'apps.orders.tasks.smart_retry_and_backup_orders_task',
         'schedule': 120.0,  # Каждые 120 секунд: умный повтор InProgress и резервный вебхук
     },
+    'poll-order-statuses': {
+        'task': 'apps.orders.tasks.poll_order_statuses_task',
+        # Пакетный опрос статусов незавершённых заказов (одна задача на организацию)
+        'schedule': ORDER_STATUS_POLL_INTERVAL,
+    },
+    'sync-iiko-reference-data': {
+        'task': 'apps.organizations.tasks.sync_iiko_reference_data',
+        'schedule': 3600.0,  # Каждый час: терминальные группы, типы оплаты и скидки всех организаций
+    },
 }
 
 # Стоп-лист: глобальное «рабочее» окно (часовой пояс сервера = TIME_ZONE, например Asia/Almaty +5).
@@ -224,6 +260,14 @@ CELERY_BEAT_SCHEDULE = {
 # Формат: 'HH:mm'. Если не задано — проверка не выполняется (поведение по умолчанию).
 STOP_LIST_SYNC_WORKING_START = config('STOP_LIST_SYNC_WORKING_START', default='08:00')
 STOP_LIST_SYNC_WORKING_END = config('STOP_LIST_SYNC_WORKING_END', default='23:59')
+# Терминалы, отданные планировщиком в задачу, не выбираются повторно столько секунд (если воркер упал — возьмутся снова)
+STOP_LIST_SYNC_LEASE = config('STOP_LIST_SYNC_LEASE', default=600, cast=int)
+# Повтор синхронизации терминала после ошибки iiko (секунды, не больше stop_list_interval_min)
+STOP_LIST_SYNC_RETRY_DELAY = config('STOP_LIST_SYNC_RETRY_DELAY', default=300, cast=int)
+# Адаптивный интервал стоп-листа (Terminal.stop_list_adaptive): границы в минутах и вес последней проверки
+STOP_LIST_ADAPTIVE_MIN_INTERVAL = config('STOP_LIST_ADAPTIVE_MIN_INTERVAL', default=2, cast=int)
+STOP_LIST_ADAPTIVE_MAX_INTERVAL = config('STOP_LIST_ADAPTIVE_MAX_INTERVAL', default=60, cast=int)
+STOP_LIST_ADAPTIVE_ALPHA = config('STOP_LIST_ADAPTIVE_ALPHA', default=0.3, cast=float)
 
 # CORS Configuration
 CORS_ALLOW_ALL_ORIGINS = True
@@ -239,6 +283,78 @@ TELEGRAM_CONTACT_SECRET = config('TELEGRAM_CONTACT_SECRET', default='')
 # iiko API
 IIKO_API_BASE_URL = config('IIKO_API_BASE_URL', default='https://api-ru.iiko.services/api/1')
 
+# HTTP-пул для iiko: одна keep-alive сессия на процесс (gunicorn/celery воркер),
+# чтобы не платить за TCP+TLS рукопожатие на каждый запрос.
+IIKO_HTTP_POOL_SIZE = config('IIKO_HTTP_POOL_SIZE', default=10, cast=int)
+# Повторы только для идемпотентных запросов на чтение (стоп-листы, меню, статусы);
+# создание заказа никогда не повторяется автоматически.
+IIKO_HTTP_MAX_RETRIES = config('IIKO_HTTP_MAX_RETRIES', default=2, cast=int)
+IIKO_HTTP_BACKOFF_FACTOR = config('IIKO_HTTP_BACKOFF_FACTOR', default=0.5, cast=float)
+# Access-токен iiko живёт ~60 минут; в общем кэше храним с запасом.
+IIKO_TOKEN_TTL = config('IIKO_TOKEN_TTL', default=50 * 60, cast=int)
+# Блокировка обновления токена после 401: время жизни и максимальное ожидание (сек).
+IIKO_TOKEN_LOCK_TTL = config('IIKO_TOKEN_LOCK_TTL', default=15, cast=int)
+IIKO_TOKEN_LOCK_WAIT = config('IIKO_TOKEN_LOCK_WAIT', default=10, cast=int)
+# Сколько организаций периодические задачи опрашивают одновременно (AsyncIikoClient).
+IIKO_ASYNC_CONCURRENCY = config('IIKO_ASYNC_CONCURRENCY', default=8, cast=int)
+# Фоновый импорт меню: через сколько секунд незавершённая задача считается зависшей
+# (воркер упал) и не мешает запустить новую; как часто писать прогресс в кэш.
+MENU_IMPORT_JOB_TIMEOUT = config('MENU_IMPORT_JOB_TIMEOUT', default=30 * 60, cast=int)
+MENU_IMPORT_PROGRESS_INTERVAL = config('MENU_IMPORT_PROGRESS_INTERVAL', default=0.5, cast=float)
+# Снимки каталога покупателя (apps.products.catalog_cache): сбрасываются при изменениях,
+# TTL только ограничивает жизнь неиспользуемых версий.
+CATALOG_CACHE_TTL = config('CATALOG_CACHE_TTL', default=10 * 60, cast=int)
+# Индекс стоп-листа (apps.products.stop_list_index): версия меняется при изменениях стоп-листа
+STOP_LIST_INDEX_TTL = config('STOP_LIST_INDEX_TTL', default=60 * 60, cast=int)
+# Push-события (core.events, SSE поверх Redis Streams). Соединение SSE занимает поток gunicorn
+# на EVENTS_SSE_MAX_DURATION секунд, затем клиент переподключается. Выключено по умолчанию:
+# синхронные воркеры (--workers 4, timeout 30 с) заняты открытыми экранами целиком. Включать
+# только с воркерами для долгих соединений (gthread/gevent, timeout > EVENTS_SSE_MAX_DURATION);
+# без SSE клиенты перепроверяют каталог по ETag.
+EVENTS_REDIS_URL = config('EVENTS_REDIS_URL', default=REDIS_CACHE_URL)
+EVENTS_SSE_ENABLED = config('EVENTS_SSE_ENABLED', default=False, cast=bool)
+# Одновременных SSE-соединений на клиента (пользователя из токена подписки)
+EVENTS_SSE_MAX_CONNECTIONS_PER_CLIENT = config('EVENTS_SSE_MAX_CONNECTIONS_PER_CLIENT', default=3, cast=int)
+# Срок жизни токена подписки на события каталога (apps.products.catalog_events), секунды
+CATALOG_EVENTS_TOKEN_TTL = config('CATALOG_EVENTS_TOKEN_TTL', default=60 * 60, cast=int)
+EVENTS_SSE_MAX_DURATION = config('EVENTS_SSE_MAX_DURATION', default=55, cast=int)
+EVENTS_SSE_HEARTBEAT = config('EVENTS_SSE_HEARTBEAT', default=15, cast=int)
+EVENTS_STREAM_MAXLEN = config('EVENTS_STREAM_MAXLEN', default=500, cast=int)
+EVENTS_STREAM_TTL = config('EVENTS_STREAM_TTL', default=24 * 60 * 60, cast=int)
+# Хаб событий процесса: ожидание одного XREAD (мс) и очередь соединения (переполнена — соединение
+# закрывается, клиент продолжает по Last-Event-ID)
+EVENTS_HUB_BLOCK_MS = config('EVENTS_HUB_BLOCK_MS', default=1000, cast=int)
+EVENTS_HUB_QUEUE_SIZE = config('EVENTS_HUB_QUEUE_SIZE', default=1000, cast=int)
+
+# Статусы заказов: пакетный опрос iiko (apps.orders.tasks.poll_order_statuses_task)
+ORDER_STATUS_BATCH_SIZE = config('ORDER_STATUS_BATCH_SIZE', default=100, cast=int)
+# Заказы старше этого окна больше не опрашиваются
+ORDER_STATUS_POLL_WINDOW_HOURS = config('ORDER_STATUS_POLL_WINDOW_HOURS', default=12, cast=int)
+# /orders/{id}/status/ идёт в iiko сам, только если последняя сверка старше этого (секунды)
+ORDER_STATUS_STALE_AFTER = config('ORDER_STATUS_STALE_AFTER', default=90, cast=int)
+# Срок жизни токена подписки на события заказов (apps.orders.order_events), секунды
+ORDER_EVENTS_TOKEN_TTL = config('ORDER_EVENTS_TOKEN_TTL', default=60 * 60, cast=int)
+
+# Очередь отправки заказов в iiko (apps.orders.outbox): пачка диспетчера, одновременных отправок
+# на организацию, аренда выданной записи (дольше худшего запроса к iiko с повторами), повторы.
+ORDER_OUTBOX_BATCH_SIZE = config('ORDER_OUTBOX_BATCH_SIZE', default=200, cast=int)
+ORDER_OUTBOX_ORG_CONCURRENCY = config('ORDER_OUTBOX_ORG_CONCURRENCY', default=4, cast=int)
+ORDER_OUTBOX_LEASE = config('ORDER_OUTBOX_LEASE', default=5 * 60, cast=int)
+ORDER_OUTBOX_RETRY_BASE = config('ORDER_OUTBOX_RETRY_BASE', default=30, cast=int)
+ORDER_OUTBOX_RETRY_MAX = config('ORDER_OUTBOX_RETRY_MAX', default=10 * 60, cast=int)
+ORDER_OUTBOX_MAX_ATTEMPTS = config('ORDER_OUTBOX_MAX_ATTEMPTS', default=8, cast=int)
+ORDER_OUTBOX_RETENTION_DAYS = config('ORDER_OUTBOX_RETENTION_DAYS', default=7, cast=int)
+
+# Пакетный расчет доставки (POST /terminals/calculate-delivery-costs/): не больше точек за запрос
+DELIVERY_BATCH_MAX_POINTS = config('DELIVERY_BATCH_MAX_POINTS', default=1000, cast=int)
+# Выбор терминала по координатам (POST /organizations/select-terminal/, заказ без terminal_id):
+# priority — зона с наивысшим приоритетом, cost — самая дешевая доставка
+DELIVERY_TERMINAL_STRATEGY = config('DELIVERY_TERMINAL_STRATEGY', default='priority')
+# Упрощение контуров зон при сохранении (PATCH /terminals/{id}/delivery-zones/, параметр simplify):
+# включено ли по умолчанию и допуск в метрах
+DELIVERY_ZONE_SIMPLIFY = config('DELIVERY_ZONE_SIMPLIFY', default=False, cast=bool)
+DELIVERY_ZONE_SIMPLIFY_TOLERANCE_M = config('DELIVERY_ZONE_SIMPLIFY_TOLERANCE_M', default=10.0, cast=float)
+
 # Security settings for production
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 USE_X_FORWARDED_HOST = True
@@ -0,0 +1,421 @@
+"""
+Push-события для клиентов (Server-Sent Events) поверх Redis Streams.
+
+Каждый канал — поток Redis (XADD с ограничением длины и временем жизни). Публикация —
+publish / publish_on_commit (после коммита, чтобы клиент не пришёл за ещё не видимыми данными).
+Подписчик получает события через sse_response: соединение держится не дольше
+EVENTS_SSE_MAX_DURATION секунд (сервер синхронный, поток gunicorn занят всё это время),
+после чего EventSource переподключается сам и передаёт Last-Event-ID — позиции во всех
+каналах подписки, поэтому события между соединениями не теряются. Если позиция уже
+вытеснена из потока, клиент получает событие reset и должен перезагрузить данные целиком.
+
+Потоки Redis читает EventHub — один фоновый поток на процесс с одним блокирующим XREAD
+по всем каналам, на которые есть подписчики; события раскладываются по очередям соединений.
+Число соединений с Redis и запросов XREAD не зависит от числа открытых SSE
+(тысячи подписчиков на узел — см. bench_order_events).
+
+Недоступность Redis не ломает публикующий код: событие теряется с предупреждением в логе.
+
+По умолчанию SSE выключены (EVENTS_SSE_ENABLED): каждое соединение держит воркер gunicorn,
+а при синхронных воркерах (Dockerfile, docker-compose.*) несколько открытых экранов занимают
+их все. Включать только на развертывании, которое держит долгие соединения (gthread с запасом
+потоков или gevent, timeout воркера больше EVENTS_SSE_MAX_DURATION); до тех пор клиенты
+перепроверяют данные по ETag. Число одновременных соединений одного клиента ограничено
+(EVENTS_SSE_MAX_CONNECTIONS_PER_CLIENT).
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, StreamingHttpResponse
+
+logger = logging.getLogger(__name__)
+
+STREAM_PREFIX = 'events'
+CURSOR_SEPARATOR = ','
+EMPTY_STREAM_ID = '0-0'
+
+_redis = None
+
+
+def get_redis():
+    """Общий клиент Redis процесса (пул соединений)."""
+    global _redis
+    if _redis is None:
+        import redis
+
+        url = getattr(settings, 'EVENTS_REDIS_URL', None) or settings.REDIS_CACHE_URL
+        _redis = redis.Redis.from_url(url, decode_responses=True, health_check_interval=30, socket_connect_timeout=2)
+    return _redis
+
+
+def channel_name(*parts) -> str:
+    return ':'.join([STREAM_PREFIX, *(str(p) for p in parts)])
+
+
+def publish(channel: str, event: str, data: Dict[str, Any]) -> Optional[str]:
+    """Добавляет событие в канал; возвращает id события или None, если Redis недоступен."""
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.xadd(
+            channel,
+            {'event': event, 'data': payload},
+            maxlen=getattr(settings, 'EVENTS_STREAM_MAXLEN', 500),
+            approximate=True,
+        )
+        pipe.expire(channel, getattr(settings, 'EVENTS_STREAM_TTL', 24 * 60 * 60))
+        event_id, _ = pipe.execute()
+        return event_id
+    except Exception as e:
+        logger.warning(f"Не удалось опубликовать событие {event} в {channel}: {e}")
+        return None
+
+
+def publish_on_commit(channel: str, event: str, data: Dict[str, Any]) -> None:
+    transaction.on_commit(lambda: publish(channel, event, data))
+
+
+def _parse_id(stream_id: str) -> Tuple[int, int]:
+    ms, _, seq = stream_id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+def decode_cursor(last_event_id: Optional[str], channels: Sequence[str]) -> Optional[List[str]]:
+    """Позиции в каналах из Last-Event-ID (в порядке channels); None — нет или не подходит к подписке."""
+    if not last_event_id:
+        return None
+    ids = last_event_id.split(CURSOR_SEPARATOR)
+    if len(ids) != len(channels):
+        return None
+    try:
+        for stream_id in ids:
+            _parse_id(stream_id)
+    except ValueError:
+        return None
+    return ids
+
+
+def encode_cursor(cursors: Dict[str, str], channels: Sequence[str]) -> str:
+    return CURSOR_SEPARATOR.join(cursors[ch] for ch in channels)
+
+
+def _stream_bounds(client, channels: Sequence[str]) -> List:
+    """Первое и последнее событие каждого канала: [first_0, last_0, first_1, last_1, ...]."""
+    pipe = client.pipeline(transaction=False)
+    for ch in channels:
+        pipe.xrange(ch, count=1)
+        pipe.xrevrange(ch, count=1)
+    return pipe.execute()
+
+
+def _last_id(bounds: List, i: int) -> str:
+    last = bounds[2 * i + 1]
+    return last[0][0] if last else EMPTY_STREAM_ID
+
+
+def _initial_cursors(bounds: List, channels: Sequence[str], resume) -> Tuple[Dict[str, str], bool]:
+    """
+    Стартовые позиции: продолжение с Last-Event-ID, иначе — конец каналов (только новые события).
+    bounds — из _stream_bounds; resume — позиции из decode_cursor; False — Last-Event-ID был, но не разобран.
+    Второе значение — True, если часть событий после Last-Event-ID уже вытеснена (нужен reset).
+    """
+    cursors, lost = {}, False
+    if resume is False:
+        # Last-Event-ID не подходит к подписке (например, изменился набор терминалов)
+        resume, lost = None, True
+    for i, ch in enumerate(channels):
+        first, last_id = bounds[2 * i], _last_id(bounds, i)
+        if resume is None:
+            cursors[ch] = last_id
+            continue
+        cursor = resume[i]
+        if first and _parse_id(cursor) < _parse_id(first[0][0]) and cursor != EMPTY_STREAM_ID:
+            lost = True
+        elif not first and cursor != EMPTY_STREAM_ID and _parse_id(cursor) > _parse_id(last_id):
+            # Поток истёк и создан заново (или пуст): позиция клиента из прошлой жизни канала
+            lost = True
+        cursors[ch] = last_id if lost else cursor
+    return cursors, lost
+
+
+def _format(event: str, data: str, event_id: Optional[str] = None) -> str:
+    lines = []
+    if event_id:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {data}')
+    return '\n'.join(lines) + '\n\n'
+
+
+class Subscription:
+    """Подписка одного SSE-соединения: очередь событий (канал, id, event, data) от EventHub."""
+
+    def __init__(self, channels: Sequence[str], maxsize: int):
+        self.channels = list(channels)
+        self.queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        # Очередь переполнена (клиент не успевает читать) или чтение Redis прервано:
+        # соединение дочитывает полученное и закрывается, клиент продолжит по Last-Event-ID
+        self.closed = False
+
+
+class EventHub:
+    """
+    Раздача событий подписчикам процесса из одного XREAD.
+
+    Для каждого канала хаб помнит позицию, до которой события уже розданы. Новый подписчик
+    получает из Redis только «хвост» между своей позицией (Last-Event-ID) и позицией хаба,
+    дальше события приходят из общего чтения.
+    """
+
+    def __init__(self, client=None):
+        self._client = client
+        self._lock = threading.Lock()
+        self._subscribers: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._positions: Dict[str, str] = {}
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.pid = os.getpid()
+
+    @property
+    def client(self):
+        return self._client if self._client is not None else get_redis()
+
+    def subscribe(self, channels: Sequence[str], resume=None) -> Tuple[Subscription, Dict[str, str], bool]:
+        """Подписка на каналы; возвращает подписку, стартовые позиции и признак reset (см. _initial_cursors)."""
+        client = self.client
+        subscription = Subscription(channels, getattr(settings, 'EVENTS_HUB_QUEUE_SIZE', 1000))
+        with self._lock:
+            bounds = _stream_bounds(client, channels)
+            cursors, lost = _initial_cursors(bounds, channels, resume)
+            for i, ch in enumerate(channels):
+                position = self._positions.setdefault(ch, _last_id(bounds, i))
+                cursor = cursors[ch]
+                if _parse_id(cursor) < _parse_id(position):
+                    # Пропущенное между соединениями: всё, что хаб уже раздал, берём из потока напрямую
+                    for entry_id, fields in client.xrange(ch, min=cursor, max=position):
+                        if entry_id != cursor:
+                            self._put(subscription, ch, entry_id, fields)
+                self._subscribers[ch].add(subscription)
+            self._ensure_thread()
+        self._wake.set()
+        return subscription, cursors, lost
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            for ch in subscription.channels:
+                subscribers = self._subscribers.get(ch)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[ch]
+                    self._positions.pop(ch, None)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len({id(s) for subscribers in self._subscribers.values() for s in subscribers})
+
+    def _put(self, subscription: Subscription, ch: str, entry_id: str, fields: Dict[str, str]) -> None:
+        if subscription.closed:
+            return
+        try:
+            subscription.queue.put_nowait(
+                (ch, entry_id, fields.get('event', 'message'), fields.get('data', '{}'))
+            )
+        except queue.Full:
+            subscription.closed = True
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='events-hub', daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        block_ms = getattr(settings, 'EVENTS_HUB_BLOCK_MS', 1000)
+        while True:
+            with self._lock:
+                streams = dict(self._positions)
+            if not streams:
+                self._wake.wait(timeout=5)
+                self._wake.clear()
+                continue
+            try:
+                response = self.client.xread(streams, count=100, block=block_ms)
+            except Exception as e:
+                logger.warning(f"Чтение потока событий прервано: {e}")
+                self._close_all()
+                time.sleep(1)
+                continue
+            if response:
+                self._dispatch(response)
+
+    def _dispatch(self, response) -> None:
+        with self._lock:
+            for ch, entries in response:
+                position = self._positions.get(ch)
+                if position is None:
+                    # Последний подписчик канала отключился, пока шло чтение
+                    continue
+                for entry_id, fields in entries:
+                    if _parse_id(entry_id) <= _parse_id(position):
+                        continue
+                    position = entry_id
+                    for subscription in self._subscribers[ch]:
+                        self._put(subscription, ch, entry_id, fields)
+                self._positions[ch] = position
+
+    def _close_all(self) -> None:
+        with self._lock:
+            for subscribers in self._subscribers.values():
+                for subscription in subscribers:
+                    subscription.closed = True
+                    try:
+                        # Разбудить соединение, ждущее события
+                        subscription.queue.put_nowait(None)
+                    except queue.Full:
+                        pass
+
+
+_hub: Optional[EventHub] = None
+_hub_lock = threading.Lock()
+
+
+def get_hub() -> EventHub:
+    """Хаб текущего процесса (после fork воркера gunicorn создаётся заново)."""
+    global _hub
+    with _hub_lock:
+        if _hub is None or _hub.pid != os.getpid():
+            _hub = EventHub()
+        return _hub
+
+
+def sse_enabled() -> bool:
+    return getattr(settings, 'EVENTS_SSE_ENABLED', False)
+
+
+def _acquire_connection(client_key: str) -> Optional[str]:
+    """
+    Место для соединения клиента: метка соединения или None, если лимит исчерпан.
+    Соединения — sorted set с временем истечения: оборванное без release освобождается само.
+    """
+    limit = getattr(settings, 'EVENTS_SSE_MAX_CONNECTIONS_PER_CLIENT', 3)
+    if limit <= 0:
+        return ''
+    key = channel_name('connections', client_key)
+    now = time.time()
+    ttl = getattr(settings, 'EVENTS_SSE_MAX_DURATION', 55) + 30
+    marker = uuid.uuid4().hex
+    try:
+        client = get_redis()
+        pipe = client.pipeline(transaction=False)
+        pipe.zremrangebyscore(key, '-inf', now)
+        pipe.zcard(key)
+        _, count = pipe.execute()
+        if count >= limit:
+            return None
+        pipe = client.pipeline(transaction=False)
+        pipe.zadd(key, {marker: now + ttl})
+        pipe.expire(key, ttl)
+        pipe.execute()
+    except Exception as e:
+        # Без Redis поток всё равно не откроется (stream_events завершится сразу)
+        logger.warning(f"Не удалось учесть соединение {client_key}: {e}")
+        return ''
+    return marker
+
+
+def _release_connection(client_key: str, marker: str) -> None:
+    if not marker:
+        return
+    try:
+        get_redis().zrem(channel_name('connections', client_key), marker)
+    except Exception as e:
+        logger.warning(f"Не удалось освободить соединение {client_key}: {e}")
+
+
+def stream_events(
+    channels: Sequence[str],
+    last_event_id: Optional[str] = None,
+    on_close: Optional[Callable[[], None]] = None,
+) -> Iterator[str]:
+    """
+    Генератор SSE-сообщений по каналам channels, завершается через EVENTS_SSE_MAX_DURATION.
+    on_close вызывается при завершении потока (освобождение места соединения).
+    """
+    try:
+        yield from _stream_events(channels, last_event_id)
+    finally:
+        if on_close is not None:
+            on_close()
+
+
+def _stream_events(channels: Sequence[str], last_event_id: Optional[str]) -> Iterator[str]:
+    max_duration = getattr(settings, 'EVENTS_SSE_MAX_DURATION', 55)
+    heartbeat = getattr(settings, 'EVENTS_SSE_HEARTBEAT', 15)
+    deadline = time.monotonic() + max_duration
+    hub = get_hub()
+
+    try:
+        resume = decode_cursor(last_event_id, channels)
+        if resume is None and last_event_id:
+            resume = False
+        subscription, cursors, lost = hub.subscribe(channels, resume)
+    except Exception as e:
+        logger.warning(f"Поток событий недоступен: {e}")
+        return
+    try:
+        # Интервал переподключения EventSource (мс)
+        yield f"retry: {getattr(settings, 'EVENTS_SSE_RETRY_MS', 3000)}\n\n"
+        if lost:
+            yield _format('reset', '{}', encode_cursor(cursors, channels))
+        else:
+            # Первое сообщение с позицией: переподключение без событий продолжит с неё
+            yield _format('ready', '{}', encode_cursor(cursors, channels))
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (subscription.closed and subscription.queue.empty()):
+                return
+            try:
+                item = subscription.queue.get(timeout=min(remaining, heartbeat))
+            except queue.Empty:
+                yield ': ping\n\n'
+                continue
+            if item is None:
+                return
+            ch, entry_id, event, data = item
+            cursors[ch] = entry_id
+            yield _format(event, data, encode_cursor(cursors, channels))
+    finally:
+        hub.unsubscribe(subscription)
+
+
+def sse_response(request, channels: Sequence[str], client_key: Optional[str] = None) -> HttpResponse:
+    """
+    Ответ text/event-stream по каналам для клиента client_key (например, пользователя из токена).
+    При выключенных событиях — 204 (EventSource не переподключается); сверх лимита соединений
+    клиента — 429. Без client_key соединения не ограничиваются.
+    """
+    if not sse_enabled():
+        return HttpResponse(status=204)
+    marker = _acquire_connection(client_key) if client_key else ''
+    if marker is None:
+        return HttpResponse(status=429)
+    last_event_id = request.META.get('HTTP_LAST_EVENT_ID') or request.GET.get('last_event_id')
+    response = StreamingHttpResponse(
+        stream_events(list(channels), last_event_id, on_close=lambda: _release_connection(client_key, marker)),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # nginx не должен буферизовать поток
+    response['X-Accel-Buffering'] = 'no'
+    return response
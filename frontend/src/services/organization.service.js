@@ -65,12 +65,46 @@ export const loadMenuGroups = async (selectedGroups) => {
     return response.data
 }
 
-export const loadMenuFromIiko = async (payload) => {
-    // payload: { external_menu_id?, price_category_id?, menu_name?, price_category_name? }
-    const response = await api.post('/organizations/load-menu/', payload)
+const MENU_IMPORT_POLL_INTERVAL_MS = 1500
+
+// Status of a background menu import job
+export const getMenuImportStatus = async (jobId) => {
+    const response = await api.get(`/organizations/load-menu/${jobId}/`)
     return response.data
 }
 
+// Импорт меню идёт в фоне: POST возвращает job_id (202, или 409 если импорт уже идёт),
+// затем опрашиваем статус до done/error. onProgress(job) — этап и processed/total.
+export const loadMenuFromIiko = async (payload, onProgress = null) => {
+    // payload: { external_menu_id?, price_category_id?, menu_name?, price_category_name?, full_resync? }
+    let job
+    try {
+        const response = await api.post('/organizations/load-menu/', payload)
+        job = response.data.job
+    } catch (err) {
+        if (err.response?.status !== 409 || !err.response.data?.job) throw err
+        job = err.response.data.job
+    }
+
+    while (job.status === 'pending' || job.status === 'running') {
+        if (onProgress) onProgress(job)
+        await new Promise((resolve) => setTimeout(resolve, MENU_IMPORT_POLL_INTERVAL_MS))
+        job = await getMenuImportStatus(job.job_id)
+    }
+    if (onProgress) onProgress(job)
+
+    if (job.status === 'error') {
+        throw { response: { data: { error: `Ошибка при загрузке меню из iiko: ${job.error || ''}` } } }
+    }
+    const unchanged = job.result?.status === 'unchanged'
+    return {
+        message: unchanged ? 'Меню актуально, изменений в iiko нет' : 'Меню успешно загружено из iiko',
+        success: true,
+        result: job.result,
+        job
+    }
+}
+
 // Get menus list (for_management=1 returns all menus for org)
 export const getMenus = async (forManagement = false) => {
     const params = forManagement ? { for_management: '1' } : {}
@@ -112,10 +146,19 @@ export const syncTerminalStopList = async (terminalId) => {
 }
 
 // Update delivery zones for terminal
-export const updateTerminalDeliveryZones = async (terminalId, deliveryZones) => {
-    const response = await api.patch(`/terminals/${terminalId}/delivery-zones/`, {
+// options.simplify / options.simplifyToleranceM - simplify zone contours on the server
+// (tolerance in meters; stats are returned in each zone's `simplification`)
+export const updateTerminalDeliveryZones = async (terminalId, deliveryZones, options = {}) => {
+    const payload = {
         delivery_zones_conditions: deliveryZones
-    })
+    }
+    if (options.simplify !== undefined) {
+        payload.simplify = options.simplify
+    }
+    if (options.simplifyToleranceM) {
+        payload.simplify_tolerance_m = options.simplifyToleranceM
+    }
+    const response = await api.patch(`/terminals/${terminalId}/delivery-zones/`, payload)
     return response.data
 }
 
@@ -135,6 +178,32 @@ export const calculateDeliveryCost = async (terminalId, latitude, longitude, ord
     return response.data
 }
 
+// Calculate delivery cost for many points (e.g. saved addresses) across terminals
+// Returns { terminal_ids, results } where results[i][j] is for points[i] and terminal_ids[j]
+export const calculateDeliveryCosts = async (terminalIds, points, orderAmount = 0) => {
+    const response = await api.post('/terminals/calculate-delivery-costs/', {
+        terminal_ids: terminalIds,
+        points,
+        order_amount: orderAmount
+    })
+    return response.data
+}
+
+// Pick the terminal for delivery coordinates across the organization's delivery zones
+// Returns { terminal_id, terminal_name, cost, zone_name, zone_found, ..., candidates }
+export const selectDeliveryTerminal = async (latitude, longitude, orderAmount = 0, strategy = null) => {
+    const payload = {
+        latitude,
+        longitude,
+        order_amount: orderAmount
+    }
+    if (strategy) {
+        payload.strategy = strategy
+    }
+    const response = await api.post('/organizations/select-terminal/', payload)
+    return response.data
+}
+
 // Get cities list
 export const getCities = async (organizationId = null) => {
     const params = {}
@@ -155,6 +224,7 @@ export default {
     loadPaymentTypesFromIiko,
     getExternalMenus,
     loadMenuFromIiko,
+    getMenuImportStatus,
     getMenus,
     updateMenu,
     deleteMenu,
@@ -166,5 +236,7 @@ export default {
     updateTerminalDeliveryZones,
     toggleTerminalActive,
     getCities,
-    calculateDeliveryCost
+    calculateDeliveryCost,
+    calculateDeliveryCosts,
+    selectDeliveryTerminal
 }
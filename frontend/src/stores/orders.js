@@ -193,6 +193,86 @@ export const useOrdersStore = defineStore('orders', () => {
         }
     }
 
+    let orderEvents = null
+    let orderEventsRetry = null
+    let adminEvents = false
+
+    const sameOrder = (order, orderId) => order && (order.order_id || order.id) === orderId
+
+    /**
+     * Перечитать заказ после события: в событии только статус, без status_display и деталей
+     */
+    async function refreshOrder(orderId) {
+        try {
+            const response = await api.get(`/orders/${orderId}/`)
+            if (sameOrder(currentOrder.value, orderId)) {
+                currentOrder.value = response.data
+            }
+            const index = orders.value.findIndex(o => sameOrder(o, orderId))
+            if (index !== -1) {
+                orders.value[index] = { ...orders.value[index], ...response.data }
+            } else if (adminEvents) {
+                orders.value.unshift(response.data)
+            }
+        } catch (err) {
+            console.error('Refresh order error:', err)
+        }
+    }
+
+    /**
+     * Подписка на смену статусов заказов (SSE) вместо опроса /status/.
+     * admin = true — новые заказы организации добавляются в список.
+     */
+    async function subscribeOrderEvents({ admin = false, onReset = null } = {}) {
+        unsubscribeOrderEvents()
+        if (typeof EventSource === 'undefined') return
+        adminEvents = admin
+
+        let token
+        try {
+            const response = await api.post('/orders/events/token/')
+            // События выключены на сервере (EVENTS_SSE_ENABLED) — без подписки, данные по загрузке экрана
+            if (!response.data.enabled) return
+            token = response.data.token
+        } catch (err) {
+            console.error('Order events token error:', err)
+            return
+        }
+
+        const source = new EventSource(`${api.defaults.baseURL}/orders/events/?token=${encodeURIComponent(token)}`)
+        orderEvents = source
+        source.addEventListener('order_status', (event) => {
+            const data = JSON.parse(event.data)
+            const known = sameOrder(currentOrder.value, data.order_id) ||
+                orders.value.some(o => sameOrder(o, data.order_id))
+            if (known || (admin && !data.previous_status)) {
+                refreshOrder(data.order_id)
+            }
+        })
+        // Часть событий пропущена (долгий разрыв) — список целиком
+        source.addEventListener('reset', () => {
+            if (onReset) onReset()
+        })
+        source.onerror = () => {
+            // Токен истёк (401), лимит соединений (429) или события выключены (204):
+            // EventSource сам не переподключается
+            if (source.readyState === EventSource.CLOSED && orderEvents === source) {
+                orderEventsRetry = setTimeout(() => subscribeOrderEvents({ admin, onReset }), 30000)
+            }
+        }
+    }
+
+    function unsubscribeOrderEvents() {
+        if (orderEventsRetry) {
+            clearTimeout(orderEventsRetry)
+            orderEventsRetry = null
+        }
+        if (orderEvents) {
+            orderEvents.close()
+            orderEvents = null
+        }
+    }
+
     /**
      * Загрузить типы оплаты для организации
      */
@@ -241,6 +321,8 @@ export const useOrdersStore = defineStore('orders', () => {
         fetchPaymentTypes,
         clearCurrentOrder,
         repeatOrder,
+        subscribeOrderEvents,
+        unsubscribeOrderEvents,
         lastStatusCheck
     }
 })
\ No newline at end of file
@@ -177,12 +177,13 @@ export const useOrganizationStore = defineStore('organization', () => {
     /**
      * Load menu from iiko (nomenclature or external with price category)
      * payload: { external_menu_id?, price_category_id?, menu_name?, price_category_name? }
+     * Импорт выполняется в фоне; промис завершается, когда задача done/error.
      */
-    async function loadMenuFromIiko(payload = {}) {
+    async function loadMenuFromIiko(payload = {}, onProgress = null) {
         loading.value = true
         error.value = null
         try {
-            const result = await organizationService.loadMenuFromIiko(payload)
+            const result = await organizationService.loadMenuFromIiko(payload, onProgress)
             return result
         } catch (err) {
             console.error('Load menu from iiko error:', err)
@@ -2,6 +2,10 @@ import { defineStore } from 'pinia'
 import { ref, computed } from 'vue'
 import api from '@/services/api'
 
+// Опрос каталога по ETag, когда событий нет; повторная подписка после закрытия потока (мс)
+const CATALOG_POLL_INTERVAL = 60000
+const CATALOG_EVENTS_RETRY = 5 * 60000
+
 export const useProductsStore = defineStore('products', () => {
     // State
     const categories = ref([])
@@ -10,6 +14,10 @@ export const useProductsStore = defineStore('products', () => {
     const searchQuery = ref('')
     const loading = ref(false)
     const error = ref(null)
+    const currentTerminalId = ref(null)
+    let catalogEvents = null
+    let catalogEventsRetry = null
+    let catalogPolling = null
 
     // Getters
     const availableProducts = computed(() => {
@@ -65,6 +73,7 @@ export const useProductsStore = defineStore('products', () => {
             if (terminalId) {
                 params.terminal_id = terminalId
             }
+            if (!forManagement) currentTerminalId.value = terminalId
 
             const response = await api.get('/products/', { params })
             products.value = response.data.results || response.data
@@ -98,6 +107,88 @@ export const useProductsStore = defineStore('products', () => {
         }
     }
 
+    // Изменения каталога с сервера (SSE): стоп-лист терминала патчим на месте, остальное — перезапрос по ETag.
+    // События выключены или недоступны — каталог перепроверяется по ETag раз в CATALOG_POLL_INTERVAL (обычно 304)
+    async function subscribeCatalogEvents() {
+        unsubscribeCatalogEvents()
+        const terminalId = currentTerminalId.value
+        if (!terminalId) return
+        const reload = () => {
+            fetchProducts(terminalId).catch(err => console.error('Catalog reload error:', err))
+        }
+
+        let token = null
+        if (typeof EventSource !== 'undefined') {
+            try {
+                const response = await api.post('/catalog/events/token/')
+                if (response.data.enabled) token = response.data.token
+            } catch (err) {
+                console.error('Catalog events token error:', err)
+            }
+        }
+        if (!token) {
+            startCatalogPolling(reload)
+            return
+        }
+
+        const source = new EventSource(
+            `${api.defaults.baseURL}/catalog/events/?token=${encodeURIComponent(token)}&terminal_id=${encodeURIComponent(terminalId)}`
+        )
+        catalogEvents = source
+        source.addEventListener('stop_list', (event) => {
+            const delta = JSON.parse(event.data)
+            if (delta.blocked?.length) {
+                const blocked = new Set(delta.blocked)
+                products.value = products.value.filter(p => !blocked.has(p.product_id || p.id))
+                updateCategoriesCounts()
+            }
+            // Вернувшихся в продажу продуктов в локальном каталоге нет — перезапрашиваем
+            if (delta.unblocked?.length) reload()
+        })
+        source.addEventListener('catalog', (event) => {
+            const { reason } = JSON.parse(event.data)
+            if (reason === 'menu') fetchCategories().catch(() => {})
+            reload()
+        })
+        // Часть событий пропущена (долгий разрыв) — каталог целиком
+        source.addEventListener('reset', reload)
+        source.onerror = () => {
+            // Токен истёк (401), лимит соединений (429) или события выключены (204): EventSource
+            // сам не переподключается — опрос по ETag, подписка заново позже
+            if (source.readyState === EventSource.CLOSED && catalogEvents === source) {
+                catalogEvents = null
+                startCatalogPolling(reload)
+                catalogEventsRetry = setTimeout(subscribeCatalogEvents, CATALOG_EVENTS_RETRY)
+            }
+        }
+    }
+
+    function startCatalogPolling(reload) {
+        stopCatalogPolling()
+        catalogPolling = setInterval(() => {
+            if (!document.hidden) reload()
+        }, CATALOG_POLL_INTERVAL)
+    }
+
+    function stopCatalogPolling() {
+        if (catalogPolling) {
+            clearInterval(catalogPolling)
+            catalogPolling = null
+        }
+    }
+
+    function unsubscribeCatalogEvents() {
+        stopCatalogPolling()
+        if (catalogEventsRetry) {
+            clearTimeout(catalogEventsRetry)
+            catalogEventsRetry = null
+        }
+        if (catalogEvents) {
+            catalogEvents.close()
+            catalogEvents = null
+        }
+    }
+
     function setSelectedCategory(id) {
         selectedCategory.value = id
     }
@@ -127,6 +218,8 @@ export const useProductsStore = defineStore('products', () => {
         refresh,
         fetchCategories,
         fetchProducts,
+        subscribeCatalogEvents,
+        unsubscribeCatalogEvents,
         setSelectedCategory,
         setSearchQuery,
         clearFilters